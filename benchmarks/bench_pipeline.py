@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+bench_pipeline
+Benchmarks of the capture -> compare -> save pipeline of shotlast.
+
+Synthetic clipboard contents are fed through ShotSaver.save_shot()
+with shotbackends.FakeBackend, so no display or real clipboard is needed:
+    - text from 1 KB to 16 MB,
+    - images from 640x480 up to 7680x4320 (8K),
+    - repeated (always the same item) and unique sequences.
+
+For each workload, it reports the latency percentiles of save_shot()
+and of the read, compare, encode and write stages, and the peak RSS
+of the process at the end.
+
+Usage:
+    python makepile.py bench
+    python benchmarks/bench_pipeline.py --quick
+    python benchmarks/bench_pipeline.py --encoder fast --filter image
+"""
+
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+# pylint: disable=line-too-long
+# pylint: disable=wrong-import-position
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+_SHOTLAST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "shotlast")
+sys.path.insert(0, os.path.normpath(_SHOTLAST_DIR))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+import shotbackends  # noqa: E402
+import shotlastmain  # noqa: E402
+import shotmetrics  # noqa: E402
+
+
+TEXT_SIZES = [1024, 1024 * 1024, 16 * 1024 * 1024]
+IMAGE_SIZES = [(640, 480), (1920, 1080), (3840, 2160), (7680, 4320)]
+
+
+def make_slide(size, seed):
+    """
+    Returns an RGB image that looks like a screenshot of a slide:
+    a light background with some colored boxes.
+    """
+    rnd = random.Random(seed)
+    image = Image.new("RGB", size, (250, 250, 250))
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    for _ in range(12):
+        x = rnd.randrange(width)
+        y = rnd.randrange(height)
+        box = (x, y, min(width, x + rnd.randrange(20, width // 3)), min(height, y + rnd.randrange(10, height // 6)))
+        draw.rectangle(box, fill=(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)))
+    return image
+
+
+def make_images(size, count, unique):
+    """
+    Returns count images, all the same if unique is False.
+    Unique images differ in a small patch, like successive screenshots.
+    """
+    base = make_slide(size, seed=size[0])
+    if not unique:
+        return [base]
+    images = []
+    for i in range(count):
+        image = base.copy()
+        ImageDraw.Draw(image).rectangle((10, 10, 60, 30), fill=(i % 256, (i * 7) % 256, 90))
+        images.append(image)
+    return images
+
+
+def make_texts(size, count, unique):
+    line = "2026-01-01 12:00:00 INFO shotlast benchmark line of a copied log\n"
+    base = (line * (size // len(line) + 1))[:size]
+    if not unique:
+        return [base]
+    return [str(i) + base[len(str(i)):] for i in range(count)]
+
+
+def format_ms(value):
+    if value is None:
+        return "-"
+    return f"{value * 1000:.2f}"
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size of this process in bytes,
+    None if it is not known (such as on Windows).
+    """
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_workload(name, make_saver, count):
+    """
+    Calls save_shot() count times on a new saver.
+    Returns a dict of results.
+    """
+    target_dir = tempfile.mkdtemp(prefix="shotlast_bench_")
+    try:
+        saver = make_saver(target_dir)
+        latencies = []
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(count):
+                saver.backend.step()
+                shot_start = time.perf_counter()
+                saver.save_shot()
+                latencies.append(time.perf_counter() - shot_start)
+            # waits for the background saves, so encode/write are complete.
+            saver.close()
+        total = time.perf_counter() - start
+        latencies.sort()
+        result = {
+            "name": name,
+            "count": count,
+            "total": total,
+            "shot": [shotmetrics.percentile(latencies, f) for f in (0.5, 0.9, 0.99)],
+        }
+        for stage in shotmetrics.STAGES:
+            result[stage] = saver.metrics.percentiles(stage)
+        return result
+    finally:
+        shutil.rmtree(target_dir, ignore_errors=True)
+
+
+def build_workloads(quick, encoder, name_filter):
+    """
+    Yields (name, make_saver, count).
+    """
+    count = 5 if quick else 20
+    text_sizes = TEXT_SIZES[:2] if quick else TEXT_SIZES
+    image_sizes = IMAGE_SIZES[:2] if quick else IMAGE_SIZES
+
+    for size in text_sizes:
+        for unique in (False, True):
+            name = f"text {shotlastmain.shotencoders.format_size(size)} {'unique' if unique else 'repeated'}"
+            if name_filter not in name:
+                continue
+            texts = make_texts(size, count, unique)
+
+            def make_saver(target_dir, texts=texts):
+                backend = shotbackends.FakeBackend([{"text": text} for text in texts])
+                return shotlastmain.create_shotter(target_dir, backend=backend, encoder=encoder)
+
+            yield name, make_saver, count
+
+    for size in image_sizes:
+        # big images are slow to generate and to encode.
+        image_count = max(3, count * 640 * 480 // (size[0] * size[1])) if size[0] > 1920 else count
+        for unique in (False, True):
+            label = f"{size[0]}x{size[1]} {'unique' if unique else 'repeated'}"
+            if name_filter not in "image " + label and name_filter not in "png bytes " + label:
+                continue
+            images = make_images(size, image_count, unique)
+
+            def make_windows_saver(target_dir, images=images):
+                backend = shotbackends.FakeBackend([{"image": image} for image in images], image_kind="pil")
+                return shotlastmain.create_shotter(target_dir, backend=backend, encoder=encoder)
+
+            if name_filter in "image " + label:
+                yield "image " + label, make_windows_saver, image_count
+            if name_filter not in "png bytes " + label:
+                continue
+
+            pngs = []
+            for image in images:
+                buffer = io.BytesIO()
+                image.save(buffer, "PNG", compress_level=1)
+                pngs.append({"image_data": {"image/png": buffer.getvalue()}})
+
+            def make_linux_saver(target_dir, pngs=pngs):
+                backend = shotbackends.FakeBackend(pngs, image_kind="data")
+                return shotlastmain.create_shotter(target_dir, backend=backend, encoder=encoder)
+
+            yield "png bytes " + label, make_linux_saver, image_count
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the shotlast capture pipeline.")
+    parser.add_argument('--quick', action='store_true', help="Fewer iterations and smaller contents.")
+    parser.add_argument('--encoder', choices=shotlastmain.shotencoders.PRESETS, default="default", help="Encoder preset to benchmark.")
+    parser.add_argument('--filter', default="", help="Only runs the workloads whose name contains this.")
+    args = parser.parse_args(arguments)
+
+    header = f"{'workload':32} {'n':>4} {'shot p50':>9} {'p90':>8} {'p99':>8} | {'compare p50':>11} {'p99':>8} | {'encode p50':>10} {'p99':>8} | {'write p50':>9} {'p99':>8} | {'total s':>7}"
+    print("latencies in ms, encoder:", args.encoder)
+    print(header)
+    print("-" * len(header))
+    for name, make_saver, count in build_workloads(args.quick, args.encoder, args.filter):
+        result = run_workload(name, make_saver, count)
+        shot = result["shot"]
+        compare = result["compare"][1]
+        encode = result["encode"][1]
+        write = result["write"][1]
+        print(f"{name:32} {count:>4} {format_ms(shot[0]):>9} {format_ms(shot[1]):>8} {format_ms(shot[2]):>8} | "
+              f"{format_ms(compare[0]):>11} {format_ms(compare[2]):>8} | "
+              f"{format_ms(encode[0]):>10} {format_ms(encode[2]):>8} | "
+              f"{format_ms(write[0]):>9} {format_ms(write[2]):>8} | {result['total']:>7.2f}")
+
+    rss = peak_rss()
+    print()
+    print("peak RSS:", shotlastmain.shotencoders.format_size(rss) if rss else "n/a")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
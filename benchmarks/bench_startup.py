@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+bench_startup
+Startup time of shotlast, and what it imports.
+
+Every run is a new Python process, so nothing is cached in sys.modules:
+    - "python": an empty interpreter, the baseline,
+    - "import": import shotlastmain,
+    - "headless start": shotlast --headless with an empty fake trace,
+      from the start of the process to the end of the session.
+The headless start must not import PySimpleGUI or tkinter, nor Pillow
+(no image was seen). The exit code is 1 if it does, or if the median
+headless start takes longer than --budget milliseconds.
+
+Usage:
+    python makepile.py bench
+    python benchmarks/bench_startup.py --quick
+    python benchmarks/bench_startup.py --budget 300
+"""
+
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+# pylint: disable=line-too-long
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+_SHOTLAST_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "shotlast"))
+
+# modules a headless start must not import.
+FORBIDDEN = ["PySimpleGUI", "tkinter", "PIL"]
+
+_REPORT_MODULES = "import json, sys; print(json.dumps([name for name in %r if name in sys.modules]))" % (FORBIDDEN,)
+
+SNIPPETS = {
+    "python": "pass",
+    "import": "import shotlastmain",
+    "headless start": (
+        "import sys, shotlastmain; "
+        "sys.argv = ['shotlast', '--headless', '--backend', 'fake', '--trace', sys.argv[1], sys.argv[2]]; "
+        "shotlastmain.main(); " + _REPORT_MODULES),
+}
+
+
+def run_snippet(snippet, arguments):
+    """
+    Returns (seconds, stdout) of a new Python process running snippet.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [_SHOTLAST_DIR, env.get("PYTHONPATH")]))
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-c", snippet] + arguments, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return time.perf_counter() - start, completed.stdout.decode("utf-8", errors="replace")
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the startup of shotlast.")
+    parser.add_argument('--quick', action='store_true', help="Fewer runs.")
+    parser.add_argument('--runs', type=int, default=10, help="Runs per measurement.")
+    parser.add_argument('--budget', type=float, default=500.0, help="Maximum median headless start, in milliseconds.")
+    args = parser.parse_args(arguments)
+    runs = 3 if args.quick else max(1, args.runs)
+
+    temp_dir = tempfile.mkdtemp(prefix="shotlast_bench_")
+    try:
+        trace = os.path.join(temp_dir, "empty.jsonl")
+        with open(trace, "w", encoding="utf-8"):
+            pass
+        target_dir = os.path.join(temp_dir, "target")
+        os.makedirs(target_dir)
+
+        header = f"{'measurement':16} {'n':>4} {'p50':>8} {'max':>8}"
+        print("times in ms, each run is a new process")
+        print(header)
+        print("-" * len(header))
+        medians = {}
+        imported = []
+        for name, snippet in SNIPPETS.items():
+            seconds = []
+            for _ in range(runs):
+                elapsed, output = run_snippet(snippet, [trace, target_dir])
+                seconds.append(elapsed)
+                if name == "headless start":
+                    imported = json.loads(output.strip().splitlines()[-1])
+            medians[name] = statistics.median(seconds) * 1000
+            print(f"{name:16} {runs:>4} {medians[name]:>8.1f} {max(seconds) * 1000:>8.1f}")
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    print()
+    status = 0
+    if imported:
+        print("headless start imported:", ", ".join(imported))
+        status = 1
+    if medians["headless start"] > args.budget:
+        print(f"headless start is over the budget of {args.budget:.0f} ms")
+        status = 1
+    if status == 0:
+        print(f"headless start is within the budget of {args.budget:.0f} ms")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
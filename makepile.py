@@ -150,6 +150,7 @@ def clean():
     shotlast/__pycache__
     tests/.pylint.d
     tests/__pycache__
+    benchmarks/__pycache__
     README.rst.html
     shotlast.spec
     """
@@ -229,6 +230,20 @@ def pyinstaller():
 #     pass
 
 
+def bench():
+    r"""
+    Runs the benchmarks of the capture -> compare -> save pipeline,
+    and of the startup time.
+    cmd = "python benchmarks/bench_pipeline.py"
+    cmd = "python benchmarks/bench_startup.py"
+    """
+    python = _get_python_command()
+    for script in ["bench_pipeline.py", "bench_startup.py"]:
+        cmd = f"{python} benchmarks/{script}"
+        print(cmd)
+        os.system(cmd)
+
+
 def linecount():
     r"""
     Counts lines in the project using cloc utility.
@@ -31,6 +31,15 @@ setuptools.setup(
         "pyperclip",
     ],
 
+    extras_require={
+        # for "--compress-text zstd"
+        "zstd": ["zstandard"],
+        # for "--compare region"
+        "region": ["numpy"],
+    },
+
+    python_requires=">=3.7",
+
     # https://pypi.org/classifiers/
     classifiers=[
         'Development Status :: 4 - Beta',
@@ -38,9 +47,9 @@ setuptools.setup(
         'License :: OSI Approved :: MIT License',
         'Operating System :: OS Independent',
         'Programming Language :: Python',
-        # 'Programming Language :: Python :: 3.4', pathlib requires 3.5
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        # asyncio.run, datetime.fromisoformat and
+        # http.server.ThreadingHTTPServer require 3.7
+        'Programming Language :: Python :: 3 :: Only',
         'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
         'Programming Language :: Python :: 3.9',
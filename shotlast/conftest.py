@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+Fixtures of the X11 tests: an Xvfb server, and a selection owner that
+answers TARGETS, TIMESTAMP and its targets, with INCR for large data.
+
+requires:
+    sudo apt-get install xvfb
+The X11 tests are skipped without it.
+"""
+
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+# pylint: disable=line-too-long
+# pylint: disable=redefined-outer-name
+
+import ctypes
+import os
+import select
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+
+# from X11/X.h and X11/Xatom.h
+_XA_ATOM = 4
+_XA_INTEGER = 19
+_PropModeReplace = 0
+_PropertyDelete = 1
+_SelectionRequest = 30
+_SelectionNotify = 31
+_PropertyNotify = 28
+_PropertyChangeMask = 1 << 22
+_NoEventMask = 0
+
+
+def _free_display_number():
+    for number in range(90, 200):
+        if not os.path.exists("/tmp/.X11-unix/X%d" % number) and not os.path.exists("/tmp/.X%d-lock" % number):
+            return number
+    raise RuntimeError("No free X display number.")
+
+
+@pytest.fixture(scope="session")
+def xvfb():
+    """
+    Starts Xvfb on a free display and points DISPLAY to it.
+    """
+    if not sys.platform.startswith("linux") or shutil.which("Xvfb") is None:
+        pytest.skip("Xvfb is not installed.")
+    number = _free_display_number()
+    process = subprocess.Popen(
+        ["Xvfb", ":%d" % number, "-screen", "0", "640x480x24", "-nolisten", "tcp"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while not os.path.exists("/tmp/.X11-unix/X%d" % number):
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill()
+            pytest.fail("Xvfb did not start.")
+        time.sleep(0.05)
+
+    old_display = os.environ.get("DISPLAY")
+    os.environ["DISPLAY"] = ":%d" % number
+    yield os.environ["DISPLAY"]
+    if old_display is None:
+        del os.environ["DISPLAY"]
+    else:
+        os.environ["DISPLAY"] = old_display
+    process.terminate()
+    process.wait(10)
+
+
+class XSelectionRequestEvent(ctypes.Structure):
+    _fields_ = [
+        ("type", ctypes.c_int),
+        ("serial", ctypes.c_ulong),
+        ("send_event", ctypes.c_int),
+        ("display", ctypes.c_void_p),
+        ("owner", ctypes.c_ulong),
+        ("requestor", ctypes.c_ulong),
+        ("selection", ctypes.c_ulong),
+        ("target", ctypes.c_ulong),
+        ("property", ctypes.c_ulong),
+        ("time", ctypes.c_ulong),
+    ]
+
+
+class SelectionOwner:
+    """
+    A selection owner on its own display connection, serving on a thread,
+    as a clipboard application would.
+    own() takes the selection with {target name: data bytes}.
+    Data larger than incr_size is sent with the INCR protocol, in
+    chunks of chunk_size.
+    """
+
+    def __init__(self, incr_size=256 * 1024, chunk_size=64 * 1024):
+        import shotx11  # pylint: disable=import-outside-toplevel
+
+        self.shotx11 = shotx11
+        self.incr_size = incr_size
+        self.chunk_size = chunk_size
+        self.xlib = xlib = shotx11.load_xlib()
+        xlib.XSetSelectionOwner.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_ulong]
+        xlib.XChangeProperty.argtypes = [
+            ctypes.c_void_p, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_ulong,
+            ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        xlib.XSendEvent.argtypes = [
+            ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int, ctypes.c_long, ctypes.POINTER(shotx11.XEvent)]
+
+        self.display = xlib.XOpenDisplay(None)
+        if not self.display:
+            raise OSError("Can not open X display: " + str(os.environ.get("DISPLAY")))
+        root = xlib.XDefaultRootWindow(self.display)
+        self.window = xlib.XCreateSimpleWindow(self.display, root, 0, 0, 1, 1, 0, 0, 0)
+        self.fd = xlib.XConnectionNumber(self.display)
+        self.lock = threading.Lock()
+        self.targets = {}  # atom -> (type atom, data bytes)
+        self.timestamp = 0
+        self.incr = None  # [requestor, property, type atom, data, offset]
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def atom(self, name):
+        return self.xlib.XInternAtom(self.display, name.encode("ascii"), 0)
+
+    def own(self, targets, timestamp=0, selection="CLIPBOARD"):
+        with self.lock:
+            self.targets = {self.atom(name): (self.atom(name), data) for name, data in targets.items()}
+            self.timestamp = timestamp
+        self.xlib.XSetSelectionOwner(self.display, self.atom(selection), self.window, 0)
+        self.xlib.XFlush(self.display)
+
+    def _change(self, window, prop, type_atom, data_format, data, count):
+        self.xlib.XChangeProperty(self.display, window, prop, type_atom, data_format, _PropModeReplace, data, count)
+
+    def _answer(self, request):
+        # obsolete clients ask with property None, the target is used then.
+        prop = request.property or request.target
+        with self.lock:
+            if request.target == self.atom("TARGETS"):
+                atoms = [self.atom("TARGETS"), self.atom("TIMESTAMP")] + list(self.targets)
+                self._change(request.requestor, prop, _XA_ATOM, 32, (ctypes.c_ulong * len(atoms))(*atoms), len(atoms))
+            elif request.target == self.atom("TIMESTAMP"):
+                self._change(request.requestor, prop, _XA_INTEGER, 32, (ctypes.c_ulong * 1)(self.timestamp), 1)
+            elif request.target in self.targets:
+                type_atom, data = self.targets[request.target]
+                if len(data) > self.incr_size:
+                    # PropertyNotify of the requestor tells when to send the next chunk.
+                    self.xlib.XSelectInput(self.display, request.requestor, _PropertyChangeMask)
+                    self.incr = [request.requestor, prop, type_atom, data, 0]
+                    self._change(request.requestor, prop, self.atom("INCR"), 32, (ctypes.c_ulong * 1)(len(data)), 1)
+                else:
+                    self._change(request.requestor, prop, type_atom, 8, data, len(data))
+            else:
+                prop = 0  # refused
+
+        notify = self.shotx11.XEvent()
+        notify.xselection.type = _SelectionNotify
+        notify.xselection.display = self.display
+        notify.xselection.requestor = request.requestor
+        notify.xselection.selection = request.selection
+        notify.xselection.target = request.target
+        notify.xselection.property = prop
+        notify.xselection.time = request.time
+        self.xlib.XSendEvent(self.display, request.requestor, 0, _NoEventMask, ctypes.byref(notify))
+        self.xlib.XFlush(self.display)
+
+    def _send_chunk(self, event):
+        if self.incr is None or event.state != _PropertyDelete:
+            return
+        requestor, prop, type_atom, data, offset = self.incr
+        if event.window != requestor or event.atom != prop:
+            return
+        chunk = data[offset:offset + self.chunk_size]
+        self._change(requestor, prop, type_atom, 8, chunk, len(chunk))
+        self.incr[4] = offset + len(chunk)
+        if not chunk:
+            # the zero length chunk ends the transfer.
+            self.xlib.XSelectInput(self.display, requestor, _NoEventMask)
+            self.incr = None
+        self.xlib.XFlush(self.display)
+
+    def _serve(self):
+        event = self.shotx11.XEvent()
+        while not self.stop.is_set():
+            if not self.xlib.XPending(self.display):
+                select.select([self.fd], [], [], 0.05)
+                continue
+            self.xlib.XNextEvent(self.display, ctypes.byref(event))
+            if event.type == _SelectionRequest:
+                self._answer(XSelectionRequestEvent.from_buffer(event))
+            elif event.type == _PropertyNotify:
+                self._send_chunk(event.xproperty)
+
+    def close(self):
+        self.stop.set()
+        self.thread.join(5)
+        self.xlib.XDestroyWindow(self.display, self.window)
+        self.xlib.XCloseDisplay(self.display)
+
+
+@pytest.fixture
+def selection_owner(xvfb):  # pylint: disable=unused-argument
+    owner = SelectionOwner()
+    yield owner
+    owner.close()
@@ -0,0 +1,394 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+shotarchive
+An append-only archive for the captures of shotlast.
+
+With "--sink archive", every capture is appended to a segment file
+instead of staying as its own file, so a week of captures is a handful
+of files instead of tens of thousands:
+
+    shotlast_000001.slog
+    shotlast_000002.slog
+    ...
+
+A segment is:
+    header : b"SHOTLOG1"
+    records: b"SREC", timestamp (double), data size (u64),
+             name size (u16), name (UTF-8), data, CRC32 of data (u32)
+    footer : the index of the records, then b"SIDX",
+             index offset (u64), record count (u32)
+
+The footer is written when a segment is full or shotlast exits.
+If shotlast crashes, the segment has no footer; the reader then scans
+the records, and stops at the first incomplete or corrupt one.
+Writes are fsync'ed in batches (every fsync_interval seconds), and the
+loose file of a capture is deleted only after its record is on disk.
+
+    shotlast export <dir>
+"""
+
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+# pylint: disable=line-too-long
+# pylint: disable=broad-except
+
+import argparse
+import bisect
+import collections
+import datetime
+import os
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+
+import click
+
+
+SEGMENT_MAGIC = b"SHOTLOG1"
+SEGMENT_PATTERN = re.compile(r"^shotlast_(\d{6})\.slog$")
+
+_RECORD_HEAD = struct.Struct("<4sdQH")  # b"SREC", timestamp, data size, name size
+_RECORD_TAIL = struct.Struct("<I")  # CRC32 of data
+_INDEX_ENTRY = struct.Struct("<dQQH")  # timestamp, record offset, data size, name size
+_FOOTER = struct.Struct("<4sQI")  # b"SIDX", index offset, record count
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+ArchiveEntry = collections.namedtuple(
+    "ArchiveEntry", ["timestamp", "segment", "offset", "size", "name"])
+
+
+def segment_file_name(directory, number):
+    return os.path.join(directory, f"shotlast_{number:06d}.slog")
+
+
+def list_segments(directory):
+    """
+    Returns the sorted list of (number, segment file name) in directory.
+    """
+    segments = []
+    for entry in os.scandir(directory):
+        match = SEGMENT_PATTERN.match(entry.name)
+        if match and entry.is_file():
+            segments.append((int(match.group(1)), entry.path))
+    return sorted(segments)
+
+
+def _fsync_directory(directory):
+    # makes a new file name durable, not possible (nor needed) on Windows.
+    if sys.platform.startswith("win32"):
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class ArchiveWriter:
+    """
+    Appends captures to segments in directory, see the module docstring.
+    Thread safe: the save workers store into it concurrently.
+
+    segment_size:
+        bytes, a new segment is started once a segment is larger.
+    fsync_interval:
+        seconds between two fsync calls. Until then, the loose files
+        of the captures are kept, so a crash loses nothing.
+    """
+
+    def __init__(self, directory, segment_size=256 * 1024 * 1024, fsync_interval=1.0):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        self.handle = None
+        self.segment_number = max([number for number, _ in list_segments(directory)], default=0)
+        self.entries = []  # (timestamp, offset, size, name bytes) of the open segment
+        self.dirty = False
+        self.pending_removals = []  # loose files to delete after the next fsync
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._sync_loop, name="shotlast-archive-sync", daemon=True)
+        self.thread.start()
+
+    def _open_segment(self):
+        # a new segment on every start: sealed segments are never modified.
+        self.segment_number += 1
+        file_name = segment_file_name(self.directory, self.segment_number)
+        self.handle = open(file_name, "xb")
+        self.handle.write(SEGMENT_MAGIC)
+        self.entries = []
+        _fsync_directory(self.directory)
+
+    def _seal_segment(self):
+        """
+        Writes the index footer and closes the segment.
+        """
+        index_offset = self.handle.tell()
+        for timestamp, offset, size, name in self.entries:
+            self.handle.write(_INDEX_ENTRY.pack(timestamp, offset, size, len(name)))
+            self.handle.write(name)
+        self.handle.write(_FOOTER.pack(b"SIDX", index_offset, len(self.entries)))
+        self._sync()
+        self.handle.close()
+        self.handle = None
+
+    def _sync(self):
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+        self.dirty = False
+        removals, self.pending_removals = self.pending_removals, []
+        for file_name in removals:
+            try:
+                os.remove(file_name)
+            except OSError as ex1:
+                print(repr(ex1))
+
+    def _sync_loop(self):
+        while not self.stopped.wait(self.fsync_interval):
+            with self.lock:
+                if self.handle is not None and self.dirty:
+                    try:
+                        self._sync()
+                    except OSError as ex1:
+                        print(repr(ex1))
+
+    def append_file(self, file_name, name, timestamp=None, remove=True):
+        """
+        Appends the content of file_name as name.
+        remove: delete file_name once the record is on disk.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        name_bytes = name.encode("utf-8")
+        with open(file_name, "rb") as source:
+            with self.lock:
+                if self.handle is None:
+                    self._open_segment()
+                size = os.fstat(source.fileno()).st_size
+                offset = self.handle.tell()
+                self.handle.write(_RECORD_HEAD.pack(b"SREC", timestamp, size, len(name_bytes)))
+                self.handle.write(name_bytes)
+                crc = 0
+                for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b""):
+                    crc = zlib.crc32(chunk, crc)
+                    self.handle.write(chunk)
+                self.handle.write(_RECORD_TAIL.pack(crc))
+                self.entries.append((timestamp, offset, size, name_bytes))
+                self.dirty = True
+                if remove:
+                    self.pending_removals.append(file_name)
+                if self.handle.tell() >= self.segment_size:
+                    self._seal_segment()
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        with self.lock:
+            if self.handle is not None:
+                self._seal_segment()
+
+
+class ArchiveSink:
+    """
+    Moves finished capture files of target_dir into an ArchiveWriter,
+    named by their path relative to target_dir.
+    """
+
+    def __init__(self, target_dir, segment_size=256 * 1024 * 1024, fsync_interval=1.0):
+        self.target_dir = target_dir
+        self.writer = ArchiveWriter(target_dir, segment_size, fsync_interval)
+
+    def store(self, full_file_name):
+        name = os.path.relpath(full_file_name, self.target_dir).replace(os.sep, "/")
+        self.writer.append_file(full_file_name, name)
+
+    def close(self):
+        self.writer.close()
+
+
+def _read_footer(handle, file_size):
+    """
+    Returns the list of ArchiveEntry (without segment) of a sealed
+    segment, None if it has no valid footer.
+    """
+    if file_size < len(SEGMENT_MAGIC) + _FOOTER.size:
+        return None
+    handle.seek(file_size - _FOOTER.size)
+    magic, index_offset, count = _FOOTER.unpack(handle.read(_FOOTER.size))
+    if magic != b"SIDX" or not len(SEGMENT_MAGIC) <= index_offset <= file_size - _FOOTER.size:
+        return None
+    handle.seek(index_offset)
+    entries = []
+    for _ in range(count):
+        head = handle.read(_INDEX_ENTRY.size)
+        if len(head) != _INDEX_ENTRY.size:
+            return None
+        timestamp, offset, size, name_size = _INDEX_ENTRY.unpack(head)
+        name = handle.read(name_size).decode("utf-8", errors="replace")
+        entries.append((timestamp, offset, size, name))
+    return entries
+
+
+def _scan_records(handle, file_size):
+    """
+    Returns the entries of an unsealed segment, reading the records one
+    by one. Stops at the first incomplete or corrupt record.
+    """
+    entries = []
+    offset = len(SEGMENT_MAGIC)
+    while offset + _RECORD_HEAD.size <= file_size:
+        handle.seek(offset)
+        magic, timestamp, size, name_size = _RECORD_HEAD.unpack(handle.read(_RECORD_HEAD.size))
+        end = offset + _RECORD_HEAD.size + name_size + size + _RECORD_TAIL.size
+        if magic != b"SREC" or end > file_size:
+            break
+        name = handle.read(name_size).decode("utf-8", errors="replace")
+        crc = 0
+        remaining = size
+        while remaining:
+            chunk = handle.read(min(COPY_CHUNK_SIZE, remaining))
+            crc = zlib.crc32(chunk, crc)
+            remaining -= len(chunk)
+        (expected,) = _RECORD_TAIL.unpack(handle.read(_RECORD_TAIL.size))
+        if crc != expected:
+            break
+        entries.append((timestamp, offset, size, name))
+        offset = end
+    return entries
+
+
+class ArchiveReader:
+    """
+    Random access to the captures of the segments in directory,
+    by timestamp.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.entries = []
+        self.recovered = []  # segments without a footer
+        for _, file_name in list_segments(directory):
+            file_size = os.path.getsize(file_name)
+            with open(file_name, "rb") as handle:
+                if handle.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+                    continue
+                entries = _read_footer(handle, file_size)
+                if entries is None:
+                    self.recovered.append(file_name)
+                    entries = _scan_records(handle, file_size)
+            for timestamp, offset, size, name in entries:
+                self.entries.append(ArchiveEntry(timestamp, file_name, offset, size, name))
+        self.entries.sort(key=lambda entry: entry.timestamp)
+        self.timestamps = [entry.timestamp for entry in self.entries]
+
+    def find(self, start=None, end=None):
+        """
+        Returns the entries with start <= timestamp < end,
+        None means no limit.
+        """
+        low = 0 if start is None else bisect.bisect_left(self.timestamps, start)
+        high = len(self.entries) if end is None else bisect.bisect_left(self.timestamps, end)
+        return self.entries[low:high]
+
+    def iter_data(self, entry):
+        """
+        Yields the content of the entry in chunks.
+        """
+        with open(entry.segment, "rb") as handle:
+            handle.seek(entry.offset + _RECORD_HEAD.size + len(entry.name.encode("utf-8")))
+            remaining = entry.size
+            while remaining:
+                chunk = handle.read(min(COPY_CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise EOFError("Truncated record: " + entry.name)
+                remaining -= len(chunk)
+                yield chunk
+
+    def read(self, entry) -> bytes:
+        return b"".join(self.iter_data(entry))
+
+
+def export_entry(reader, entry, out_dir):
+    """
+    Writes the entry as a file under out_dir, keeping its relative path,
+    with its capture time as the modification time.
+    Returns the name of the written file.
+    """
+    parts = [part for part in entry.name.split("/") if part not in ("", ".", "..")]
+    file_name = os.path.join(out_dir, *parts)
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    root, extension = os.path.splitext(file_name)
+    number = 1
+    while True:
+        try:
+            handle = open(file_name, "xb")
+            break
+        except FileExistsError:
+            number += 1
+            file_name = f"{root}_{number}{extension}"
+    with handle:
+        for chunk in reader.iter_data(entry):
+            handle.write(chunk)
+    os.utime(file_name, (entry.timestamp, entry.timestamp))
+    return file_name
+
+
+def parse_time(value):
+    """
+    Parses an ISO 8601 local time such as "2024-05-01" or
+    "2024-05-01T14:30", returns a timestamp.
+    """
+    return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def main(arguments=None):
+    """
+    shotlast export <dir> [--out OUT] [--since TIME] [--until TIME] [--list]
+    """
+    parser = argparse.ArgumentParser(prog="shotlast export", description="Unpacks the archive segments of a directory into individual files.")
+
+    help1 = "Directory with the shotlast_*.slog segments."
+    parser.add_argument('directory', help=help1)
+
+    help1 = "Directory to write the files to, the archive directory by default."
+    parser.add_argument('--out', help=help1, default=None)
+
+    help1 = 'Only the captures from this local time on, such as "2024-05-01T14:30".'
+    parser.add_argument('--since', type=parse_time, help=help1, default=None)
+
+    help1 = 'Only the captures before this local time.'
+    parser.add_argument('--until', type=parse_time, help=help1, default=None)
+
+    help1 = "Only lists the captures, nothing is written."
+    parser.add_argument('--list', action='store_true', help=help1)
+
+    args = parser.parse_args(arguments)
+
+    if not os.path.isdir(args.directory):
+        click.secho("Not a directory: " + str(args.directory), fg="red")
+        return 1
+
+    reader = ArchiveReader(args.directory)
+    for file_name in reader.recovered:
+        click.secho("no index footer, scanned: " + file_name, fg="yellow")
+    entries = reader.find(args.since, args.until)
+    out_dir = args.out or args.directory
+    for entry in entries:
+        moment = datetime.datetime.fromtimestamp(entry.timestamp).isoformat(sep=" ", timespec="seconds")
+        if args.list:
+            click.secho(f"{moment}  {entry.size:>12}  {entry.name}")
+        else:
+            file_name = export_entry(reader, entry, out_dir)
+            click.secho("exported: ", nl=False, fg="green")
+            click.secho(file_name, fg="green")
+    click.secho(f"{len(entries)} of {len(reader.entries)} captures.")
+    return 0
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+shotasync
+The asyncio core loop of shotlast.
+
+A capture goes through three stages, each one waiting on something
+different, so they run concurrently:
+    watch   : waits for a clipboard change (watcher.wait()) on its own
+              thread, and wakes the capture stage through a queue.
+    capture : reads the clipboard and compares the item with the previous
+              ones (ShotSaver.save_shot()) on its own thread, while the
+              next change is already being watched.
+    persist : encodes and writes the new items on the SaveQueue workers,
+              while the next item is already being captured.
+The queues between the stages are bounded: the wake queue holds a single
+wake up (any number of changes during a capture need one more check,
+not one each), the save queue holds --queue-depth captures.
+"""
+
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+# pylint: disable=line-too-long
+# pylint: disable=broad-except
+
+import asyncio
+import concurrent.futures
+import inspect
+
+
+class CapturePipeline:
+    """
+    Runs the watch and capture stages of a shotter (a ShotSaver or a
+    MultiSelectionSaver) in an asyncio event loop, until cancelled.
+    Owns the shotter and the watcher: both are closed when run() ends.
+
+    on_change:
+        optional, called with the shotter in the event loop after every
+        check that found something new; it can be a coroutine function.
+    poll_timeout:
+        longest wait (in seconds) of the watch thread, so a cancellation
+        is noticed quickly even if the clipboard never changes.
+    """
+
+    def __init__(self, shotter, watcher, on_change=None, poll_timeout=0.5):
+        self.shotter = shotter
+        self.watcher = watcher
+        self.on_change = on_change
+        self.poll_timeout = poll_timeout
+        self.stopping = False
+        self.wakes = None  # asyncio.Queue, created in the event loop
+        # one thread per stage: a ShotSaver is not thread safe, and
+        # wait() must not be blocked behind a capture.
+        # every wait() runs on the same watch thread, for the whole run:
+        # a watcher's window (shotwatch.WindowsWatcher) must belong to the
+        # thread that pumps its messages, so it is created there.
+        self.watch_executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="shotlast-watch")
+        self.capture_executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="shotlast-capture")
+
+    async def run(self):
+        """
+        Watches and captures until cancelled or until a stage fails.
+        Cancelling waits for the capture in progress and the pending
+        saves, then returns.
+        """
+        loop = asyncio.get_running_loop()
+        self.wakes = asyncio.Queue(maxsize=1)
+        # take whatever is already in the clipboard, then wait for changes.
+        self.wakes.put_nowait(True)
+        stages = [asyncio.ensure_future(self._watch(loop)),
+                  asyncio.ensure_future(self._capture(loop))]
+        try:
+            await asyncio.gather(*stages)
+        finally:
+            self.stopping = True
+            for stage in stages:
+                stage.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+            # the threads may still be in wait() or save_shot().
+            await asyncio.shield(loop.run_in_executor(None, self.close))
+
+    async def _watch(self, loop):
+        while not self.stopping:
+            changed = await loop.run_in_executor(self.watch_executor, self.watcher.wait, self.poll_timeout)
+            if changed and not self.wakes.full():
+                # a wake up is already queued, it will see this change too.
+                self.wakes.put_nowait(True)
+
+    async def _capture(self, loop):
+        while not self.stopping:
+            await self.wakes.get()
+            changed = await loop.run_in_executor(self.capture_executor, self.shotter.save_shot)
+            self.watcher.notify(changed)
+            if changed and self.on_change is not None:
+                try:
+                    result = self.on_change(self.shotter)
+                    if inspect.isawaitable(result):
+                        await result
+                except asyncio.CancelledError:  # pylint: disable=try-except-raise
+                    # on Python 3.7, CancelledError is still an Exception:
+                    # without this, the handler below would swallow a cancel.
+                    raise
+                except Exception as ex1:
+                    # a failing callback must not stop the captures.
+                    print(repr(ex1))
+
+    def close(self):
+        """
+        Waits for the stage threads, then closes the watcher and the
+        shotter (which waits for the pending saves).
+        """
+        self.watch_executor.shutdown(wait=True)
+        self.capture_executor.shutdown(wait=True)
+        try:
+            self.watcher.close()
+        finally:
+            self.shotter.close()
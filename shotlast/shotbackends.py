@@ -0,0 +1,579 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+shotbackends
+Clipboard backends for shotlast.
+
+A backend is the only part of shotlast that touches the clipboard:
+    PyperclipBackend : text only, any OS.
+    XclipBackend     : Linux, runs xclip.
+    X11Backend       : Linux, a persistent libX11 connection (shotx11).
+    WindowsBackend   : Windows, PIL.ImageGrab and pyperclip.
+    FakeBackend      : in-memory, replays a recorded clipboard trace,
+                       for tests and benchmarks on headless machines.
+"""
+
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+# pylint: disable=line-too-long
+
+import ctypes
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import shothash
+
+
+# texts are read and written in chunks of this size (in bytes).
+TEXT_CHUNK_SIZE = 256 * 1024
+
+# the X selections that can be watched, see --selection:
+#   CLIPBOARD: ctrl c, PRIMARY: selected text (middle click),
+#   SECONDARY: rarely used.
+SELECTIONS = ["CLIPBOARD", "PRIMARY", "SECONDARY"]
+
+# image targets, the cheapest to fetch and store first: compressed
+# formats are small to transfer, and PNG is stored without re-encoding
+# by the default encoder. Uncompressed BMP and TIFF come last.
+IMAGE_PREFERENCES = ["image/png", "image/jpeg", "image/webp", "image/gif", "image/tiff", "image/bmp"]
+
+
+def parse_image_formats(value):
+    """
+    Converts the value of --image-formats to a preference list.
+    >>> parse_image_formats("png,jpeg, bmp")
+    ['image/png', 'image/jpeg', 'image/bmp']
+    """
+    return [item if "/" in item else "image/" + item
+            for item in (item.strip().lower() for item in value.split(",")) if item]
+
+
+def choose_image_format(formats, preferences=None):
+    """
+    Returns the image target of formats to fetch, None if there is none.
+    Targets in preferences come first, in that order, then the other
+    "image/" targets in the order of the owner.
+    >>> choose_image_format(["TARGETS", "image/bmp", "image/tiff", "image/png"])
+    'image/png'
+    >>> choose_image_format(["image/x-icon", "image/bmp"], ["image/jpeg"])
+    'image/x-icon'
+    >>> choose_image_format(["UTF8_STRING"]) is None
+    True
+    """
+    if preferences is None:
+        preferences = IMAGE_PREFERENCES
+    images = [target for target in formats if target.startswith("image/")]
+    for preferred in preferences:
+        if preferred in images:
+            return preferred
+    return images[0] if images else None
+
+
+class ClipboardBackend:
+    """
+    The base class for clipboard backends.
+    Every method returns an "empty" value if the clipboard does not
+    contain that kind of item.
+    """
+
+    # short name, printed when shotlast starts.
+    name = "base"
+
+    # how images are delivered:
+    #   "pil": read_image() returns PIL images (ShotSaverForWindows).
+    #   "data": list_formats() and read_image_data() return encoded
+    #           image bytes, such as "image/png" (ShotSaverForLinux).
+    image_kind = "data"
+
+    # an optional shotmetrics.StageTimer, set by the ShotSaver.
+    metrics = None
+
+    def list_formats(self):
+        """
+        Returns the names of the formats in the clipboard,
+        such as ["TARGETS", "UTF8_STRING", "image/png"].
+        """
+        return []
+
+    def read_text(self):
+        """
+        Returns the text in the clipboard, or None.
+        """
+        return None
+
+    def iter_text(self, chunk_size=TEXT_CHUNK_SIZE):
+        """
+        Yields the text in the clipboard as UTF-8 bytes, in chunks.
+        Backends that can read the clipboard piece by piece override
+        this, so a large text is never held in memory at once.
+        """
+        text = self.read_text()
+        if text:
+            for start in range(0, len(text), chunk_size):
+                yield text[start:start + chunk_size].encode("utf-8")
+
+    def read_image(self):
+        """
+        Returns the image in the clipboard as a PIL image, or None.
+        """
+        return None
+
+    def read_image_data(self, target: str) -> bytes:  # pylint: disable=unused-argument
+        """
+        Returns the image in the clipboard encoded as target,
+        such as "image/png", or b"".
+        """
+        return b""
+
+    def read_image_data_and_digest(self, target: str):
+        """
+        Returns (read_image_data(target), its shothash content digest).
+        Backends that hash the data while reading it override this,
+        so it is not hashed a second time.
+        """
+        data = self.read_image_data(target)
+        return data, shothash.get_content_digest(data)
+
+    def read_files(self):
+        """
+        Returns the list of file names in the clipboard, or [].
+        """
+        return []
+
+    def change_token(self):
+        """
+        Returns a value that changes every time something is copied.
+        If it did not change, the clipboard does not need to be read.
+        None means unknown, so the clipboard must be read.
+        """
+        return None
+
+    def close(self):
+        """
+        Releases the resources of the backend.
+        """
+
+
+def iter_process_output(lst_arguments, chunk_size=256 * 1024):
+    """
+    Runs the process and yields its stdout in chunks, as they arrive.
+    stderr of the process is discarded.
+
+    requires:
+        import subprocess
+    """
+    with subprocess.Popen(lst_arguments,
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL) as process:
+        yield from iter(lambda: process.stdout.read(chunk_size), b"")
+
+
+def read_process_output(lst_arguments, chunk_size=256 * 1024):
+    """
+    Runs the process and reads its stdout through a pipe, in chunks.
+    Returns (output, digest):
+        output : bytes, the whole stdout of the process.
+        digest : shothash content digest of output, computed while reading.
+    stderr of the process is discarded.
+
+    requires:
+        import subprocess
+    """
+    hasher = shothash.new_content_hasher()
+    chunks = []
+    for chunk in iter_process_output(lst_arguments, chunk_size):
+        hasher.update(chunk)
+        chunks.append(chunk)
+    return b"".join(chunks), hasher.hexdigest()
+
+
+class PyperclipBackend(ClipboardBackend):
+    """
+    Text only backend, works everywhere pyperclip works.
+    """
+
+    name = "pyperclip"
+
+    def __init__(self):
+        import pyperclip  # pylint: disable=import-outside-toplevel
+        self.pyperclip = pyperclip
+
+    def read_text(self):
+        return self.pyperclip.paste()
+
+
+class XclipBackend(ClipboardBackend):
+    """
+    Reads an X selection by running xclip, one process per request.
+
+    requires:
+        sudo apt-get install xclip
+    """
+
+    name = "xclip"
+
+    def __init__(self, selection="CLIPBOARD"):
+        self.selection = selection
+
+    def _read(self, target):
+        """
+        Returns (output, digest) of xclip for the target, see read_process_output().
+        """
+        lst_arguments = ["xclip", "-selection", self.selection.lower(), "-t", target, "-o"]
+        if self.metrics is None:
+            return read_process_output(lst_arguments)
+        with self.metrics.time("subprocess"):
+            return read_process_output(lst_arguments)
+
+    def _run(self, target) -> bytes:
+        return self._read(target)[0]
+
+    def list_formats(self):
+        return self._run("TARGETS").decode("utf-8").splitlines()
+
+    def read_text(self):
+        output = self._run("UTF8_STRING")
+        if not output:
+            return None
+        return output.decode("utf-8", errors="replace")
+
+    def iter_text(self, chunk_size=TEXT_CHUNK_SIZE):
+        lst_arguments = ["xclip", "-selection", self.selection.lower(), "-t", "UTF8_STRING", "-o"]
+        yield from iter_process_output(lst_arguments, chunk_size)
+
+    def read_image_data(self, target: str) -> bytes:
+        return self._run(target)
+
+    def read_image_data_and_digest(self, target: str):
+        # hashed while xclip's output is read.
+        return self._read(target)
+
+    def change_token(self):
+        # TIMESTAMP is the time the current owner acquired the selection.
+        # some owners report 0 (CurrentTime), which never changes.
+        output = self._run("TIMESTAMP")
+        if not output.strip(b"0\0 \n"):
+            return None
+        return output
+
+
+class X11Backend(ClipboardBackend):
+    """
+    Reads an X selection through a shotx11.X11SelectionReader,
+    without starting any process.
+    reader:
+        an existing reader to share its display connection,
+        a new one is created if None.
+    """
+
+    name = "x11"
+
+    def __init__(self, selection="CLIPBOARD", reader=None):
+        import shotx11  # pylint: disable=import-outside-toplevel
+        self.selection = selection
+        self.owns_reader = reader is None
+        self.reader = reader or shotx11.X11SelectionReader()
+        self.token = None  # the result of the last change_token()
+        self.targets = []  # the last TARGETS of the owner
+        self.targets_token = None  # the change token of targets
+
+    def list_formats(self):
+        # TARGETS is a round trip to the owner application, so it is
+        # cached for the change token (owner and TIMESTAMP), such as when
+        # an image is checked again after an error. Without a real token,
+        # the same owner can offer other targets for every copy (a text,
+        # then an image), so TARGETS is asked every time.
+        if self.token is not None and self.token == self.targets_token:
+            return self.targets
+        self.targets = self.reader.get_targets(self.selection)
+        self.targets_token = self.token
+        return self.targets
+
+    def read_text(self):
+        output = self.reader.read(self.selection, "UTF8_STRING")
+        if output:
+            return output.decode("utf-8", errors="replace")
+        output = self.reader.read(self.selection, "STRING")
+        if output:
+            return output.decode("latin-1")
+        return None
+
+    def iter_text(self, chunk_size=TEXT_CHUNK_SIZE):
+        found = False
+        for chunk in self.reader.iter_read(self.selection, "UTF8_STRING"):
+            found = True
+            yield chunk
+        if not found:
+            for chunk in self.reader.iter_read(self.selection, "STRING"):
+                yield chunk.decode("latin-1").encode("utf-8")
+
+    def read_image_data(self, target: str) -> bytes:
+        return self.reader.read(self.selection, target)
+
+    def change_token(self):
+        # the owner window too: two applications can report the same
+        # TIMESTAMP. None if the owner does not report a real one.
+        self.token = None  # not a stale token if the request fails
+        timestamp = self.reader.get_timestamp(self.selection)
+        self.token = (self.reader.get_owner(self.selection), timestamp) if timestamp else None
+        return self.token
+
+    def close(self):
+        if self.owns_reader:
+            self.reader.close()
+
+
+class WindowsBackend(ClipboardBackend):
+    """
+    Windows backend:
+        PIL.ImageGrab for images and files,
+        pyperclip for text,
+        GetClipboardSequenceNumber() as the change token.
+    """
+
+    name = "windows"
+    image_kind = "pil"
+
+    def __init__(self):
+        from PIL import ImageGrab  # pylint: disable=import-outside-toplevel
+        import pyperclip  # pylint: disable=import-outside-toplevel
+        self.image_grab = ImageGrab
+        self.pyperclip = pyperclip
+        self.user32 = ctypes.WinDLL("user32")
+        self.user32.GetClipboardSequenceNumber.restype = ctypes.c_uint32
+        self.grab_token = None
+        self.grabbed = None
+
+    def _grab(self):
+        # grabclipboard() returns an image or a list of file names,
+        # grab once per clipboard change.
+        token = self.change_token()
+        if token != self.grab_token:
+            self.grabbed = self.image_grab.grabclipboard()
+            self.grab_token = token
+        return self.grabbed
+
+    def list_formats(self):
+        grabbed = self._grab()
+        if isinstance(grabbed, list):
+            return ["files"]
+        if grabbed is not None:
+            return ["image"]
+        return []
+
+    def read_text(self):
+        return self.pyperclip.paste()
+
+    def read_image(self):
+        grabbed = self._grab()
+        if grabbed is None or isinstance(grabbed, list):
+            return None
+        return grabbed
+
+    def read_files(self):
+        grabbed = self._grab()
+        if isinstance(grabbed, list):
+            return [item for item in grabbed if isinstance(item, str)]
+        return []
+
+    def change_token(self):
+        return self.user32.GetClipboardSequenceNumber()
+
+
+class FakeBackend(ClipboardBackend):
+    """
+    A scriptable, in-memory clipboard.
+    entries:
+        list of dicts, each one is the clipboard after a copy:
+            {"text": "hello"}
+            {"image": <PIL image>}
+            {"image_data": {"image/png": b"..."}}
+            {"files": ["a.txt", "b.txt"]}
+    Call step() to "copy" the next entry.
+    image_kind:
+        "pil" to deliver images like WindowsBackend, "data" like
+        the X11 backends. Images are converted when needed.
+    """
+
+    name = "fake"
+
+    def __init__(self, entries, image_kind="data", loop=True):
+        self.entries = list(entries)
+        self.image_kind = image_kind
+        self.loop = loop
+        self.position = -1
+
+    def step(self) -> bool:
+        """
+        Moves to the next entry. Returns False at the end of a
+        non looping trace.
+        """
+        if self.position + 1 >= len(self.entries):
+            if not self.loop:
+                return False
+            self.position = -1
+        self.position += 1
+        return True
+
+    def _entry(self):
+        if 0 <= self.position < len(self.entries):
+            return self.entries[self.position]
+        return {}
+
+    def list_formats(self):
+        entry = self._entry()
+        formats = ["TARGETS", "TIMESTAMP"]
+        if "text" in entry:
+            formats.append("UTF8_STRING")
+        formats.extend(entry.get("image_data", {}).keys())
+        if "image" in entry and "image_data" not in entry:
+            formats.append("image/png")
+        return formats
+
+    def read_text(self):
+        return self._entry().get("text")
+
+    def read_image(self):
+        entry = self._entry()
+        if "image" in entry:
+            return entry["image"]
+        for data in entry.get("image_data", {}).values():
+            from PIL import Image  # pylint: disable=import-outside-toplevel
+            import io  # pylint: disable=import-outside-toplevel
+            image = Image.open(io.BytesIO(data))
+            image.load()
+            return image
+        return None
+
+    def read_image_data(self, target: str) -> bytes:
+        entry = self._entry()
+        if target in entry.get("image_data", {}):
+            return entry["image_data"][target]
+        if "image" in entry and target == "image/png":
+            import io  # pylint: disable=import-outside-toplevel
+            buffer = io.BytesIO()
+            entry["image"].save(buffer, "PNG")
+            return buffer.getvalue()
+        return b""
+
+    def read_files(self):
+        return list(self._entry().get("files", []))
+
+    def change_token(self):
+        # every entry is a new copy, even if its content is the same.
+        return self.position
+
+    @classmethod
+    def from_trace(cls, file_name, **kwargs):
+        """
+        Loads a trace saved with save_trace(): a JSON object per line,
+            {"text": "hello"}
+            {"image": "relative/or/absolute/path.png"}
+            {"files": ["a.txt", "b.txt"]}
+        Image paths are relative to the trace file. Their bytes are
+        loaded as they are, with the MIME type of their extension.
+        """
+        base_dir = os.path.dirname(os.path.abspath(file_name))
+        entries = []
+        with open(file_name, "rt", encoding="utf8") as handle:
+            for line in handle:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                entry = {}
+                if "text" in record:
+                    entry["text"] = record["text"]
+                if "image" in record:
+                    image_file_name = os.path.join(base_dir, record["image"])
+                    extension = os.path.splitext(image_file_name)[1].lower().lstrip(".")
+                    extension = {"jpg": "jpeg", "tif": "tiff"}.get(extension, extension)
+                    with open(image_file_name, "rb") as image_handle:
+                        entry["image_data"] = {"image/" + extension: image_handle.read()}
+                if "files" in record:
+                    entry["files"] = list(record["files"])
+                entries.append(entry)
+        return cls(entries, **kwargs)
+
+
+def save_trace(records, file_name):
+    """
+    Writes a trace for FakeBackend.from_trace(), records are dicts with
+    "text", "image" (a file name) or "files" keys.
+    """
+    with open(file_name, "wt", encoding="utf8") as handle:
+        for record in records:
+            handle.write(json.dumps(record) + "\n")
+
+
+BACKENDS = ["auto", "x11", "xclip", "pyperclip", "windows", "fake"]
+
+
+def create_backend(name="auto", selection="CLIPBOARD", trace=None):
+    """
+    Returns a ClipboardBackend:
+        "auto": "windows" on Windows; "xclip" on Linux if it is
+                installed, "x11" otherwise.
+        "fake": replays the trace file, see FakeBackend.from_trace().
+        others: the backend of that name.
+    """
+    if name == "fake":
+        if not trace:
+            raise ValueError("The fake backend needs a trace file.")
+        return FakeBackend.from_trace(trace, loop=False)
+    if name == "pyperclip":
+        return PyperclipBackend()
+    if name == "windows":
+        return WindowsBackend()
+    if name == "xclip":
+        return XclipBackend(selection)
+    if name == "x11":
+        return X11Backend(selection)
+
+    # https://docs.python.org/3/library/sys.html#sys.platform
+    if sys.platform.startswith('win32'):
+        return WindowsBackend()
+    if sys.platform.startswith('linux'):
+        # xclip stays the default until the x11 backend has been tested
+        # on a real X server, see test_shotx11.py.
+        if shutil.which("xclip"):
+            return XclipBackend(selection)
+        return X11Backend(selection)
+    if sys.platform.startswith('darwin'):
+        msg = "macOS is not supported. yet."
+        raise NotImplementedError(msg)
+    if sys.platform.startswith('freebsd'):
+        msg = "FreeBSD is not supported. yet."
+        raise NotImplementedError(msg)
+    msg = "Only Windows and Linux is supported."
+    raise NotImplementedError(msg)
+
+
+def create_backends(name="auto", selections=("CLIPBOARD",), trace=None):
+    """
+    Returns a ClipboardBackend per selection.
+    Several selections need the x11 backend: they share its display
+    connection, so watching more selections starts no processes
+    (xclip would run for every selection at every check).
+    The first backend owns the connection, so it must be closed last.
+    """
+    selections = list(dict.fromkeys(selections))  # without repeats, in order
+    if selections == ["CLIPBOARD"]:
+        return [create_backend(name, trace=trace)]
+    if name in ("fake", "pyperclip", "windows") or sys.platform.startswith('win32'):
+        msg = "Only the X11 backends can watch other selections than CLIPBOARD."
+        raise ValueError(msg)
+    if len(selections) == 1:
+        return [create_backend(name, selections[0])]
+    if name == "xclip":
+        msg = "Watching several selections needs the x11 backend."
+        raise ValueError(msg)
+    # raises OSError without libX11, instead of falling back to xclip.
+    first = X11Backend(selections[0])
+    return [first] + [X11Backend(selection, reader=first.reader) for selection in selections[1:]]
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+shotdedup
+Finds and removes duplicates in an existing capture directory.
+
+    shotlast dedup <dir>
+    shotlast dedup <dir> --action hardlink
+    shotlast dedup <dir> --action delete --perceptual
+
+Files are grouped by size first, only the files sharing a size are
+hashed, and hashing runs on a process pool.
+The directory is read with os.scandir() and files are hashed in chunks,
+so it works on directories with 100k+ files.
+Without --action, it only reports what would be done.
+The oldest file (by modification time) of each group is kept.
+"""
+
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+# pylint: disable=line-too-long
+# pylint: disable=broad-except
+
+import argparse
+import collections
+import concurrent.futures
+import fnmatch
+import os
+import sys
+
+import click
+
+import shotencoders
+import shothash
+import shotindex
+import shotregion
+import shotsearch
+
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff", ".webp"}
+
+# the files shotlast saves, whatever --name-template named them.
+CAPTURE_EXTENSIONS = tuple(sorted(IMAGE_EXTENSIONS)) + (".txt", ".txt.gz", ".txt.zst")
+
+
+def is_capture(name, pattern=None):
+    """
+    True if the file name matches the pattern, or without a pattern,
+    if it has the extension of a saved capture.
+    >>> is_capture("2024/143000_0f3a9c1d.PNG"), is_capture("clip_1.txt.gz")
+    (True, True)
+    >>> is_capture(".shotlast_index.jsonl"), is_capture("a.png", "clip_*")
+    (False, False)
+    """
+    if pattern is not None:
+        return fnmatch.fnmatch(name, pattern)
+    return name.lower().endswith(CAPTURE_EXTENSIONS)
+
+
+def iter_files(directory, pattern=None, recursive=False):
+    """
+    Yields (path, size, mtime) for the regular files matching the pattern,
+    see is_capture().
+    """
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if recursive:
+                    yield from iter_files(entry.path, pattern, recursive)
+            elif entry.is_file(follow_symlinks=False) and is_capture(entry.name, pattern):
+                stat = entry.stat(follow_symlinks=False)
+                yield entry.path, stat.st_size, stat.st_mtime
+
+
+def _digest_worker(path):
+    """
+    Runs in a worker process. Returns (path, key) or (path, None).
+    """
+    try:
+        return path, shothash.get_file_digest(path)
+    except OSError:
+        return path, None
+
+
+def _dhash_worker(path):
+    """
+    Runs in a worker process. Returns (path, key) or (path, None).
+    """
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    try:
+        with Image.open(path) as image:
+            image.draft("RGB", (256, 256))  # JPEG only, decodes at a smaller scale.
+            return path, "%016x" % shothash.get_image_dhash(image)
+    except Exception:
+        return path, None
+
+
+def _group(worker, candidates, mtimes, jobs):
+    """
+    Hashes the candidates with the worker on a process pool.
+    Returns the groups of paths with the same key, oldest first.
+    """
+    by_key = collections.defaultdict(list)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        for path, key in executor.map(worker, candidates, chunksize=64):
+            if key is not None:
+                by_key[key].append(path)
+
+    groups = [sorted(paths, key=lambda path: (mtimes[path], path)) for paths in by_key.values() if len(paths) > 1]
+    groups.sort()
+    return groups
+
+
+def find_duplicates(directory, pattern=None, recursive=False, perceptual=False, jobs=None):
+    """
+    Returns (groups, mtimes). Each group is a list of paths with the
+    same content, the oldest first: the first path is the one to keep.
+    mtimes maps the hashed paths to their modification times.
+    perceptual:
+        if True, images with the same dHash are also duplicates,
+        even though their bytes differ.
+    """
+    candidates = []
+    mtimes = {}
+    if perceptual:
+        # the size of similar images differ, so all the images are hashed.
+        for path, _, mtime in iter_files(directory, pattern, recursive):
+            if os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS:
+                candidates.append(path)
+                mtimes[path] = mtime
+        worker = _dhash_worker
+    else:
+        by_size = collections.defaultdict(list)
+        for path, size, mtime in iter_files(directory, pattern, recursive):
+            by_size[size].append((path, mtime))
+        for size, files in by_size.items():
+            if len(files) > 1 and size > 0:
+                for path, mtime in files:
+                    candidates.append(path)
+                    mtimes[path] = mtime
+        del by_size
+        worker = _digest_worker
+
+    return _group(worker, candidates, mtimes, jobs), mtimes
+
+
+def split_identical(groups, mtimes, jobs=None):
+    """
+    Splits groups of similar images into groups of identical files.
+    Only those can be hard linked or deleted: a similar image may
+    differ, and the index must keep pointing at the same bytes.
+    """
+    candidates = [path for group in groups for path in group]
+    return _group(_digest_worker, candidates, mtimes, jobs)
+
+
+def hardlink(original, duplicate):
+    """
+    Replaces duplicate with a hard link to original.
+    The link is created next to it first, then renamed over it,
+    so the duplicate is never missing.
+    """
+    if os.path.samefile(original, duplicate):
+        return False
+    temp_name = duplicate + ".shotlast-link"
+    os.link(original, temp_name)
+    os.replace(temp_name, duplicate)
+    return True
+
+
+def dedup_directory(directory, action="report", pattern=None, recursive=False, perceptual=False, jobs=None):
+    """
+    Finds the duplicates and applies the action to all but the first
+    (oldest) file of each group:
+        "report": prints them, changes nothing.
+        "hardlink": replaces them with hard links to the first file.
+        "delete": deletes them, except the deltas and keyframes that
+            the delta log (see --save-deltas) needs.
+    With perceptual, similar images are only reported: "hardlink" and
+    "delete" apply to the identical files among them.
+    The content index and the search index follow the deleted files.
+    Returns (number of duplicates, bytes reclaimed or reclaimable).
+    """
+    groups, mtimes = find_duplicates(directory, pattern, recursive, perceptual, jobs)
+    if perceptual and action != "report":
+        groups = split_identical(groups, mtimes, jobs)
+    index = None
+    searcher = None
+    referenced = set()
+    if action == "delete":
+        referenced = shotregion.read_delta_references(directory)
+    index_file_name = os.path.join(directory, shotindex.INDEX_FILE_NAME)
+    if action != "report" and os.path.isfile(index_file_name):
+        index = shotindex.ContentIndex(directory)
+    if action == "delete" and os.path.isfile(os.path.join(directory, shotsearch.SEARCH_FILE_NAME)):
+        searcher = shotsearch.TextIndex(directory)
+
+    count = 0
+    reclaimed = 0
+    for group in groups:
+        original = group[0]
+        click.secho("keep:   ", nl=False)
+        click.secho(original, fg="green")
+        for duplicate in group[1:]:
+            try:
+                if action != "delete" and os.path.samefile(original, duplicate):
+                    # already hard linked, there is nothing to reclaim.
+                    continue
+                if os.path.normpath(duplicate) in referenced:
+                    click.secho("  kept, in the delta log: ", nl=False)
+                    click.secho(duplicate, fg="cyan")
+                    continue
+                size = os.path.getsize(duplicate)
+                if action == "hardlink":
+                    if not hardlink(original, duplicate):
+                        continue
+                elif action == "delete":
+                    os.remove(duplicate)
+                    if index is not None:
+                        index.replace_path(duplicate, original)
+                    if searcher is not None:
+                        searcher.replace_path(duplicate, original)
+            except OSError as ex1:
+                click.secho(f"  {duplicate}: {ex1!r}", fg="red")
+                continue
+            click.secho(f"  {action}: ", nl=False)
+            click.secho(duplicate, fg="yellow")
+            count += 1
+            reclaimed += size
+
+    if index is not None:
+        index.close()
+    if searcher is not None:
+        searcher.close()
+    verb = "reclaimable" if action == "report" else "reclaimed"
+    click.secho(f"{count} duplicates in {len(groups)} groups, {shotencoders.format_size(reclaimed)} {verb}.")
+    return count, reclaimed
+
+
+def main(arguments=None):
+    """
+    Entry point of "shotlast dedup".
+    """
+    parser = argparse.ArgumentParser(prog="shotlast dedup", description="Finds duplicate captures in a directory.")
+
+    help1 = "Directory with the saved clipboard files."
+    parser.add_argument('directory', help=help1)
+
+    help1 = 'What to do with the duplicates: "report" (the default) only lists them, "hardlink" replaces them with hard links to the kept file, "delete" deletes them.'
+    parser.add_argument('--action', choices=["report", "hardlink", "delete"], help=help1, default="report")
+
+    help1 = 'Same as "--action report".'
+    parser.add_argument('--dry-run', action='store_true', help=help1)
+
+    help1 = 'Only the files matching this pattern are compared, such as "clip_*". Default: all the saved images and texts, whatever their --name-template.'
+    parser.add_argument('--pattern', help=help1, default=None)
+
+    help1 = 'Also scans the subdirectories.'
+    parser.add_argument('--recursive', action='store_true', help=help1)
+
+    help1 = 'Images that look the same (same dHash) are also reported as duplicates. Hard links and deletes still only replace identical files.'
+    parser.add_argument('--perceptual', action='store_true', help=help1)
+
+    help1 = 'Number of worker processes. Default: number of CPUs.'
+    parser.add_argument('--jobs', type=int, help=help1, default=None)
+
+    args = parser.parse_args(arguments)
+    if not os.path.isdir(args.directory):
+        click.secho("Not a valid directory:", fg="red")
+        click.secho(str(args.directory), fg="yellow")
+        return 1
+
+    action = "report" if args.dry_run else args.action
+    dedup_directory(args.directory, action, args.pattern, args.recursive, args.perceptual, args.jobs)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
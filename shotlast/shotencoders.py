@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+shotencoders
+Output encoder presets for shotlast.
+
+    default : PNG with Pillow defaults. On Linux, the clipboard bytes
+              are kept as they are, whatever the format is.
+    fast    : PNG with compress_level=1, cheap on CPU, larger files.
+    compact : lossless WebP (or optimized PNG if Pillow has no WebP),
+              small files, expensive on CPU.
+    archive : saves with "fast" first, then re-encodes to "compact"
+              on a low priority background thread.
+"""
+
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+# pylint: disable=line-too-long
+
+import collections
+import os
+import threading
+import time
+
+
+EncodeResult = collections.namedtuple(
+    "EncodeResult", ["file_name", "seconds", "size"])
+
+
+class Encoder:
+    """
+    Saves PIL images with a fixed format and fixed save parameters.
+    Keeps the totals of the encode times and sizes, see summary().
+    """
+
+    def __init__(self, name, file_format, params=None, keep_original=False):
+        self.name = name
+        self.file_format = file_format  # such as "png", also the file extension.
+        self.params = params or {}
+        # True if already encoded clipboard content can be written as is.
+        self.keep_original = keep_original
+        self.count = 0
+        self.total_seconds = 0.0
+        self.total_size = 0
+        self.lock = threading.Lock()
+        self.metrics = None  # an optional shotmetrics.StageTimer
+
+    def encode(self, image, full_file_name) -> EncodeResult:
+        """
+        Saves the image to full_file_name, returns an EncodeResult.
+        """
+        if self.file_format == "webp" and image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        start = time.perf_counter()
+        image.save(full_file_name, self.file_format.upper(), **self.params)
+        seconds = time.perf_counter() - start
+        result = EncodeResult(full_file_name, seconds, os.path.getsize(full_file_name))
+        self.record(result)
+        return result
+
+    def record(self, result, stage="encode"):
+        if self.metrics is not None:
+            self.metrics.record(stage, result.seconds)
+        with self.lock:
+            self.count += 1
+            self.total_seconds += result.seconds
+            self.total_size += result.size
+
+    def summary(self) -> str:
+        """
+        Returns a one line report like:
+        "fast: 12 images, 3.4 MB, 45.1 ms average encode time"
+        """
+        with self.lock:
+            if not self.count:
+                return f"{self.name}: no images"
+            average = self.total_seconds / self.count
+            return f"{self.name}: {self.count} images, {format_size(self.total_size)}, {average * 1000:.1f} ms average encode time"
+
+
+class ArchiveEncoder(Encoder):
+    """
+    Encodes with a fast encoder right away, then re-encodes the file
+    with a compact encoder on its own background thread.
+    The fast file is deleted once the compact one is written, and the
+    content index points to it.
+    """
+
+    def __init__(self, fast, compact):
+        super().__init__("archive", fast.file_format, fast.params)
+        self.fast = fast
+        self.compact = compact
+        self.later = None  # a shotwriter.SaveQueue, see set_queue()
+        self.index = None  # a shotindex.ContentIndex, see set_index()
+
+    def set_queue(self, later):
+        self.later = later
+
+    def set_index(self, index):
+        self.index = index
+
+    def set_metrics(self, metrics):
+        self.metrics = metrics
+        self.fast.metrics = metrics
+
+    def encode(self, image, full_file_name) -> EncodeResult:
+        result = self.fast.encode(image, full_file_name)
+        if self.later is not None:
+            self.later.submit(lambda: self.reencode(full_file_name))
+        return result
+
+    def reencode(self, full_file_name):
+        from PIL import Image  # pylint: disable=import-outside-toplevel
+
+        compact_file_name = os.path.splitext(full_file_name)[0] + "." + self.compact.file_format
+        with Image.open(full_file_name) as image:
+            image.load()
+            self.compact.encode(image, compact_file_name)
+        if compact_file_name != full_file_name:
+            if self.index is not None:
+                try:
+                    self.index.replace_path(full_file_name, compact_file_name)
+                except Exception:  # pylint: disable=broad-except
+                    # the index still points to the fast file, keep it.
+                    os.remove(compact_file_name)
+                    raise
+            os.remove(full_file_name)
+
+    def summary(self) -> str:
+        return self.fast.summary() + "\n" + self.compact.summary()
+
+
+def format_size(size) -> str:
+    """
+    Returns a human readable size such as "1.5 MB".
+    >>> format_size(1536)
+    '1.5 KB'
+    """
+    value = float(size)
+    for unit in ["B", "KB", "MB", "GB"]:
+        if value < 1024 or unit == "GB":
+            break
+        value /= 1024
+    if unit == "B":
+        return f"{int(value)} B"
+    return f"{value:.1f} {unit}"
+
+
+PRESETS = ["default", "fast", "compact", "archive"]
+
+
+def create_encoder(preset="default") -> Encoder:
+    """
+    Returns a new Encoder for one of the PRESETS.
+    """
+    if preset == "default":
+        return Encoder("default", "png", keep_original=True)
+    if preset == "fast":
+        return Encoder("fast", "png", {"compress_level": 1})
+    if preset == "compact":
+        # the only preset that needs Pillow right away.
+        from PIL import features  # pylint: disable=import-outside-toplevel
+        if features.check("webp"):
+            return Encoder("compact", "webp", {"lossless": True, "quality": 80, "method": 4})
+        return Encoder("compact", "png", {"optimize": True})
+    if preset == "archive":
+        return ArchiveEncoder(create_encoder("fast"), create_encoder("compact"))
+    raise ValueError("Unknown encoder preset: " + str(preset))
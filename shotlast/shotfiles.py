@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+shotfiles
+Copies the files and directories found in the clipboard for shotlast.
+
+Copying a folder of 500 photos must not freeze the clipboard watcher:
+FileCopier plans the copy in the caller thread (cheap, no file content
+is read), then hashes and copies the files on a thread pool.
+File contents are copied in the kernel where possible
+(copy_file_range, then sendfile), without passing through Python.
+"""
+
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+# pylint: disable=line-too-long
+# pylint: disable=broad-except
+
+import concurrent.futures
+import errno
+import os
+import shutil
+import sys
+import threading
+import time
+
+import click
+
+import shotencoders
+import shothash
+import shotnames
+
+
+# bytes per copy_file_range/sendfile call.
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+# errors meaning "zero-copy is not possible here", not "the copy failed".
+_FALLBACK_ERRORS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF, errno.ETXTBSY}
+
+
+def _copy_file_range(fd_in, fd_out, size) -> bool:
+    copied = 0
+    try:
+        while copied < size:
+            count = os.copy_file_range(fd_in, fd_out, min(COPY_CHUNK_SIZE, size - copied))
+            if count == 0:
+                break
+            copied += count
+    except OSError as ex1:
+        if copied == 0 and ex1.errno in _FALLBACK_ERRORS:
+            return False
+        raise
+    return True
+
+
+def _sendfile(fd_in, fd_out, size) -> bool:
+    copied = 0
+    try:
+        while copied < size:
+            count = os.sendfile(fd_out, fd_in, copied, min(COPY_CHUNK_SIZE, size - copied))
+            if count == 0:
+                break
+            copied += count
+    except OSError as ex1:
+        if copied == 0 and ex1.errno in _FALLBACK_ERRORS:
+            return False
+        raise
+    return True
+
+
+def copy_file_fast(source, target):
+    """
+    Copies the content and the permission bits of source to target,
+    which must not exist, or be the empty file reserved for it.
+    On Linux, uses os.copy_file_range (may even share the blocks on
+    filesystems like btrfs and XFS), then os.sendfile, then a plain
+    buffered copy. On Windows and macOS, shutil.copyfile already uses
+    the fast OS calls (fcopyfile on macOS).
+    Returns the number of bytes copied.
+    """
+    if not sys.platform.startswith("linux"):
+        shutil.copyfile(source, target)
+        shutil.copymode(source, target)
+        return os.path.getsize(target)
+    with open(source, "rb") as fsrc, open(target, "wb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        done = False
+        if hasattr(os, "copy_file_range"):
+            done = _copy_file_range(fsrc.fileno(), fdst.fileno(), size)
+        if not done:
+            done = _sendfile(fsrc.fileno(), fdst.fileno(), size)
+        if not done:
+            shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+    shutil.copymode(source, target)
+    return size
+
+
+def plan_copy(paths, target_dir):
+    """
+    Returns (jobs, skipped):
+        jobs: list of (source file, target file, size, in_tree), with
+            directories expanded recursively; a directory keeps its
+            structure under target_dir/<directory name>, and its files
+            have in_tree True.
+        skipped: list of the paths that are neither files nor directories.
+    The names in target_dir are taken here, atomically (see
+    shotnames.reserve_path()): "a.txt" is copied as "a_2.txt" if "a.txt"
+    is taken. The sub directories are created by the copies.
+    """
+    jobs = []
+    skipped = []
+    for path in paths:
+        path = os.path.normpath(path)
+        name = os.path.basename(path)
+        if os.path.isfile(path):
+            target = shotnames.reserve_path(os.path.join(target_dir, name))
+            jobs.append((path, target, os.path.getsize(path), False))
+        elif os.path.isdir(path):
+            target_root = shotnames.reserve_path(os.path.join(target_dir, name), directory=True)
+            for dir_path, dir_names, file_names in os.walk(path):
+                dir_names.sort()
+                relative = os.path.relpath(dir_path, path)
+                target_path = os.path.normpath(os.path.join(target_root, relative))
+                for file_name in sorted(file_names):
+                    source = os.path.join(dir_path, file_name)
+                    if os.path.isfile(source):
+                        jobs.append((source, os.path.join(target_path, file_name), os.path.getsize(source), True))
+        else:
+            skipped.append(path)
+    return jobs, skipped
+
+
+def remove_reserved(target):
+    """
+    Removes target if it is still the empty file reserved by plan_copy().
+    """
+    try:
+        if os.path.getsize(target) == 0:
+            os.remove(target)
+    except OSError:
+        pass
+
+
+class CopyBatch:
+    """
+    Progress of the files of one clipboard copy.
+    Reported at most once per interval seconds, and when it is done.
+    """
+
+    def __init__(self, total_files, total_bytes, interval=1.0):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.files = 0  # finished, copied or not
+        self.copied_files = 0
+        self.copied_bytes = 0
+        self.linked = 0  # copied as hard links, see FileCopier
+        self.duplicates = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+        self.reported = self.started
+        self.lock = threading.Lock()
+
+    def finish_file(self, copied_bytes=None, duplicate=False, error=False, linked=False):
+        with self.lock:
+            self.files += 1
+            if copied_bytes is not None:
+                self.copied_files += 1
+                self.copied_bytes += copied_bytes
+            self.linked += linked
+            self.duplicates += duplicate
+            self.errors += error
+            now = time.perf_counter()
+            done = self.files == self.total_files
+            if not done and now - self.reported < self.interval:
+                return
+            self.reported = now
+            self.report(done, now - self.started)
+
+    def report(self, done, seconds):
+        size = shotencoders.format_size(self.copied_bytes)
+        message = f"files: {self.files}/{self.total_files}, copied {self.copied_files} ({size})"
+        if self.linked:
+            message += f", {self.linked} of them hard linked"
+        if self.duplicates:
+            message += f", {self.duplicates} duplicates skipped"
+        if self.errors:
+            message += f", {self.errors} errors"
+        if done:
+            message += f" in {seconds:.1f} s"
+        click.secho(message, fg="yellow" if done else None)
+
+
+class FileCopier:
+    """
+    Copies files and directories on a pool of threads.
+    Every file is checked against the content index (kind "file")
+    first, so files that are already saved are not copied again.
+    A directory is copied whole, so that its tree is complete: there,
+    a file that is already saved is a hard link to the saved copy
+    (or copied, if a link is not possible).
+
+    workers:
+        int, number of copying threads. Copies wait on the disk, not on
+        the GIL, so more threads than CPUs is fine.
+    index:
+        an optional shotindex.ContentIndex.
+    metrics:
+        an optional shotmetrics.StageTimer.
+    """
+
+    def __init__(self, workers=4, index=None, metrics=None):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max(1, workers), thread_name_prefix="shotlast-copy")
+        self.index = index
+        self.metrics = metrics
+        # digest -> Future of the copy of the digest that runs right now,
+        # so a batch with the same file twice copies it once. Its result
+        # is True if the content was copied, see _claim().
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def copy_items(self, paths, target_dir) -> CopyBatch:
+        """
+        Starts copying the files and directories to target_dir,
+        returns at once with the CopyBatch that tracks them.
+        """
+        jobs, skipped = plan_copy(paths, target_dir)
+        for path in skipped:
+            click.secho("can not copy: " + str(path), fg="red")
+        batch = CopyBatch(len(jobs), sum(size for _, _, size, _ in jobs))
+        for source, target, _, in_tree in jobs:
+            self.executor.submit(self._copy_one, source, target, batch, in_tree)
+        return batch
+
+    def _claim(self, digest):
+        """
+        Returns a Future if this thread is to copy the digest; its result
+        must be set when the copy ends. Returns None if another thread
+        copied it. If that copy failed, the digest is claimed again.
+        """
+        while True:
+            with self.lock:
+                other = self.in_flight.get(digest)
+                if other is None:
+                    claim = concurrent.futures.Future()
+                    self.in_flight[digest] = claim
+                    return claim
+            if other.result():
+                return None
+
+    def _copy_one(self, source, target, batch, in_tree=False):
+        digest = None
+        claim = None  # see _claim()
+        copied = False
+        try:
+            digest = shothash.get_file_digest(source)
+            if in_tree:
+                # a directory is copied whole, so its tree is complete.
+                saved = self._lookup(digest)
+            else:
+                claim = self._claim(digest)
+                saved = self._lookup(digest) if claim is not None else None
+                if claim is None or saved is not None:
+                    copied = True  # by another thread, or before
+                    remove_reserved(target)
+                    self._increment("duplicates", kind="file")
+                    batch.finish_file(duplicate=True)
+                    return
+            start = time.perf_counter()
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if saved is not None and self._link(saved, target):
+                copied = True
+                self._increment("linked", kind="file")
+                batch.finish_file(copied_bytes=0, linked=True)
+                return
+            size = copy_file_fast(source, target)
+            if self.metrics is not None:
+                self.metrics.record("write", time.perf_counter() - start)
+            if self.index is not None:
+                self.index.add("file", digest, target)
+            copied = True
+            self._increment("saved", kind="file")
+            batch.finish_file(copied_bytes=size)
+        except Exception as ex1:
+            self._increment("errors", stage="copy")
+            print(repr(ex1))
+            remove_reserved(target)
+            batch.finish_file(error=True)
+        finally:
+            if claim is not None:
+                with self.lock:
+                    del self.in_flight[digest]
+                # wakes the threads waiting for this digest, they copy it if this failed.
+                claim.set_result(copied)
+
+    def _lookup(self, digest):
+        if self.index is None:
+            return None
+        return self.index.lookup("file", digest)
+
+    @staticmethod
+    def _link(saved, target) -> bool:
+        """
+        Makes target a hard link to the saved file, returns False if
+        that is not possible (another file system, or saved is gone).
+        """
+        try:
+            os.link(saved, target)
+        except OSError:
+            return False
+        return True
+
+    def _increment(self, name, **labels):
+        if self.metrics is not None:
+            self.metrics.increment(name, **labels)
+
+    def close(self):
+        """
+        Waits for the pending copies.
+        """
+        self.executor.shutdown(wait=True)
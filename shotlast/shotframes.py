@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+shotframes
+Keyframe + delta storage of screenshot sequences for shotlast.
+
+With "--sink frames", images are not saved as files. Every image
+becomes a frame of a frame segment:
+
+    shotlast_frames_000001.sfrm
+    shotlast_frames_000002.sfrm
+    ...
+
+A frame is either a keyframe (the whole image as PNG) or a delta: the
+image is cut into tiles of tile x tile pixels, and only the tiles that
+differ from the previous frame are stored, XOR'ed with it (so the
+unchanged pixels of a changed tile are zeros) and compressed with zlib.
+A keyframe is stored every keyframe_interval frames, when the size
+changes, or when more than half of the tiles changed.
+Tiles are compared and XOR'ed with NumPy, on whole arrays.
+
+A segment is:
+    header : b"SHOTFRM1", tile size (u16)
+    records: b"FREC", kind (b"K" or b"D"), timestamp (double),
+             width (u16), height (u16), channels (u8), name size (u16),
+             payload size (u32), name (UTF-8), payload, CRC32 of payload (u32)
+    delta payload, zlib compressed: tile count (u32), tile numbers
+             (u32 each, row by row), XOR'ed tiles (uint8)
+Every start opens a new segment, which always starts with a keyframe.
+A frame is rebuilt from the keyframe before it:
+
+    shotlast extract <dir>
+
+requires:
+    pip install numpy
+"""
+
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+# pylint: disable=line-too-long
+# pylint: disable=broad-except
+
+import argparse
+import collections
+import datetime
+import io
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+
+import click
+
+import shotarchive
+
+
+SEGMENT_MAGIC = b"SHOTFRM1"
+SEGMENT_PATTERN = re.compile(r"^shotlast_frames_(\d{6})\.sfrm$")
+
+_SEGMENT_HEAD = struct.Struct("<8sH")  # b"SHOTFRM1", tile size
+_RECORD_HEAD = struct.Struct("<4scdHHBHI")  # b"FREC", kind, timestamp, width, height, channels, name size, payload size
+_RECORD_TAIL = struct.Struct("<I")  # CRC32 of payload
+
+# channels of the stored pixels, by PIL mode.
+_MODES = {1: "L", 3: "RGB", 4: "RGBA"}
+
+# a delta with more changed tiles than this fraction becomes a keyframe.
+MAX_DELTA_TILES = 0.5
+
+
+FrameEntry = collections.namedtuple(
+    "FrameEntry", ["timestamp", "segment", "offset", "kind", "size", "channels", "name", "payload_size"])
+
+
+def segment_file_name(directory, number):
+    return os.path.join(directory, f"shotlast_frames_{number:06d}.sfrm")
+
+
+def list_segments(directory):
+    """
+    Returns the sorted list of (number, segment file name) in directory.
+    """
+    segments = []
+    for entry in os.scandir(directory):
+        match = SEGMENT_PATTERN.match(entry.name)
+        if match and entry.is_file():
+            segments.append((int(match.group(1)), entry.path))
+    return sorted(segments)
+
+
+def image_to_array(image):
+    """
+    Returns the pixels of a PIL image as a (height, width, channels)
+    uint8 array, in L, RGB or RGBA.
+    """
+    import numpy  # pylint: disable=import-outside-toplevel
+
+    if image.mode not in ("L", "RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    array = numpy.asarray(image, dtype=numpy.uint8)
+    if array.ndim == 2:
+        array = array[:, :, None]
+    return array
+
+
+def pad_to_tiles(array, tile):
+    """
+    Returns array padded with zeros to a multiple of tile in both
+    directions, so it can be reshaped into tiles without a copy.
+    """
+    import numpy  # pylint: disable=import-outside-toplevel
+
+    height, width = array.shape[:2]
+    padded_height = -(-height // tile) * tile
+    padded_width = -(-width // tile) * tile
+    if (padded_height, padded_width) == (height, width):
+        return numpy.ascontiguousarray(array)
+    padded = numpy.zeros((padded_height, padded_width, array.shape[2]), dtype=numpy.uint8)
+    padded[:height, :width] = array
+    return padded
+
+
+def _tile_view(padded, tile):
+    # (tile rows, tile, tile columns, tile, channels), a view of padded.
+    height, width, channels = padded.shape
+    return padded.reshape(height // tile, tile, width // tile, tile, channels)
+
+
+def encode_delta(previous, current, tile):
+    """
+    Returns (payload, tile count, changed fraction) of the delta from
+    previous to current, two padded arrays of the same shape.
+    """
+    import numpy  # pylint: disable=import-outside-toplevel
+
+    view0 = _tile_view(previous, tile)
+    view1 = _tile_view(current, tile)
+    changed = (view0 != view1).any(axis=(1, 3, 4))  # (tile rows, tile columns)
+    rows, cols = numpy.nonzero(changed)
+    numbers = (rows * changed.shape[1] + cols).astype("<u4")
+    tiles = numpy.bitwise_xor(view1[rows, :, cols], view0[rows, :, cols])
+    payload = zlib.compress(struct.pack("<I", len(numbers)) + numbers.tobytes() + tiles.tobytes(), 6)
+    return payload, len(numbers), len(numbers) / float(changed.size)
+
+
+def apply_delta(padded, payload, tile):
+    """
+    Applies a delta payload to padded, in place.
+    """
+    import numpy  # pylint: disable=import-outside-toplevel
+
+    data = zlib.decompress(payload)
+    (count,) = struct.unpack_from("<I", data)
+    numbers = numpy.frombuffer(data, dtype="<u4", count=count, offset=4)
+    view = _tile_view(padded, tile)
+    tiles = numpy.frombuffer(data, dtype=numpy.uint8, offset=4 + 4 * count)
+    tiles = tiles.reshape(count, tile, tile, padded.shape[2])
+    rows, cols = numpy.divmod(numbers.astype(numpy.int64), view.shape[2])
+    view[rows, :, cols] ^= tiles
+
+
+class FrameStore:
+    """
+    Appends frames to a new segment in directory, see the module docstring.
+    Frames must be added in order, from a single thread (or a SaveQueue
+    with a single worker).
+
+    keyframe_interval:
+        int, a keyframe at least every this many frames, so rebuilding
+        a frame never needs more than this many deltas.
+    segment_size:
+        bytes, a new segment is started at the next keyframe once a
+        segment is larger.
+    fsync_interval:
+        seconds between two fsync calls.
+    """
+
+    def __init__(self, directory, keyframe_interval=30, tile=32,
+                 segment_size=256 * 1024 * 1024, fsync_interval=1.0):
+        self.directory = directory
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.tile = tile
+        self.segment_size = segment_size
+        self.fsync_interval = fsync_interval
+        self.segment_number = max([number for number, _ in list_segments(directory)], default=0)
+        self.handle = None
+        self.previous = None  # padded array of the previous frame
+        self.previous_size = None
+        self.since_keyframe = 0  # deltas since the last keyframe
+        self.synced = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _open_segment(self):
+        # a new segment on every start: sealed segments are never modified.
+        self.segment_number += 1
+        self.handle = open(segment_file_name(self.directory, self.segment_number), "xb")  # pylint: disable=consider-using-with
+        self.handle.write(_SEGMENT_HEAD.pack(SEGMENT_MAGIC, self.tile))
+
+    def _close_segment(self):
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+        self.handle.close()
+        self.handle = None
+
+    def add(self, image, name, timestamp=None):
+        """
+        Appends the PIL image as a frame, returns (kind, stored bytes),
+        kind is "keyframe" or "delta".
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        array = image_to_array(image)
+        height, width, channels = array.shape
+        padded = pad_to_tiles(array, self.tile)
+        with self.lock:
+            payload = None
+            key = (self.previous is None or self.previous.shape != padded.shape
+                   or self.previous_size != (width, height)
+                   or self.since_keyframe + 1 >= self.keyframe_interval)
+            if not key:
+                payload, _, fraction = encode_delta(self.previous, padded, self.tile)
+                key = fraction > MAX_DELTA_TILES
+            if key:
+                if self.handle is not None and self.handle.tell() >= self.segment_size:
+                    self._close_segment()
+                if image.mode != _MODES[channels]:
+                    image = image.convert(_MODES[channels])
+                buffer = io.BytesIO()
+                image.save(buffer, "PNG")
+                payload = buffer.getvalue()
+                self.since_keyframe = 0
+            else:
+                self.since_keyframe += 1
+            if self.handle is None:
+                self._open_segment()
+            name_bytes = name.encode("utf-8")
+            kind = b"K" if key else b"D"
+            self.handle.write(_RECORD_HEAD.pack(b"FREC", kind, timestamp, width, height, channels, len(name_bytes), len(payload)))
+            self.handle.write(name_bytes)
+            self.handle.write(payload)
+            self.handle.write(_RECORD_TAIL.pack(zlib.crc32(payload)))
+            self.handle.flush()
+            if time.monotonic() - self.synced >= self.fsync_interval:
+                os.fsync(self.handle.fileno())
+                self.synced = time.monotonic()
+            self.previous = padded
+            self.previous_size = (width, height)
+        return ("keyframe" if key else "delta"), len(payload)
+
+    def close(self):
+        with self.lock:
+            if self.handle is not None:
+                self._close_segment()
+
+
+def _scan_segment(file_name):
+    """
+    Returns the tile size and the FrameEntry list of a segment.
+    Stops at the first incomplete record (shotlast did not exit cleanly).
+    """
+    entries = []
+    file_size = os.path.getsize(file_name)
+    with open(file_name, "rb") as handle:
+        head = handle.read(_SEGMENT_HEAD.size)
+        if len(head) != _SEGMENT_HEAD.size:
+            return 0, entries
+        magic, tile = _SEGMENT_HEAD.unpack(head)
+        if magic != SEGMENT_MAGIC:
+            return 0, entries
+        offset = _SEGMENT_HEAD.size
+        while offset + _RECORD_HEAD.size <= file_size:
+            handle.seek(offset)
+            magic, kind, timestamp, width, height, channels, name_size, payload_size = _RECORD_HEAD.unpack(handle.read(_RECORD_HEAD.size))
+            end = offset + _RECORD_HEAD.size + name_size + payload_size + _RECORD_TAIL.size
+            if magic != b"FREC" or kind not in (b"K", b"D") or channels not in _MODES or end > file_size:
+                break
+            name = handle.read(name_size).decode("utf-8", errors="replace")
+            entries.append(FrameEntry(timestamp, file_name, offset, kind.decode("ascii"), (width, height), channels, name, payload_size))
+            offset = end
+    return tile, entries
+
+
+class FrameReader:
+    """
+    Rebuilds the frames of the segments in directory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.entries = []
+        self.tiles = {}  # tile size by segment
+        for _, file_name in list_segments(directory):
+            tile, entries = _scan_segment(file_name)
+            self.tiles[file_name] = tile
+            self.entries.extend(entries)
+        self.entries.sort(key=lambda entry: (entry.timestamp, entry.segment, entry.offset))
+
+    def find(self, start=None, end=None):
+        """
+        Returns the entries with start <= timestamp < end,
+        None means no limit.
+        """
+        return [entry for entry in self.entries
+                if (start is None or entry.timestamp >= start) and (end is None or entry.timestamp < end)]
+
+    def read_payload(self, entry) -> bytes:
+        with open(entry.segment, "rb") as handle:
+            handle.seek(entry.offset + _RECORD_HEAD.size + len(entry.name.encode("utf-8")))
+            payload = handle.read(entry.payload_size)
+            (expected,) = _RECORD_TAIL.unpack(handle.read(_RECORD_TAIL.size))
+        if zlib.crc32(payload) != expected:
+            raise ValueError("Corrupt frame: " + entry.name)
+        return payload
+
+    def iter_images(self, wanted):
+        """
+        Yields (entry, PIL image) for the wanted entries, in order.
+        Each one is rebuilt from the keyframe before it; the deltas
+        between two wanted frames are applied only once.
+        """
+        from PIL import Image  # pylint: disable=import-outside-toplevel
+
+        wanted = set(wanted)
+        by_segment = collections.defaultdict(list)
+        for entry in self.entries:
+            by_segment[entry.segment].append(entry)
+        for segment, entries in sorted(by_segment.items()):
+            entries.sort(key=lambda entry: entry.offset)
+            tile = self.tiles[segment]
+            last = max((index for index, entry in enumerate(entries) if entry in wanted), default=-1)
+            if last < 0:
+                continue
+            first = min(index for index, entry in enumerate(entries) if entry in wanted)
+            start = max((index for index in range(first + 1) if entries[index].kind == "K"), default=0)
+            padded = None
+            for entry in entries[start:last + 1]:
+                if entry.kind == "K":
+                    with Image.open(io.BytesIO(self.read_payload(entry))) as image:
+                        padded = pad_to_tiles(image_to_array(image), tile)
+                elif padded is not None:
+                    apply_delta(padded, self.read_payload(entry), tile)
+                if entry in wanted and padded is not None:
+                    width, height = entry.size
+                    pixels = padded[:height, :width]
+                    if entry.channels == 1:
+                        pixels = pixels[:, :, 0]
+                    yield entry, Image.fromarray(pixels.copy(), _MODES[entry.channels])
+
+
+def main(arguments=None):
+    """
+    shotlast extract <dir> [--out OUT] [--since TIME] [--until TIME] [--name NAME] [--list]
+    """
+    parser = argparse.ArgumentParser(prog="shotlast extract", description="Rebuilds the frames of the frame segments of a directory as PNG files.")
+
+    help1 = "Directory with the shotlast_frames_*.sfrm segments."
+    parser.add_argument('directory', help=help1)
+
+    help1 = "Directory to write the PNG files to, the frames directory by default."
+    parser.add_argument('--out', help=help1, default=None)
+
+    help1 = 'Only the frames from this local time on, such as "2024-05-01T14:30".'
+    parser.add_argument('--since', type=shotarchive.parse_time, help=help1, default=None)
+
+    help1 = 'Only the frames before this local time.'
+    parser.add_argument('--until', type=shotarchive.parse_time, help=help1, default=None)
+
+    help1 = 'Only the frame(s) with this name, such as "clip_20240501_143000.png".'
+    parser.add_argument('--name', action='append', help=help1, default=None)
+
+    help1 = "Only lists the frames, nothing is written."
+    parser.add_argument('--list', action='store_true', help=help1)
+
+    args = parser.parse_args(arguments)
+
+    if not os.path.isdir(args.directory):
+        click.secho("Not a directory: " + str(args.directory), fg="red")
+        return 1
+
+    reader = FrameReader(args.directory)
+    entries = reader.find(args.since, args.until)
+    if args.name:
+        entries = [entry for entry in entries if entry.name in args.name]
+    if args.list:
+        for entry in entries:
+            moment = datetime.datetime.fromtimestamp(entry.timestamp).isoformat(sep=" ", timespec="seconds")
+            kind = "keyframe" if entry.kind == "K" else "delta"
+            click.secho(f"{moment}  {kind:8}  {entry.size[0]}x{entry.size[1]}  {entry.payload_size:>10}  {entry.name}")
+    else:
+        out_dir = args.out or args.directory
+        for entry, image in reader.iter_images(entries):
+            parts = [part for part in entry.name.split("/") if part not in ("", ".", "..")]
+            file_name = os.path.join(out_dir, *parts)
+            os.makedirs(os.path.dirname(file_name), exist_ok=True)
+            root, extension = os.path.splitext(file_name)
+            number = 1
+            while os.path.lexists(file_name):
+                number += 1
+                file_name = f"{root}_{number}{extension}"
+            image.save(file_name, "PNG")
+            os.utime(file_name, (entry.timestamp, entry.timestamp))
+            click.secho("extracted: ", nl=False, fg="green")
+            click.secho(file_name, fg="green")
+    click.secho(f"{len(entries)} of {len(reader.entries)} frames.")
+    return 0
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+shothash
+Content fingerprints used by shotlast to find duplicates.
+"""
+
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+# pylint: disable=line-too-long
+
+import hashlib
+
+
+def new_content_hasher():
+    """
+    Returns a new hashlib object used to fingerprint clipboard contents.
+    BLAKE2b is in the standard library and faster than MD5/SHA on 64-bit.
+
+    requires:
+        import hashlib
+    """
+    return hashlib.blake2b(digest_size=16)
+
+
+def get_content_digest(content: bytes) -> str:
+    """
+    Returns the hex digest of content, such as encoded image bytes.
+    """
+    hasher = new_content_hasher()
+    hasher.update(content)
+    return hasher.hexdigest()
+
+
+def get_file_digest(file_name: str, chunk_size=1024 * 1024) -> str:
+    """
+    Returns the hex digest of the file contents.
+    The file is read in chunks, so it never needs to fit into memory.
+    """
+    hasher = new_content_hasher()
+    with open(file_name, "rb") as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def get_image_dhash(image, hash_size=8) -> int:
+    """
+    Returns the difference hash (dHash) of an image as an int of
+    hash_size * hash_size bits.
+    The image is shrunk to (hash_size + 1) x hash_size grayscale pixels
+    and each bit tells if a pixel is brighter than its right neighbour.
+    Similar looking images have dHashes with a small Hamming distance.
+    http://www.hackerfactor.com/blog/index.php?/archives/529-Kind-of-Like-That.html
+
+    requires:
+        from PIL import Image
+    """
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    if image.mode not in ("L", "RGB", "RGBA"):
+        image = image.convert("RGB")
+    small = image.resize((hash_size + 1, hash_size), Image.BILINEAR, reducing_gap=2.0)
+    pixels = list(small.convert("L").getdata())
+    dhash = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            dhash = (dhash << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return dhash
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+shotindex
+Persistent, content addressed index of the saved clipboard items.
+
+Each target directory gets a small SQLite database which maps the
+digest of every saved item to its file name and save time.
+Since it is on disk, deduplication survives restarts, and an item that
+was copied again after a while (A, B, A) is not saved twice.
+"""
+
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+# pylint: disable=line-too-long
+
+import argparse
+import os
+import sqlite3
+import threading
+import time
+
+
+INDEX_FILE_NAME = ".shotlast_index.sqlite"
+
+
+def parse_dedup_window(value):
+    """
+    Converts the value of --dedup-window to the number of the most recent
+    items of the same kind to compare with.
+    None means all the items ever saved.
+    >>> parse_dedup_window("previous")
+    1
+    >>> parse_dedup_window("20")
+    20
+    >>> parse_dedup_window("forever") is None
+    True
+    """
+    if value == "previous":
+        return 1
+    if value == "forever":
+        return None
+    try:
+        window = int(value)
+    except ValueError:
+        window = 0
+    if window < 1:
+        msg = 'must be "previous", "forever" or a positive number: ' + str(value)
+        raise argparse.ArgumentTypeError(msg)
+    return window
+
+
+class ContentIndex:
+    """
+    Maps content digests to the saved files of a target directory.
+
+    target_dir:
+        str, the index file is created in this directory.
+    window:
+        int, the number of the most recent items of the same kind
+        that a new item is compared with, or None for all of them.
+        See parse_dedup_window().
+
+    The database is opened lazily, on the first lookup or add.
+    Safe to use from multiple threads.
+    """
+
+    def __init__(self, target_dir, window=1):
+        self.file_name = os.path.join(target_dir, INDEX_FILE_NAME)
+        self.window = window
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.file_name, check_same_thread=False)
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS items (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    saved_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS items_digest ON items (digest, kind);
+                CREATE INDEX IF NOT EXISTS items_kind_seq ON items (kind, seq);
+            """)
+        return self.connection
+
+    def lookup(self, kind: str, digest: str):
+        """
+        Returns the file name of a previously saved item of the given
+        kind ("text", "image", "file") with the same digest,
+        or None if it is new within the dedup window.
+        """
+        with self.lock:
+            connection = self._connect()
+            if self.window is None:
+                sql = "SELECT path FROM items WHERE digest = ? AND kind = ? LIMIT 1"
+                row = connection.execute(sql, (digest, kind)).fetchone()
+            else:
+                sql = ("SELECT path FROM "
+                       "(SELECT digest, path FROM items WHERE kind = ? ORDER BY seq DESC LIMIT ?) "
+                       "WHERE digest = ? LIMIT 1")
+                row = connection.execute(sql, (kind, self.window, digest)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def add(self, kind: str, digest: str, path: str, saved_at=None):
+        """
+        Records a saved item.
+        """
+        if saved_at is None:
+            saved_at = time.time()
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "INSERT INTO items (kind, digest, path, saved_at) VALUES (?, ?, ?, ?)",
+                    (kind, digest, path, saved_at))
+
+    def remove(self, kind: str, digest: str, path: str):
+        """
+        Forgets an item that was recorded but not saved after all,
+        such as a capture dropped from a full save queue.
+        """
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "DELETE FROM items WHERE kind = ? AND digest = ? AND path = ?",
+                    (kind, digest, path))
+
+    def replace_path(self, old_path: str, new_path: str):
+        """
+        Points the items saved as old_path to new_path,
+        used when a duplicate file is deleted.
+        """
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("UPDATE items SET path = ? WHERE path = ?", (new_path, old_path))
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
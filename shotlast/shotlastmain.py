@@ -21,29 +21,35 @@ Watches clipboard and automatically saves any new images, text and files.
 # pylint: disable=wrong-import-position
 
 import argparse
+import asyncio
+import collections
+import copy
 import datetime
+import functools
+import io
 import os
 import pathlib
 import platform
-import shutil
 import subprocess
 import sys
 import time
-import uuid
-from PIL import ImageChops
-# ImportError: ImageGrab is macOS and Windows only
-if sys.platform.startswith('win32') or sys.platform.startswith("darwin"):
-    from PIL import ImageGrab
-else:
-    print("skipped importing PIL.ImageGrab: Windows and macOS only.")
 import click
-import PySimpleGUI as sg
-import pyperclip
-
-
-sg.theme("DarkGrey7")
-# for other themes:
-# https://www.geeksforgeeks.org/themes-in-pysimplegui/
+import shotarchive
+import shotasync
+import shotbackends
+import shotdedup
+import shotencoders
+import shotfiles
+import shotframes
+import shothash
+import shotindex
+import shotmetrics
+import shotnames
+import shotregion
+import shotsearch
+import shottext
+import shotwatch
+import shotwriter
 
 
 def get_datetime_stamp(sep_date="", sep_group="_", sep_time="", moment=None):
@@ -101,52 +107,157 @@ def get_process_output(process_executable: str, arguments: str):
     return output
 
 
-def build_only_file_name(prefix="clip"):
+def report_encoded(result, color="blue"):
     """
-    Returns a string like "clip_20121212_120102" without file extension.
+    Prints the file name, size and encode time of a
+    shotencoders.EncodeResult.
     """
-    file_name = prefix + "_" + get_datetime_stamp()
-    return file_name
+    click.secho("saved image: ", nl=False, fg=color)
+    click.secho(str(result.file_name), fg=color, nl=False)
+    size = shotencoders.format_size(result.size)
+    click.secho(f" ({size} in {result.seconds * 1000:.0f} ms)")
 
 
-def build_full_file_name(target_dir, file_format="png"):
-    only_file_name = build_only_file_name()
-    full_file_name = os.path.join(
-        target_dir, only_file_name) + "." + file_format
+def save_image_file(image, full_file_name, encoder, color="blue", sink=None):
+    """
+    Encodes and writes the image, then reports it.
+    This is the slow part of a capture, it runs on a SaveQueue worker.
+    sink: an optional shotarchive.ArchiveSink, that takes the file.
+    """
+    result = encoder.encode(image, full_file_name)
+    report_encoded(result, color)
+    if sink is not None:
+        sink.store(result.file_name)
 
-    if os.path.isfile(full_file_name):
-        # there is a file name clash.
-        # add some UUID to avoid it.
-        uuid1 = str(uuid.uuid1())
-        full_file_name = os.path.join(
-            target_dir, only_file_name) + "_" + uuid1 + "." + file_format
 
-    return full_file_name
+def decode_image(content: bytes):
+    """
+    Returns the PIL image of encoded content, such as PNG bytes.
+    """
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+    image = Image.open(io.BytesIO(content))
+    image.load()
+    return image
 
 
-def is_same_image(image1, image2):
+def save_encoded_file(content: bytes, full_file_name, encoder, color="yellow", sink=None):
     """
-    Returns True if 2 images are the same, False otherwise.
-    https://stackoverflow.com/questions/35176639/compare-images-python-pil/56280735
-    requires:
-        from PIL import ImageChops
+    Decodes already encoded content (such as xclip output) and
+    re-encodes it with the encoder.
+    """
+    with decode_image(content) as image:
+        save_image_file(image, full_file_name, encoder, color, sink)
+
+
+def save_frame(frames, image, name, timestamp, metrics=None, color="blue"):
+    """
+    Adds the image (PIL, or encoded bytes) to a shotframes.FrameStore,
+    then reports it. Runs on the frame queue.
+    """
+    if isinstance(image, bytes):
+        image = decode_image(image)
+    start = time.perf_counter()
+    kind, size = frames.add(image, name, timestamp)
+    seconds = time.perf_counter() - start
+    if metrics is not None:
+        metrics.record("encode", seconds)
+    click.secho("saved frame: ", nl=False, fg=color)
+    click.secho(name, fg=color, nl=False)
+    click.secho(f" ({kind}, {shotencoders.format_size(size)} in {seconds * 1000:.0f} ms)")
+
+
+def save_text_file(capture, full_file_name, compression="none", metrics=None, sink=None, searcher=None):
+    """
+    Writes a large shottext.TextCapture, compressed or not, then reports it.
+    Runs on a SaveQueue worker.
+    searcher: optional shotsearch.TextIndexer.
+    """
+    content = capture.head(shotsearch.INDEX_LIMIT) if searcher is not None else None
+    size = shottext.save_text_capture(capture, full_file_name, compression, metrics)
+    click.secho("saved text: ", nl=False, fg="green")
+    click.secho(str(full_file_name), fg="green", nl=False)
+    click.secho(f" ({shotencoders.format_size(size)})")
+    if searcher is not None:
+        searcher.submit(full_file_name, content)
+    if sink is not None:
+        sink.store(full_file_name)
+
+
+def save_bytes_file(content: bytes, full_file_name, encoder=None, color="yellow", sink=None):
+    """
+    Writes already encoded content, then reports it.
+    The write is recorded in the stats of the encoder, if provided.
+    """
+    start = time.perf_counter()
+    with open(full_file_name, "wb") as handle:
+        handle.write(content)
+    result = shotencoders.EncodeResult(full_file_name, time.perf_counter() - start, len(content))
+    if encoder is not None:
+        encoder.record(result, stage="write")
+    report_encoded(result, color)
+    if sink is not None:
+        sink.store(full_file_name)
+
+
+ImageFingerprint = collections.namedtuple(
+    "ImageFingerprint", ["size", "mode", "digest", "dhash"])
+
+
+def get_image_fingerprint(image, compare="exact"):
+    """
+    Returns an ImageFingerprint of the image, or None if image is None.
+    compare:
+        "exact": size, mode and a digest of the raw pixels.
+        "perceptual": also the dHash of the image.
+        "region": like "exact", the grid is computed by
+            ShotSaver.check_region() for the new images only.
     """
-    if image1 is None and image2 is None:  # pylint: disable=no-else-return
+    if image is None:
+        return None
+    hasher = shothash.new_content_hasher()
+    hasher.update(image.tobytes())
+    dhash = None
+    if compare == "perceptual":
+        dhash = shothash.get_image_dhash(image)
+    return ImageFingerprint(image.size, image.mode, hasher.hexdigest(), dhash)
+
+
+def is_same_fingerprint(fingerprint1, fingerprint2, threshold=0) -> bool:
+    """
+    Returns True if 2 image fingerprints are considered the same.
+    The checks go from the cheapest to the most expensive:
+        - sizes and modes must be equal,
+        - equal pixel digests are the same image,
+        - if both have a dHash, a Hamming distance of at most
+          threshold bits is also considered the same image.
+    """
+    if fingerprint1 is None and fingerprint2 is None:  # pylint: disable=no-else-return
         # both is None, so 2 "images" are "equal".
         return True
-    elif image1 is None:
+    elif fingerprint1 is None or fingerprint2 is None:
         return False
-    elif image1 is None:
+
+    if fingerprint1.size != fingerprint2.size:
         return False
+    if fingerprint1.mode == fingerprint2.mode and fingerprint1.digest == fingerprint2.digest:
+        return True
+    if fingerprint1.dhash is not None and fingerprint2.dhash is not None:
+        distance = bin(fingerprint1.dhash ^ fingerprint2.dhash).count("1")
+        return distance <= threshold
+    return False
 
-    same = True
-    image1_rgb = image1.convert('RGB')
-    image2_rgb = image2.convert('RGB')
-    diff = ImageChops.difference(image1_rgb, image2_rgb)
-    if diff.getbbox():
-        # there is a difference.
-        same = False
-    return same
+
+def is_same_image(image1, image2, compare="exact", threshold=0):
+    """
+    Returns True if 2 images are the same, False otherwise.
+    compare:
+        "exact": pixel by pixel equality.
+        "perceptual": near identical images (dHash distance <= threshold)
+        are also the same.
+    """
+    fingerprint1 = get_image_fingerprint(image1, compare)
+    fingerprint2 = get_image_fingerprint(image2, compare)
+    return is_same_fingerprint(fingerprint1, fingerprint2, threshold)
 
 
 class ShotSaver:
@@ -154,43 +265,286 @@ class ShotSaver:
     The base class for OS-specific shot savers.
     """
 
-    def __init__(self, target_dir: str) -> None:
-        self.text0 = ""  # previous text
-        self.text1 = ""  # current text
-        self.image0 = None  # previous image
-        self.image1 = None  # current image
-        self.file0 = None  # previous file
-        self.file1 = None  # current file
+    def __init__(self, target_dir: str, backend=None, compare="exact", threshold=0,
+                 save_workers=2, queue_depth=8, queue_policy="block",
+                 encoder="default", dedup_window=1,
+                 text_compression="none", text_threshold=1024 * 1024,
+                 copy_workers=4, sink="files", segment_size=256 * 1024 * 1024,
+                 fsync_interval=1.0, name_template=shotnames.DEFAULT_TEMPLATE,
+                 image_formats=None, min_change=0.01, save_deltas=False,
+                 keyframe_interval=30, search_index=True) -> None:
+        self.text_digest0 = None  # digest of the previous text, not the text itself
+        self.text_token0 = None  # change token when the previous text was read
+        self.token1 = None  # change token of the current save_shot()
+        self.files0 = None  # previous tuple of copied files
+        self.changed = False  # True if the last save_shot() saw something new
         self.target_dir = target_dir
+        self.compare = compare  # "exact", "perceptual" or "region", see is_same_image()
+        self.threshold = threshold  # max dHash distance for "perceptual"
+        # with "region", images where less than min_change (0.0 - 1.0) of
+        # the keyframe changed are skipped, see shotregion:
+        self.min_change = min_change
+        self.keyframe_grid = None  # shotregion grid of the keyframe
+        self.keyframe_size = None
+        self.keyframe_file = None  # the last image saved in full
+        # with "perceptual", images are compared with the last saved one,
+        # not the previous one, so a slow drift is saved once it adds up:
+        self.fingerprint_saved = None
+        # texts of text_threshold bytes or more are saved in the background,
+        # compressed with text_compression, see shottext.COMPRESSIONS.
+        self.text_compression = text_compression
+        self.text_threshold = text_threshold
+        # image targets to fetch, the preferred first, see shotbackends.IMAGE_PREFERENCES:
+        self.image_formats = image_formats or shotbackends.IMAGE_PREFERENCES
+        # takes the file names, see shotnames.FIELDS:
+        self.namer = shotnames.NameBuilder(target_dir, name_template)
+        # the clipboard, a shotbackends.ClipboardBackend:
+        self.backend = backend or shotbackends.create_backend()
+        # images are encoded and written in the background:
+        self.writer = shotwriter.SaveQueue(save_workers, queue_depth, queue_policy)
+        self.encoder = shotencoders.create_encoder(encoder)
+        # remembers what is already saved, even between sessions:
+        self.index = shotindex.ContentIndex(target_dir, dedup_window)
+        # durations of the read, compare, encode and write stages:
+        self.metrics = shotmetrics.StageTimer()
+        self.encoder.metrics = self.metrics
+        self.backend.metrics = self.metrics
+        self.writer.metrics = self.metrics
+        self.metrics.set_gauge("queue_depth", self.writer.pending)
+        # "files": every capture is a file, "archive": captures are
+        # appended to segments, see shotarchive.
+        self.sink = None
+        if sink == "archive":
+            if encoder == "archive":
+                msg = '"--encoder archive" re-encodes saved files later, it can not be used with "--sink archive".'
+                raise ValueError(msg)
+            self.sink = shotarchive.ArchiveSink(target_dir, segment_size, fsync_interval)
+        # "frames": images are the frames of a keyframe + delta store,
+        # see shotframes; the other captures are still files.
+        self.frames = None
+        self.framer = None
+        if sink == "frames":
+            if save_deltas:
+                msg = '"--sink frames" stores every image as a delta, it can not be used with "--save-deltas".'
+                raise ValueError(msg)
+            self.frames = shotframes.FrameStore(target_dir, keyframe_interval, segment_size=segment_size, fsync_interval=fsync_interval)
+            # a delta needs the previous frame, so a single worker keeps the order:
+            self.framer = shotwriter.SaveQueue(workers=1, depth=queue_depth)
+            self.framer.metrics = self.metrics
+            self.metrics.set_gauge("frame_queue_depth", self.framer.pending)
+        # small changes are saved as cropped deltas of the keyframe:
+        self.delta_log = None
+        if save_deltas:
+            if encoder == "archive":
+                msg = '"--encoder archive" renames saved files later, it can not be used with "--save-deltas".'
+                raise ValueError(msg)
+            self.delta_log = shotregion.DeltaLog(target_dir)
+        # deltas are small crops, so they are always compact PNGs:
+        self.delta_encoder = shotencoders.Encoder("delta", "png", {"optimize": True})
+        self.delta_encoder.metrics = self.metrics
+        # the saved texts are indexed in the background for "shotlast search":
+        self.searcher = shotsearch.TextIndexer(target_dir, self.metrics) if search_index else None
+        # copies the files and directories found in the clipboard:
+        self.copier = shotfiles.FileCopier(copy_workers, self.index, self.metrics)
+        self.archiver = None  # background re-encoder for the "archive" preset
+        if isinstance(self.encoder, shotencoders.ArchiveEncoder):
+            self.archiver = shotwriter.SaveQueue(workers=1, depth=1024)
+            self.archiver.metrics = self.metrics
+            self.metrics.set_gauge("archive_queue_depth", self.archiver.pending)
+            self.encoder.set_queue(self.archiver)
+            self.encoder.set_index(self.index)
+            self.encoder.set_metrics(self.metrics)
+
+    def forget(self):
+        """
+        Forgets the previous text and image, so the next ones are compared
+        with the index only.
+        """
+        self.text_digest0 = None
+        self.text_token0 = None
+        self.token1 = None
+        self.files0 = None
+        self.changed = False
+        self.keyframe_grid = None
+        self.keyframe_size = None
+        self.keyframe_file = None
+        self.fingerprint_saved = None
+
+    def check_region(self, image):
+        """
+        For compare "region": compares the image with the keyframe, the
+        last image saved in full. Returns (small, box, grid):
+            small: True if less than min_change of the image changed,
+                so it is not saved.
+            box: the changed box, if the image is to be saved as a cropped
+                delta (see --save-deltas), None to save it in full.
+            grid: the grid of the image, see shotregion.get_image_grid().
+        """
+        grid = shotregion.get_image_grid(image)
+        if self.keyframe_grid is None or self.keyframe_size != image.size:
+            return False, None, grid
+        change = shotregion.compare_grids(self.keyframe_grid, grid, image.size)
+        if change.fraction < self.min_change:
+            return True, None, grid
+        if self.delta_log is not None and shotregion.box_area_fraction(change.box, image.size) <= shotregion.MAX_DELTA_AREA:
+            return False, change.box, grid
+        return False, None, grid
+
+    def set_keyframe(self, grid, size, full_file_name):
+        if grid is not None:
+            self.keyframe_grid = grid
+            self.keyframe_size = size
+            self.keyframe_file = full_file_name
+
+    def discard_save(self, kind, digest, full_file_name, capture=None):
+        """
+        Undoes a queued save that failed or never ran (dropped by
+        "--queue-policy drop-oldest"): forgets it in the index, so the
+        next copy of the same content is saved again, deletes the empty
+        file reserved for it and releases its text capture.
+        A file that was (maybe completely) written is kept.
+        """
+        if capture is not None:
+            capture.close()
+        self.index.remove(kind, digest, full_file_name)
+        if self.keyframe_file == full_file_name:
+            self.keyframe_grid = None
+            self.keyframe_size = None
+            self.keyframe_file = None
+        try:
+            if os.path.getsize(full_file_name) == 0:
+                os.remove(full_file_name)
+        except FileNotFoundError:
+            pass
+
+    def move_reservation(self, full_file_name, file_format, digest, source):
+        """
+        Used by the spill jobs, which write another format than the
+        reserved one: reserves a name with the file_format extension
+        instead, and points the index (and the keyframe) to it.
+        Returns the new full file name.
+        """
+        if full_file_name.endswith("." + file_format):
+            return full_file_name
+        new_file_name = self.namer.reserve(file_format, digest, source)
+        os.remove(full_file_name)
+        self.index.replace_path(full_file_name, new_file_name)
+        if self.keyframe_file == full_file_name:
+            self.keyframe_file = new_file_name
+        return new_file_name
+
+    def save_delta(self, crop, box, size, digest):
+        """
+        Saves the changed box of an image, the rest is in the keyframe.
+        """
+        full_file_name = self.namer.reserve("png", digest, source="delta", kind="delta")
+        self.index.add("image", digest, full_file_name)
+        self.writer.submit(
+            functools.partial(self._save_delta_file, crop, full_file_name, self.keyframe_file, box, size),
+            discard=functools.partial(self.discard_save, "image", digest, full_file_name))
+        self.metrics.increment("saved", kind="delta")
+
+    def _save_delta_file(self, crop, full_file_name, keyframe_file_name, box, size):
+        # logged once written, so the log never names a missing delta.
+        save_image_file(crop, full_file_name, self.delta_encoder, "cyan")
+        self.delta_log.add(full_file_name, keyframe_file_name, box, size)
+        if self.sink is not None:
+            self.sink.store(full_file_name)
+
+    def store_frame(self, image, digest, source, grid=None, size=None):
+        """
+        Queues a PIL image (or encoded image bytes) for the frame store.
+        grid, size: see set_keyframe(), for compare "region"; the frame
+        is a full image, the next ones are compared with it.
+        """
+        name = self.namer.next_name("png", digest, source)
+        full_file_name = os.path.join(self.target_dir, name)
+        self.set_keyframe(grid, size, full_file_name)
+        self.index.add("image", digest, full_file_name)
+        self.framer.submit(
+            functools.partial(save_frame, self.frames, image, name, time.time(), self.metrics),
+            discard=functools.partial(self.discard_save, "image", digest, full_file_name))
+        self.metrics.increment("saved", kind="frame")
+
+    def share(self, backend):
+        """
+        Returns a saver for another backend, such as another X selection.
+        It shares the save queue, the index, the file names and the
+        metrics of this saver, so an item found in two selections is
+        saved once. Only this saver must be closed.
+        """
+        saver = copy.copy(self)
+        saver.backend = backend
+        backend.metrics = self.metrics
+        saver.forget()
+        return saver
 
     def save_text(self):
         """
-        Uses cross-platform pyperclip for saving text from clipboard.
+        Saves the text in the clipboard, if it is new.
         """
         try:
-            # try text
-            text1 = pyperclip.paste()
-            if text1 is None:  # pylint: disable=no-else-return
-                return
-            elif text1.strip() == "":
+            if self.token1 is not None and self.token1 == self.text_token0:
+                # nothing was copied since the previous text was read,
+                # skip reading (maybe megabytes of) text again.
                 return
-            elif self.text0 != text1:
-                full_file_name = build_full_file_name(
-                    self.target_dir, file_format="txt")
-
-                full_file_name = os.path.normpath(full_file_name)
-                # the line above is required since PySimpleGUI uses / on Windows.
-                # C:/Users/caglar/Desktop/gun05\clip_20201204_142219.png
-
-                handle = open(full_file_name, "wt", encoding="utf8")
-                handle.write(text1)
-                handle.close()
-
-                click.secho("saved text: ", nl=False, fg="green")
-                click.secho(str(full_file_name), fg="green")
-                self.text0 = text1
+            # try text
+            # the text is streamed in chunks: hashed on the fly and kept
+            # in a temporary file once it is large, never as a single str.
+            capture = shottext.TextCapture(self.target_dir)
+            try:
+                with self.metrics.time("read"):
+                    for chunk in self.backend.iter_text():
+                        capture.write(chunk)
+                self.text_token0 = self.token1
+                if capture.blank:
+                    # nothing, or only whitespace.
+                    return
+                with self.metrics.time("compare"):
+                    digest1 = capture.hexdigest()
+                    new = self.text_digest0 != digest1
+                    known = new and self.index.lookup("text", digest1)
+                if not new:
+                    return
+                self.text_digest0 = digest1
+                self.changed = True
+                if known:
+                    # saved before, in this session or in a previous one.
+                    self.metrics.increment("duplicates", kind="text")
+                    return
+
+                large = capture.size >= self.text_threshold
+                compression = self.text_compression if large else "none"
+                full_file_name = self.namer.reserve(
+                    shottext.EXTENSIONS[compression], digest1, source="text", kind="text")
+
+                if large:
+                    # recorded while queued, so a copy of the same text is
+                    # not queued again; forgotten if the save fails.
+                    self.index.add("text", digest1, full_file_name)
+                    # the save queue owns the capture from now on.
+                    self.writer.submit(
+                        functools.partial(save_text_file, capture, full_file_name, compression, self.metrics, self.sink, self.searcher),
+                        discard=functools.partial(self.discard_save, "text", digest1, full_file_name, capture))
+                    capture = None
+                else:
+                    with self.metrics.time("write"):
+                        capture.save(full_file_name)
+                    click.secho("saved text: ", nl=False, fg="green")
+                    click.secho(str(full_file_name), fg="green")
+                    if self.searcher is not None:
+                        self.searcher.submit(full_file_name, capture.head(shotsearch.INDEX_LIMIT))
+                    self.index.add("text", digest1, full_file_name)
+                    if self.sink is not None:
+                        self.sink.store(full_file_name)
+                self.metrics.increment("saved", kind="text")
+            finally:
+                if capture is not None:
+                    capture.close()
         except Exception as ex1:
-            self.text0 = None
+            self.text_digest0 = None
+            self.text_token0 = None
+            self.metrics.increment("errors", stage="save_text")
             print(repr(ex1))
 
     def save_image(self):
@@ -200,35 +554,90 @@ class ShotSaver:
         msg = "Do not call save_image() of the base class."
         raise NotImplementedError(msg)
 
-    def save_shot(self):
+    def save_shot(self) -> bool:
         """
         Driver code to be used from all child classes.
+        Returns True if the clipboard had something new, even if it
+        was not saved as a duplicate.
         """
-        self.save_text()
-        self.save_image()
+        self.changed = False
+        try:
+            # read once, used by both save_text() and save_image().
+            self.token1 = self.backend.change_token()
+        except Exception as ex1:
+            # unknown, so the clipboard will be read.
+            self.token1 = None
+            print(repr(ex1))
+        with self.metrics.time("save_text"):
+            self.save_text()
+        with self.metrics.time("save_image"):
+            self.save_image()
+        return self.changed
+
+    def close(self):
+        """
+        Waits for the pending saves, to be called before exit.
+        """
+        self.writer.close()
+        if self.frames is not None:
+            self.framer.close()
+            self.frames.close()
+        self.copier.close()
+        if self.searcher is not None:
+            # after the writer: large texts are queued by its workers.
+            self.searcher.close()
+        if self.archiver is not None:
+            self.archiver.close()
+        click.secho("encoder " + self.encoder.summary())
+        if self.delta_log is not None:
+            click.secho("encoder " + self.delta_encoder.summary())
+            self.delta_log.close()
+        if self.sink is not None:
+            self.sink.close()
+        self.index.close()
+        self.backend.close()
 
 
 class ShotSaverForWindows(ShotSaver):
-    def __init__(self, target_dir: str):
-        super().__init__(target_dir)
+    """
+    For backends that deliver PIL images (image_kind "pil"), such as
+    shotbackends.WindowsBackend.
+    """
+
+    def __init__(self, target_dir: str, **kwargs):
+        super().__init__(target_dir, **kwargs)
+        self.fingerprint0 = None  # fingerprint of the previous image
+
+    def forget(self):
+        super().forget()
+        self.fingerprint0 = None
 
     def save_image(self):
         self._save_image_or_file()
 
+    def _grab_clipboard(self):
+        """
+        Returns a PIL image, a list of file names or None.
+        """
+        files = self.backend.read_files()
+        if files:
+            return files
+        return self.backend.read_image()
+
     def _save_image_or_file(self):
         """
         On Windows, this function saves an image or file.
         """
         try:
             # try an image
-            image1 = ImageGrab.grabclipboard()
+            with self.metrics.time("read"):
+                image1 = self._grab_clipboard()
             # print(type(image1))
 
             # the result can be an image or a list.
             # if it is the latter, it can be any type of file.
 
             # print(type(image1))
-            type_as_str = str(type(image1))
             # if clipboard contains text: <class 'NoneType'>
             # if copied an file (for example, an image copied form browser): <class 'list'>
             # if it contains an image:
@@ -237,97 +646,101 @@ class ShotSaverForWindows(ShotSaver):
 
             if isinstance(image1, list):
                 # for example, if there is a file in the clipboard,
-                # image will be a list.
-                if len(image1) == 1:
-                    if isinstance(image1[0], str):
-                        # we have a list of str with 1 item.
-                        # this is a path to file, such as:
-                        # <class 'list'>
-                        # 0 <class 'str'> C:\Users\CAGLAR~1.TOK\AppData\Local\Temp\Ew_reXQWQAMWgIL-1.jpg
-                        # simply copy that file to clip path:
-                        if self.file0 != image1[0]:
-                            # this is a new file.
-                            shutil.copy(image1[0], self.target_dir)
-                            click.secho("saved image: ", nl=False, fg="yellow")
-                            click.secho(str(image1[0]), fg="yellow")
-
-                            self.file0 = image1[0]
-                else:
-                    print("can not handle multiple files.")
-            elif "ImageFile" in type_as_str:
+                # image will be a list of paths, such as:
+                # <class 'list'>
+                # 0 <class 'str'> C:\Users\CAGLAR~1.TOK\AppData\Local\Temp\Ew_reXQWQAMWgIL-1.jpg
+                # files and directories are copied in the background,
+                # and each file is checked against the index.
+                files1 = tuple(image1)
+                if self.files0 != files1:
+                    # this is a new copy.
+                    self.files0 = files1
+                    self.changed = True
+                    click.secho("copying: ", nl=False, fg="yellow")
+                    click.secho(", ".join(files1[:3]) + (" ..." if len(files1) > 3 else ""), fg="yellow")
+                    self.copier.copy_items(files1, self.target_dir)
+            elif image1 is not None:
+                # read_image() returns a PIL image or None, so PIL does
+                # not have to be imported here (see --headless).
                 # this is a single image, such as:
                 # <class 'PIL.BmpImagePlugin.DibImageFile'>
                 # <class 'PIL.PngImagePlugin.PngImageFile'>
 
-                file_format = "png"
-                if not is_same_image(self.image0, image1):
-                    full_file_name = build_full_file_name(
-                        self.target_dir, file_format)
-
-                    full_file_name = os.path.normpath(full_file_name)
-                    # the line above is required since PySimpleGUI uses / on Windows.
-                    # C:/Users/caglar/Desktop/gun05\clip_20201204_142219.png
-
-                    image1.save(full_file_name, file_format.upper())
-
-                    click.secho("saved image: ", nl=False, fg="blue")
-                    click.secho(str(full_file_name), fg="blue")
-                self.image0 = image1
+                file_format = self.encoder.file_format
+                with self.metrics.time("compare"):
+                    fingerprint1 = get_image_fingerprint(image1, self.compare)
+                    # the previous image again gives the same answer as before.
+                    same = fingerprint1 == self.fingerprint0 or is_same_fingerprint(self.fingerprint_saved, fingerprint1, self.threshold)
+                    # if not, maybe saved before, in this session or in a previous one:
+                    same = same or self.index.lookup("image", fingerprint1.digest)
+                    small, box, grid = False, None, None
+                    if not same and self.compare == "region":
+                        small, box, grid = self.check_region(image1)
+                if fingerprint1 != self.fingerprint0:
+                    self.changed = True
+                if small:
+                    # such as a moved cursor, see --min-change.
+                    self.metrics.increment("small_changes", kind="image")
+                elif not same and box is not None:
+                    self.save_delta(image1.crop(box), box, image1.size, fingerprint1.digest)
+                    self.fingerprint_saved = fingerprint1
+                elif not same and self.frames is not None:
+                    self.store_frame(image1, fingerprint1.digest, (image1.format or "").lower(), grid, image1.size)
+                    self.fingerprint_saved = fingerprint1
+                elif not same:
+                    source = (image1.format or "").lower()  # "dib" or "png"
+                    full_file_name = self.namer.reserve(file_format, fingerprint1.digest, source)
+                    self.set_keyframe(grid, image1.size, full_file_name)
+                    self.index.add("image", fingerprint1.digest, full_file_name)
+                    self.writer.submit(
+                        functools.partial(save_image_file, image1, full_file_name, self.encoder, sink=self.sink),
+                        spill=functools.partial(self._spill_image, image1, full_file_name, fingerprint1.digest, source),
+                        discard=functools.partial(self.discard_save, "image", fingerprint1.digest, full_file_name))
+                    self.fingerprint_saved = fingerprint1
+                    self.metrics.increment("saved", kind="image")
+                elif fingerprint1 != self.fingerprint0:
+                    # the same as the previous image is not a new copy.
+                    self.metrics.increment("duplicates", kind="image")
+                self.fingerprint0 = fingerprint1
         except Exception as ex1:
-            self.file0 = None
-            self.image0 = None
+            self.files0 = None
+            self.fingerprint0 = None
+            self.metrics.increment("errors", stage="save_image")
             print(repr(ex1))
 
+    def _spill_image(self, image, full_file_name, digest, source):
+        """
+        Used when the save queue is full: writes an uncompressed BMP
+        right away, which is much faster than encoding a PNG.
+        """
+        bmp_file_name = self.move_reservation(full_file_name, "bmp", digest, source)
+        save_image_file(image, bmp_file_name, shotencoders.Encoder("spill", "bmp"), sink=self.sink)
+
 
 class ShotSaverForLinux(ShotSaver):
     """
-    On Linux:
-        pyperclip: to save text
-        xclip: to save images
+    For backends that deliver encoded image data (image_kind "data"),
+    such as shotbackends.X11Backend and shotbackends.XclipBackend.
     """
 
-    def __init__(self, target_dir: str):
-        super().__init__(target_dir)
+    def __init__(self, target_dir: str, **kwargs):
+        super().__init__(target_dir, **kwargs)
+        self.digest0 = None  # digest of the previous image
+        self.token0 = None  # change token of the previous check
+
+    def forget(self):
+        super().forget()
+        self.digest0 = None
+        self.token0 = None
 
     def save_image(self):
-        self._save_image_with_xclip()
-
-    def _read_whole_file(self, file_name: str) -> bytes:
-        handle = open(file_name, "rb")
-        content = handle.read()
-        handle.close()
-        return content
-
-    def _is_same_content(self, file0: bytes, file1: bytes) -> bool:
-        """
-        Returns True if the file contents(bytes) are different,False otherwise.
-        """
-        assert isinstance(file0, (bytes, type(None)))
-        assert isinstance(file1, (bytes, type(None)))
-
-        if not file0 and not file1:  # pylint: disable=no-else-return
-            # return False if both of them are None.
-            return False
-        elif not file0:
-            # return False if previous value is None.
-            return False
-        elif len(file0) != len(file1):
-            # return False if their lengths are different.
-            return False
-        else:
-            # their length is same.
-            # compare values one by one.
-            equal = True
-            for i, _ in enumerate(file0):
-                if file0[i] != file1[i]:
-                    equal = False
-                    break
-            return equal
-
-    def _save_image_with_xclip(self):
+        self._save_image_from_selection()
+
+    def _save_image_from_selection(self):
         """
         Linux-specific image saver.
         requires:
+            libX11, or:
             sudo apt-get install xclip
 
         https://unix.stackexchange.com/questions/145131/copy-image-from-clipboard-to-file
@@ -355,82 +768,259 @@ class ShotSaverForLinux(ShotSaver):
         xclip -selection clipboard -t image/png -o > /tmp/clipboard.png
         """
         try:
-            args = "xclip -selection clipboard -t TARGETS -o"
-            output = get_process_output("xclip", args)  # output is now bytes
-            output = output.decode("utf-8")
-            output = output.splitlines()
-            for target_format in output:
-                if target_format.startswith("image/"):
-                    # target_format: "image/png"
-                    break
-            else:
-                target_format = None
+            # the change token (owner and TIMESTAMP on X11) only changes when
+            # something new is copied. it is None if it is not known.
+            token1 = self.token1
+            if token1 is not None and token1 == self.token0:
+                # the clipboard owner did not change since the last check,
+                # there is nothing new to read.
+                return
+
+            output = self.backend.list_formats()
+            # "image/png" rather than a huge "image/bmp", see --image-formats.
+            target_format = shotbackends.choose_image_format(output, self.image_formats)
 
-            # This function uses the a3rd party utility xclip.
-            # it saves the file form clipboard anyway.
-            # even though it is saved previously.
-            # then, it compares its contents against previous file contents.
-            # if they are same, it deletes the new one.
+            # the image is read into memory, and written to disk only
+            # if its digest differs from the previous one.
 
             if target_format:
-                file_format = target_format.split("/")[1]  # png
-                full_file_name = build_full_file_name(
-                    self.target_dir, file_format)
-                full_file_name = os.path.normpath(full_file_name)
-
-                # modify a copy of the file name for shell:
-                full_file_name2 = full_file_name.replace(" ", "\\ ")
-                cmd = f"xclip -selection clipboard -t {target_format} -o > {full_file_name2}"
-
-                # retcode = subprocess.call(cmd, shell=False)
-                os.system(cmd)
-                file1 = self._read_whole_file(full_file_name)
-                if self._is_same_content(self.file0, file1):
-                    # deleting the file, because it is the same as previous one.
-                    os.remove(full_file_name)
-                else:
-                    click.secho("saved image: ", nl=False, fg="yellow")
-                    click.secho(full_file_name, fg="yellow")
-                    self.file0 = file1
+                with self.metrics.time("read"):
+                    # the digest is computed while reading, when the backend can.
+                    content, digest1 = self.backend.read_image_data_and_digest(target_format)
+                with self.metrics.time("compare"):
+                    new = content and digest1 != self.digest0 and not self.index.lookup("image", digest1)
+                    small, box, grid, image1, fingerprint1 = False, None, None, None, None
+                    if new and self.compare in ("perceptual", "region"):
+                        # the only cases where the image is decoded to compare it.
+                        image1 = decode_image(content)
+                    if new and self.compare == "perceptual":
+                        # new bytes, but maybe the same picture, see --threshold.
+                        fingerprint1 = get_image_fingerprint(image1, "perceptual")
+                        new = not is_same_fingerprint(self.fingerprint_saved, fingerprint1, self.threshold)
+                    if new and self.compare == "region":
+                        small, box, grid = self.check_region(image1)
+                if content and digest1 != self.digest0:
+                    self.changed = True
+                if small:
+                    # such as a moved cursor, see --min-change.
+                    self.metrics.increment("small_changes", kind="image")
+                elif new and box is not None:
+                    self.save_delta(image1.crop(box), box, image1.size, digest1)
+                elif new and self.frames is not None:
+                    # decoded on the frame queue, unless it already is.
+                    self.store_frame(
+                        content if image1 is None else image1, digest1, target_format.split("/")[1],
+                        grid, image1.size if image1 is not None else None)
+                    self.fingerprint_saved = fingerprint1
+                elif new:
+                    source = target_format.split("/")[1]  # png
+                    spill = None  # the job itself, if it only writes the bytes
+                    if self.encoder.keep_original:
+                        file_format = source
+                        job = functools.partial(save_bytes_file, encoder=self.encoder, sink=self.sink)
+                    else:
+                        file_format = self.encoder.file_format
+                        job = functools.partial(save_encoded_file, encoder=self.encoder, sink=self.sink)
+                    full_file_name = self.namer.reserve(file_format, digest1, source=source)
+                    if image1 is not None:
+                        self.set_keyframe(grid, image1.size, full_file_name)
+                    self.index.add("image", digest1, full_file_name)
+                    if not self.encoder.keep_original:
+                        spill = functools.partial(self._spill_content, content, full_file_name, digest1, source)
+                    self.writer.submit(
+                        functools.partial(job, content, full_file_name), spill=spill,
+                        discard=functools.partial(self.discard_save, "image", digest1, full_file_name))
+                    self.fingerprint_saved = fingerprint1
+                    self.metrics.increment("saved", kind="image")
+                elif content and digest1 != self.digest0:
+                    self.metrics.increment("duplicates", kind="image")
+                self.digest0 = digest1
             else:
-                # print("An image format could not be found from xclip.")
+                # print("An image format could not be found in the clipboard.")
                 pass
+            self.token0 = token1
         except Exception as ex1:
-            self.file0 = None
+            self.digest0 = None
+            self.token0 = None
+            self.metrics.increment("errors", stage="save_image")
             print(repr(ex1))
 
 
-def start_shots(target_dir, sleep_duration=2):
-    # https://docs.python.org/3/library/sys.html#sys.platform
-    if sys.platform.startswith('win32'):
-        shotter = ShotSaverForWindows(target_dir)
-    elif sys.platform.startswith('linux'):
-        shotter = ShotSaverForLinux(target_dir)
-    elif sys.platform.startswith('darwin'):
-        msg = "macOS is not supported. yet."
-        raise NotImplementedError(msg)
-    elif sys.platform.startswith('freebsd'):
-        msg = "FreeBSD is not supported. yet."
-        raise NotImplementedError(msg)
+    def _spill_content(self, content, full_file_name, digest, source):
+        """
+        Used when the save queue is full: writes the clipboard bytes as
+        they are (such as the PNG of the owner application), with their
+        own extension, without decoding and encoding them.
+        """
+        spill_file_name = self.move_reservation(full_file_name, source, digest, source)
+        save_bytes_file(content, spill_file_name, sink=self.sink)
+
+
+class MultiSelectionSaver:
+    """
+    Watches several X selections (see shotbackends.SELECTIONS) in the
+    same loop, with a ShotSaverForLinux per selection.
+    The savers share everything but their backends, see ShotSaver.share().
+    """
+
+    def __init__(self, savers):
+        self.savers = savers
+        self.backend = savers[0].backend
+        self.metrics = savers[0].metrics
+
+    def save_shot(self) -> bool:
+        changed = False
+        for saver in self.savers:
+            # the order matters: CLIPBOARD is checked first, so a copied
+            # selection is saved as CLIPBOARD, then skipped as PRIMARY.
+            changed = saver.save_shot() or changed
+        return changed
+
+    def close(self):
+        for saver in self.savers[1:]:
+            saver.backend.close()
+        self.savers[0].close()
+
+
+def create_shotter(target_dir, backend="auto", trace=None, selections=("CLIPBOARD",), **kwargs):
+    """
+    Returns a ShotSaver for the backend, or a MultiSelectionSaver
+    for several selections.
+    backend:
+        a shotbackends.ClipboardBackend, or a name for
+        shotbackends.create_backends().
+    kwargs are passed to the ShotSaver, such as compare and threshold.
+    """
+    if isinstance(backend, str):
+        backends = shotbackends.create_backends(backend, selections, trace)
     else:
-        msg = "Only Windows and Linux is supported."
-        raise NotImplementedError(msg)
+        backends = [backend]
+    if backends[0].image_kind == "pil":
+        return ShotSaverForWindows(target_dir, backend=backends[0], **kwargs)
+    shotter = ShotSaverForLinux(target_dir, backend=backends[0], **kwargs)
+    if len(backends) > 1:
+        return MultiSelectionSaver([shotter] + [shotter.share(backend1) for backend1 in backends[1:]])
+    return shotter
+
+
+def replay_shots(shotter):
+    """
+    Saves every entry of a shotbackends.FakeBackend trace, once.
+    """
+    try:
+        while shotter.backend.step():
+            shotter.save_shot()
+    finally:
+        shotter.close()
+
+
+def start_metrics_exports(metrics, metrics_port=None, metrics_file=None, metrics_interval=60.0):
+    """
+    Starts the optional exporters of the metrics, returns them in a list.
+    metrics_port:
+        serves the metrics at http://127.0.0.1:<port>/metrics
+    metrics_file:
+        rewrites a JSON file every metrics_interval seconds.
+    """
+    exporters = []
+    if metrics_port:
+        server = shotmetrics.MetricsServer(metrics, metrics_port)
+        click.secho("metrics: ", nl=False)
+        click.secho(server.address, fg="yellow")
+        exporters.append(server)
+    if metrics_file:
+        exporters.append(shotmetrics.JsonDumper(metrics, metrics_file, metrics_interval))
+        click.secho("metrics file: ", nl=False)
+        click.secho(str(metrics_file), fg="yellow")
+    return exporters
+
+
+def start_shots(target_dir, sleep_duration=2.0, watch_mode="auto", min_period=0.1,
+                metrics_port=None, metrics_file=None, metrics_interval=60.0,
+                selections=("CLIPBOARD",), **kwargs):
+    """
+    Watches the clipboard forever.
+    kwargs are passed to create_shotter(), such as backend and compare.
+    """
+    shotter = create_shotter(target_dir, selections=selections, **kwargs)
 
     click.secho("started shotlast.")
 
     click.secho("target_dir: ", nl=False)
     click.secho(str(target_dir), fg="yellow")
 
-    click.secho("sleep_duration: ", nl=False)
-    click.secho(str(sleep_duration), fg="yellow")
+    click.secho("backend: ", nl=False)
+    click.secho(shotter.backend.name, fg="yellow")
+
+    if list(selections) != ["CLIPBOARD"]:
+        click.secho("selections: ", nl=False)
+        click.secho(", ".join(selections), fg="yellow")
+
+    exporters = start_metrics_exports(shotter.metrics, metrics_port, metrics_file, metrics_interval)
+
+    if isinstance(shotter.backend, shotbackends.FakeBackend):
+        # a recorded trace, there is nothing to watch.
+        try:
+            replay_shots(shotter)
+        finally:
+            for exporter in exporters:
+                exporter.close()
+        return
+
+    watcher = shotwatch.create_watcher(watch_mode, period=sleep_duration, selections=selections, min_period=min_period)
+
+    click.secho("watcher: ", nl=False)
+    click.secho(watcher.name, fg="yellow")
+
+    if isinstance(watcher, shotwatch.AdaptivePollingWatcher):
+        click.secho("period: ", nl=False)
+        click.secho(f"{watcher.min_period} - {watcher.max_period}", fg="yellow")
+    elif isinstance(watcher, shotwatch.PollingWatcher):
+        # the period is only meaningful while polling.
+        click.secho("sleep_duration: ", nl=False)
+        click.secho(str(sleep_duration), fg="yellow")
 
     click.secho("press ", nl=False)
     click.secho("ctrl c", fg="magenta", nl=False)
     click.secho(" to end.")
 
-    while True:
-        shotter.save_shot()
-        time.sleep(sleep_duration)
+    try:
+        asyncio.run(shotasync.CapturePipeline(shotter, watcher).run())
+    except KeyboardInterrupt:
+        click.secho("stopping shotlast.")
+    finally:
+        for exporter in exporters:
+            exporter.close()
+
+
+async def run_watcher(target_dir, watch_mode="auto", sleep_duration=2.0, min_period=0.1,
+                      selections=("CLIPBOARD",), on_change=None, **kwargs):
+    """
+    Watches the clipboard until cancelled, in the running event loop.
+    This is start_shots() for other applications, without the messages:
+
+        task = asyncio.ensure_future(shotlastmain.run_watcher("/data/captures"))
+        ...
+        task.cancel()
+
+    Cancelling waits for the capture in progress and the pending saves.
+    on_change:
+        called with the shotter after every check that found something
+        new, see shotasync.CapturePipeline.
+    kwargs are passed to create_shotter(), such as backend and compare.
+    """
+    loop = asyncio.get_running_loop()
+    shotter = create_shotter(target_dir, selections=selections, **kwargs)
+    if isinstance(shotter.backend, shotbackends.FakeBackend):
+        # a recorded trace, there is nothing to watch.
+        await loop.run_in_executor(None, replay_shots, shotter)
+        return
+    try:
+        watcher = shotwatch.create_watcher(watch_mode, period=sleep_duration, selections=selections, min_period=min_period)
+    except Exception:
+        shotter.close()
+        raise
+    await shotasync.CapturePipeline(shotter, watcher, on_change).run()
 
 
 def get_candidate_dir():
@@ -485,6 +1075,22 @@ def choose_target_dir_with_click(default_dir):
     return chosen_dir
 
 
+def import_gui():
+    """
+    Imports PySimpleGUI, which loads tkinter and needs a display.
+    Only the directory dialog needs it, so it is never imported when
+    the target directory is given, or with --headless.
+
+    requires:
+        import PySimpleGUI as sg
+    """
+    import PySimpleGUI as sg  # pylint: disable=import-outside-toplevel
+    sg.theme("DarkGrey7")
+    # for other themes:
+    # https://www.geeksforgeeks.org/themes-in-pysimplegui/
+    return sg
+
+
 def choose_target_dir_with_sg(default_dir):
     """
     Make the user to type a directory using PySimpleGUI package.
@@ -492,6 +1098,7 @@ def choose_target_dir_with_sg(default_dir):
     requires:
         import PySimpleGUI as sg
     """
+    sg = import_gui()
     layout = [
         [sg.T("")],
         [sg.Text("Choose a directory to store the captured clipboard items:")],
@@ -533,8 +1140,92 @@ def get_settings():
     help1 = "Target directory to store the saved clipboard files."
     parser.add_argument('target_dir', nargs='?', help=help1)
 
-    help1 = 'Sleep duration (in seconds) between two clipboard checks.'
-    parser.add_argument('--period', nargs='?', help=help1, default="2")
+    help1 = 'Sleep duration (in seconds, fractions allowed) between two clipboard checks with "--watch poll", the longest one with "--watch adaptive".'
+    parser.add_argument('--period', nargs='?', type=float, help=help1, default=2.0)
+
+    help1 = 'Shortest sleep duration (in seconds) with "--watch adaptive", used right after a change.'
+    parser.add_argument('--min-period', type=float, help=help1, default=0.1)
+
+    help1 = 'How to detect clipboard changes: "event" uses OS notifications, "poll" checks every --period seconds, "adaptive" checks every --min-period seconds after a change and slows down to --period while idle, "auto" (the default) uses "event" if possible, "adaptive" otherwise.'
+    parser.add_argument('--watch', choices=["auto", "event", "poll", "adaptive"], help=help1, default="auto")
+
+    help1 = 'How to compare images: "exact" (the default), "perceptual", which also treats near identical images (such as video frames) as duplicates, or "region", which skips images where less than --min-change percent of the last saved image changed (requires numpy).'
+    parser.add_argument('--compare', choices=["exact", "perceptual", "region"], help=help1, default="exact")
+
+    help1 = 'Maximum number of different dHash bits (out of 64) for two images to be the same with "--compare perceptual".'
+    parser.add_argument('--threshold', type=int, help=help1, default=5)
+
+    help1 = 'Smallest change (in percent of the image area, fractions allowed) that is saved with "--compare region".'
+    parser.add_argument('--min-change', type=float, help=help1, default=1.0)
+
+    help1 = 'With "--compare region", saves a change covering at most half of the image as a cropped delta of the last full image (the keyframe), listed in .shotlast_deltas.jsonl.'
+    parser.add_argument('--save-deltas', action='store_true', help=help1)
+
+    help1 = 'Number of background threads that encode and write images.'
+    parser.add_argument('--save-workers', type=int, help=help1, default=2)
+
+    help1 = 'Maximum number of captures waiting to be written.'
+    parser.add_argument('--queue-depth', type=int, help=help1, default=8)
+
+    help1 = 'What to do when the save queue is full: "block" (the default) waits, "drop-oldest" discards the oldest pending capture, "spill" writes an uncompressed file right away.'
+    parser.add_argument('--queue-policy', choices=shotwriter.POLICIES, help=help1, default="block")
+
+    help1 = 'Image encoder preset: "default" (PNG, clipboard format kept on Linux), "fast" (PNG, low compression), "compact" (lossless WebP) or "archive" (fast now, compact later in the background).'
+    parser.add_argument('--encoder', choices=shotencoders.PRESETS, help=help1, default="default")
+
+    help1 = 'Which saved items a new item is compared with to skip duplicates: "previous" (the default), a number N for the last N items, or "forever". Kept in the target directory, so it survives restarts.'
+    parser.add_argument('--dedup-window', type=shotindex.parse_dedup_window, help=help1, default="previous")
+
+    help1 = 'How to read the clipboard: "x11" keeps a libX11 connection open, "xclip" runs xclip for every request, "windows" uses PIL.ImageGrab, "pyperclip" reads text only, "fake" replays a --trace file. "auto" (the default) uses "windows" on Windows, "xclip" on Linux if it is installed, "x11" otherwise.'
+    parser.add_argument('--backend', choices=shotbackends.BACKENDS, help=help1, default="auto")
+
+    help1 = 'Image formats to fetch from the clipboard on Linux, the preferred first, such as "png,jpeg,bmp". Offered formats that are not listed come last. The default prefers small formats: ' + ",".join(item.split("/")[1] for item in shotbackends.IMAGE_PREFERENCES) + '.'
+    parser.add_argument('--image-formats', type=shotbackends.parse_image_formats, help=help1, default=None)
+
+    help1 = 'X selection to watch, may be repeated: CLIPBOARD (the default, ctrl c), PRIMARY (selected text, middle click) or SECONDARY. Several selections are read through one X11 connection and share the duplicate checks.'
+    parser.add_argument('--selection', action='append', type=str.upper, choices=shotbackends.SELECTIONS, help=help1, default=None)
+
+    help1 = 'Clipboard trace to replay with "--backend fake": a JSON object per line, such as {"text": "hello"} or {"image": "shot.png"}.'
+    parser.add_argument('--trace', help=help1, default=None)
+
+    help1 = 'Where captures go: "files" (the default) saves each one as a file, "archive" appends them to a few shotlast_*.slog segments, see "shotlast export", "frames" stores images as keyframes and changed tiles in shotlast_frames_*.sfrm segments (requires numpy), see "shotlast extract". Copied files and directories are always kept as they are.'
+    parser.add_argument('--sink', choices=["files", "archive", "frames"], help=help1, default="files")
+
+    help1 = 'With "--sink frames", a full image (keyframe) is stored at least every this many images, the others are stored as the tiles that changed.'
+    parser.add_argument('--keyframe-interval', type=int, help=help1, default=30)
+
+    help1 = 'Size (in MB) of an archive or frame segment, with "--sink archive" or "--sink frames".'
+    parser.add_argument('--segment-size', type=int, help=help1, default=256)
+
+    help1 = 'Seconds between two fsync calls of the archive or frame segments. With "--sink archive", captures stay as files until they are on disk.'
+    parser.add_argument('--fsync-interval', type=float, help=help1, default=1.0)
+
+    help1 = 'File names of the captures, without extension. Fields: {date}, {time}, {ms} (milliseconds), {us} (microseconds), {seq} (counts up from 1), {hash} (content digest prefix), {source} (clipboard format) and {kind} (image or text); "/" makes sub directories. Clashes get "_2", "_3", ... (or the next {seq}).'
+    parser.add_argument('--name-template', type=shotnames.parse_template, help=help1, default=shotnames.DEFAULT_TEMPLATE)
+
+    help1 = 'Number of background threads that copy the files and directories found in the clipboard.'
+    parser.add_argument('--copy-workers', type=int, help=help1, default=4)
+
+    help1 = 'Compression of the texts of --text-threshold KB or more: "none" (the default), "gzip" (.txt.gz) or "zstd" (.txt.zst, requires the zstandard package).'
+    parser.add_argument('--compress-text', choices=shottext.COMPRESSIONS, help=help1, default="none")
+
+    help1 = 'Size (in KB) from which texts are saved in the background, and compressed with --compress-text.'
+    parser.add_argument('--text-threshold', type=int, help=help1, default=1024)
+
+    help1 = 'Does not index the saved texts for "shotlast search". By default, every saved text is added to a full-text index in the target directory, in the background.'
+    parser.add_argument('--no-search-index', action='store_true', help=help1)
+
+    help1 = 'Serves counters and timing histograms in the Prometheus format at http://127.0.0.1:PORT/metrics (localhost only).'
+    parser.add_argument('--metrics-port', type=int, help=help1, default=None)
+
+    help1 = 'Writes counters and timing percentiles to this JSON file every --metrics-interval seconds.'
+    parser.add_argument('--metrics-file', help=help1, default=None)
+
+    help1 = 'Seconds between two writes of --metrics-file.'
+    parser.add_argument('--metrics-interval', type=float, help=help1, default=60.0)
+
+    help1 = 'Never opens a window: no directory dialog (target_dir is required), no file manager and no GUI toolkit, which also makes the start faster.'
+    parser.add_argument('--headless', action='store_true', help=help1)
 
     # help1 = 'If provided, automatically confirms overwrite.'
     # parser.add_argument('--overwrite', action='store_true', help=help1)
@@ -543,7 +1234,36 @@ def get_settings():
 
     settings = {}
     settings["sleep_duration"] = args.period
+    settings["min_period"] = args.min_period
     settings["target_dir"] = args.target_dir
+    settings["watch_mode"] = args.watch
+    settings["compare"] = args.compare
+    settings["threshold"] = args.threshold
+    settings["min_change"] = args.min_change / 100.0
+    settings["save_deltas"] = args.save_deltas
+    settings["save_workers"] = args.save_workers
+    settings["queue_depth"] = args.queue_depth
+    settings["queue_policy"] = args.queue_policy
+    settings["encoder"] = args.encoder
+    settings["dedup_window"] = args.dedup_window
+    settings["backend"] = args.backend
+    settings["trace"] = args.trace
+    settings["image_formats"] = args.image_formats
+    # CLIPBOARD first, see MultiSelectionSaver.save_shot().
+    settings["selections"] = sorted(set(args.selection or ["CLIPBOARD"]), key=shotbackends.SELECTIONS.index)
+    settings["name_template"] = args.name_template
+    settings["copy_workers"] = args.copy_workers
+    settings["sink"] = args.sink
+    settings["keyframe_interval"] = args.keyframe_interval
+    settings["segment_size"] = args.segment_size * 1024 * 1024
+    settings["fsync_interval"] = args.fsync_interval
+    settings["text_compression"] = args.compress_text
+    settings["text_threshold"] = args.text_threshold * 1024
+    settings["metrics_port"] = args.metrics_port
+    settings["metrics_file"] = args.metrics_file
+    settings["metrics_interval"] = args.metrics_interval
+    settings["headless"] = args.headless
+    settings["search_index"] = not args.no_search_index
 
     # for file_name in args.target_dir:
     #     if os.path.isfile(file_name):
@@ -555,16 +1275,31 @@ def get_settings():
     return settings
 
 
+# subcommands, such as "shotlast dedup <dir>".
+# anything else on the command line starts watching the clipboard.
+COMMANDS = {
+    "dedup": shotdedup.main,
+    "export": shotarchive.main,
+    "extract": shotframes.main,
+    "search": shotsearch.main,
+}
+
+
 def main():
     """
     entry point of the module.
     """
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        return COMMANDS[sys.argv[1]](sys.argv[2:])
 
     # os.chdir(os.path.abspath(os.path.dirname(__file__)))
     settings = get_settings()
-    sleep_duration = int(settings["sleep_duration"])
+    sleep_duration = settings["sleep_duration"]
     if settings["target_dir"]:
         target_dir = settings["target_dir"]
+    elif settings["headless"]:
+        click.secho("A target directory is required with --headless.", fg="red")
+        return
     else:
         candidate_target_dir = get_candidate_dir()
         target_dir = choose_target_dir(default_dir=candidate_target_dir)
@@ -579,8 +1314,77 @@ def main():
         click.secho(str(target_dir), fg="yellow")
         return
 
-    click.launch(target_dir)
-    start_shots(target_dir=target_dir, sleep_duration=sleep_duration)
+    if settings["sink"] == "archive" and settings["encoder"] == "archive":
+        click.secho('"--encoder archive" can not be used with "--sink archive".', fg="red")
+        return
+
+    selections = settings["selections"]
+    if selections != ["CLIPBOARD"] and settings["backend"] in ("fake", "pyperclip", "windows"):
+        click.secho("Only the X11 backends can watch other selections than CLIPBOARD.", fg="red")
+        return
+
+    if len(selections) > 1 and settings["backend"] == "xclip":
+        click.secho("Watching several selections needs the x11 backend.", fg="red")
+        return
+
+    if settings["compare"] == "region" and not shotregion.numpy_available():
+        click.secho('"--compare region" requires the numpy package.', fg="red")
+        return
+
+    if settings["save_deltas"] and settings["compare"] != "region":
+        click.secho('"--save-deltas" requires "--compare region".', fg="red")
+        return
+
+    if settings["sink"] == "frames" and not shotregion.numpy_available():
+        click.secho('"--sink frames" requires the numpy package.', fg="red")
+        return
+
+    if settings["sink"] == "frames" and settings["save_deltas"]:
+        click.secho('"--save-deltas" can not be used with "--sink frames".', fg="red")
+        return
+
+    if settings["save_deltas"] and settings["encoder"] == "archive":
+        click.secho('"--encoder archive" can not be used with "--save-deltas".', fg="red")
+        return
+
+    if settings["search_index"] and not shotsearch.fts5_available():
+        click.secho("The SQLite of this Python has no FTS5, the texts are not indexed for search.", fg="red")
+        settings["search_index"] = False
+
+    if settings["text_compression"] == "zstd" and not shottext.zstd_available():
+        click.secho("zstd requires the zstandard package, using gzip.", fg="red")
+        settings["text_compression"] = "gzip"
+
+    if not settings["headless"]:
+        click.launch(target_dir)
+    start_shots(target_dir=target_dir, sleep_duration=sleep_duration,
+                watch_mode=settings["watch_mode"],
+                min_period=settings["min_period"],
+                metrics_port=settings["metrics_port"],
+                metrics_file=settings["metrics_file"],
+                metrics_interval=settings["metrics_interval"],
+                selections=settings["selections"],
+                compare=settings["compare"],
+                threshold=settings["threshold"],
+                min_change=settings["min_change"],
+                save_deltas=settings["save_deltas"],
+                save_workers=settings["save_workers"],
+                queue_depth=settings["queue_depth"],
+                queue_policy=settings["queue_policy"],
+                encoder=settings["encoder"],
+                dedup_window=settings["dedup_window"],
+                copy_workers=settings["copy_workers"],
+                sink=settings["sink"],
+                segment_size=settings["segment_size"],
+                keyframe_interval=settings["keyframe_interval"],
+                fsync_interval=settings["fsync_interval"],
+                text_compression=settings["text_compression"],
+                text_threshold=settings["text_threshold"],
+                search_index=settings["search_index"],
+                name_template=settings["name_template"],
+                image_formats=settings["image_formats"],
+                backend=settings["backend"],
+                trace=settings["trace"])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+shotmetrics
+Timers, counters and gauges of the capture pipeline of shotlast.
+
+    metrics = StageTimer()
+    with metrics.time("compare"):
+        ...
+    metrics.increment("duplicates", kind="text")
+    print(metrics.percentiles("compare"))
+
+They can be exported while shotlast runs:
+    MetricsServer : Prometheus text format over HTTP, on localhost only.
+    JsonDumper    : a JSON file, rewritten periodically.
+"""
+
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+# pylint: disable=line-too-long
+
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+# stages of a capture, in pipeline order.
+# save_text and save_image are whole calls, the others are parts of them.
+# subprocess is the time spent in external programs, such as xclip.
+# index is the full-text indexing of a saved text, in the background.
+STAGES = ["save_text", "save_image", "read", "subprocess", "compare", "encode", "write", "index"]
+
+# upper bounds (in seconds) of the histogram buckets, Prometheus style.
+BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+
+def percentile(sorted_values, fraction):
+    """
+    Returns the value at the given fraction (0.0 - 1.0) of
+    an already sorted list, None if it is empty.
+    >>> percentile([1, 2, 3, 4], 0.5)
+    3
+    """
+    if not sorted_values:
+        return None
+    position = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[position]
+
+
+class StageTimer:
+    """
+    Collects the durations (in seconds) of each stage, as recent samples
+    for percentiles and as histograms since the start.
+    Also keeps counters (such as skipped duplicates and errors) and
+    gauges (such as the queue depth).
+    Safe to use from the save workers, too.
+
+    max_samples:
+        only the most recent samples of each stage are kept.
+    """
+
+    def __init__(self, max_samples=10000):
+        self.samples = collections.defaultdict(lambda: collections.deque(maxlen=max_samples))
+        # stage -> [bucket counts..., +Inf count], and the sum of durations.
+        self.buckets = collections.defaultdict(lambda: [0] * (len(BUCKETS) + 1))
+        self.sums = collections.defaultdict(float)
+        # (name, ((label, value), ...)) -> int
+        self.counters = collections.defaultdict(int)
+        # name -> callable returning a number, read at export time.
+        self.gauges = {}
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.samples[stage].append(seconds)
+            buckets = self.buckets[stage]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+                    break
+            else:
+                buckets[-1] += 1
+            self.sums[stage] += seconds
+
+    def increment(self, name, amount=1, **labels):
+        """
+        Adds amount to the counter name, such as:
+            metrics.increment("duplicates", kind="image")
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += amount
+
+    def counter(self, name, **labels) -> int:
+        with self.lock:
+            return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def set_gauge(self, name, function):
+        """
+        function is called without arguments every time the metrics
+        are exported, such as SaveQueue.pending.
+        """
+        with self.lock:
+            self.gauges[name] = function
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.buckets.clear()
+            self.sums.clear()
+            self.counters.clear()
+
+    def percentiles(self, stage, fractions=(0.5, 0.9, 0.99)):
+        """
+        Returns (count, [values at fractions]) of the stage.
+        """
+        with self.lock:
+            values = sorted(self.samples.get(stage, ()))
+        return len(values), [percentile(values, fraction) for fraction in fractions]
+
+    def _read_gauges(self):
+        with self.lock:
+            gauges = dict(self.gauges)
+        values = {}
+        for name, function in gauges.items():
+            try:
+                values[name] = function()
+            except Exception:  # pylint: disable=broad-except
+                values[name] = None
+        return values
+
+    def snapshot(self) -> dict:
+        """
+        Returns all the metrics as a dict that can be dumped as JSON.
+        """
+        gauges = self._read_gauges()
+        with self.lock:
+            stages = {}
+            for stage in sorted(self.buckets):
+                values = sorted(self.samples.get(stage, ()))
+                stages[stage] = {
+                    "count": sum(self.buckets[stage]),
+                    "sum": self.sums[stage],
+                    "p50": percentile(values, 0.5),
+                    "p90": percentile(values, 0.9),
+                    "p99": percentile(values, 0.99),
+                }
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self.counters.items())]
+        return {
+            "time": time.time(),
+            "uptime": time.time() - self.started,
+            "stages": stages,
+            "counters": counters,
+            "gauges": gauges,
+        }
+
+    def to_prometheus(self, prefix="shotlast") -> str:
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        gauges = self._read_gauges()
+        lines = []
+        with self.lock:
+            name = prefix + "_stage_seconds"
+            lines.append(f"# HELP {name} Duration of the stages of a capture.")
+            lines.append(f"# TYPE {name} histogram")
+            for stage in sorted(self.buckets):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ["+Inf"], self.buckets[stage]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {self.sums[stage]}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {cumulative}')
+
+            declared = set()
+            for (counter_name, labels), value in sorted(self.counters.items()):
+                full_name = f"{prefix}_{counter_name}_total"
+                if full_name not in declared:
+                    declared.add(full_name)
+                    lines.append(f"# TYPE {full_name} counter")
+                label_text = ",".join(f'{key}="{value1}"' for key, value1 in labels)
+                lines.append(f"{full_name}{{{label_text}}} {value}" if label_text else f"{full_name} {value}")
+
+        for gauge_name, value in sorted(gauges.items()):
+            if value is None:
+                continue
+            full_name = f"{prefix}_{gauge_name}"
+            lines.append(f"# TYPE {full_name} gauge")
+            lines.append(f"{full_name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    Serves the metrics at http://127.0.0.1:<port>/metrics
+    in the Prometheus text format, from a daemon thread.
+    It only listens on localhost, clipboard activity is private.
+    """
+
+    def __init__(self, metrics, port=9464, host="127.0.0.1"):
+        # imported here, it is not needed without --metrics-port.
+        import http.server  # pylint: disable=import-outside-toplevel
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):  # pylint: disable=invalid-name
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.address = "http://%s:%d/metrics" % self.server.server_address[:2]
+        self.thread = threading.Thread(target=self.server.serve_forever, name="shotlast-metrics", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class JsonDumper:
+    """
+    Writes StageTimer.snapshot() to file_name every interval seconds,
+    and once more on close().
+    The file is replaced atomically, so readers never see half of it.
+    """
+
+    def __init__(self, metrics, file_name, interval=60.0):
+        self.metrics = metrics
+        self.file_name = file_name
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._work, name="shotlast-metrics-dump", daemon=True)
+        self.thread.start()
+
+    def dump(self):
+        temp_file_name = self.file_name + ".tmp"
+        with open(temp_file_name, "wt", encoding="utf8") as handle:
+            json.dump(self.metrics.snapshot(), handle, indent=2)
+        os.replace(temp_file_name, self.file_name)
+
+    def _work(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.dump()
+            except OSError as ex1:
+                print(repr(ex1))
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.dump()
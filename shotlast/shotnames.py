@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+shotnames
+Builds the file names of the captures for shotlast.
+
+A name comes from a template, such as the default "clip_{date}_{time}"
+or "{date}/{time}{ms}_{hash}". Names are taken with an atomic
+O_CREAT | O_EXCL create, so there is no probe-then-write race, and the
+clashes (two captures in the same second) are numbered from memory
+("clip_20121212_120102_2"), so no existence checks are needed.
+"""
+
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+# pylint: disable=line-too-long
+
+import argparse
+import datetime
+import os
+import threading
+
+
+DEFAULT_TEMPLATE = "clip_{date}_{time}"
+
+# the fields of a template, with an example value, see --name-template.
+FIELDS = {
+    "date": "20121212",  # year, month, day
+    "time": "120102",  # hour, minute, second
+    "ms": "345",  # milliseconds, 3 digits
+    "us": "345678",  # microseconds, 6 digits
+    "seq": 1,  # a number, counting up from 1 in each session
+    "hash": "0f3a9c1d",  # the first 8 hex digits of the content digest
+    "source": "png",  # the clipboard format, such as "png", "bmp" or "text"
+    "kind": "image",  # "image", "text" or "delta"
+}
+
+
+def check_template(template):
+    """
+    Raises ValueError if the template can not build file names.
+    >>> check_template("clip_{date}_{time}{ms}")
+    >>> check_template("clip_{name}")
+    Traceback (most recent call last):
+    ValueError: unknown field in the name template: {name}
+    """
+    try:
+        name = template.format(**FIELDS)
+    except KeyError as ex1:
+        raise ValueError("unknown field in the name template: {" + ex1.args[0] + "}") from None
+    except (IndexError, ValueError) as ex1:
+        raise ValueError("invalid name template: " + str(ex1)) from None
+    parts = name.replace("\\", "/").split("/")
+    if not name or os.path.isabs(name) or ".." in parts or "" in parts:
+        raise ValueError("the name template must give a relative path: " + template)
+
+
+def parse_template(value):
+    """
+    Checks the value of --name-template.
+    """
+    try:
+        check_template(value)
+    except ValueError as ex1:
+        raise argparse.ArgumentTypeError(str(ex1)) from None
+    return value
+
+
+def create_exclusive(full_file_name):
+    """
+    Creates an empty file, raises FileExistsError if the name is taken.
+    O_CREAT | O_EXCL is atomic, there is no race with another writer.
+    """
+    fd = os.open(full_file_name, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+    os.close(fd)
+
+
+def reserve_path(path, directory=False) -> str:
+    """
+    Creates path, an empty file (or a directory), and returns it.
+    If it is taken, "_2", "_3", ... is added before the extension.
+    For the copied files and directories, which keep their names.
+    """
+    root, extension = (path, "") if directory else os.path.splitext(path)
+    repeat = 1
+    while True:
+        candidate = root + ("" if repeat == 1 else "_" + str(repeat)) + extension
+        try:
+            if directory:
+                os.mkdir(candidate)
+            else:
+                create_exclusive(candidate)
+            return candidate
+        except FileExistsError:
+            repeat += 1
+
+
+class NameBuilder:
+    """
+    Takes unique file names in target_dir.
+    Thread safe: the names of large texts and images are taken in the
+    watcher thread, but nothing stops a worker from taking one.
+
+    template:
+        str, see FIELDS; it may contain "/" for sub directories,
+        which are created when needed.
+    """
+
+    def __init__(self, target_dir, template=DEFAULT_TEMPLATE):
+        check_template(template)
+        self.target_dir = target_dir
+        self.template = template
+        self.numbered = "{seq" in template  # clashes take the next seq, not a suffix
+        self.sequence = 0
+        self.last_stem = None  # the stem of the previous name
+        self.repeats = {}  # extension -> how many times last_stem was used with it
+        self.lock = threading.Lock()
+
+    def format_stem(self, moment, file_format, digest="", source="", kind="image") -> str:
+        """
+        Returns the name without target_dir and extension,
+        and counts the sequence up.
+        """
+        self.sequence += 1
+        return self.template.format(
+            date=moment.strftime("%Y%m%d"),
+            time=moment.strftime("%H%M%S"),
+            ms=f"{moment.microsecond // 1000:03d}",
+            us=f"{moment.microsecond:06d}",
+            seq=self.sequence,
+            hash=(digest or "")[:8],
+            source=source or file_format,
+            kind=kind)
+
+    def _count_stem(self, stem, file_format) -> int:
+        # the clashes of this session are numbered from memory, per
+        # extension: a text and an image of the same second are
+        # clip_X.txt and clip_X.png.
+        if stem != self.last_stem:
+            self.last_stem = stem
+            self.repeats = {}
+        self.repeats[file_format] = self.repeats.get(file_format, 0) + 1
+        return self.repeats[file_format]
+
+    def next_name(self, file_format="png", digest="", source="", kind="image", moment=None) -> str:
+        """
+        Returns a new name relative to target_dir, without creating
+        a file, for captures that are not files (see shotframes).
+        Unique in this session only.
+        """
+        if moment is None:
+            moment = datetime.datetime.now()
+        with self.lock:
+            stem = self.format_stem(moment, file_format, digest, source, kind)
+            repeat = self._count_stem(stem, file_format)
+            name = stem if repeat == 1 else stem + "_" + str(repeat)
+            return name.replace("\\", "/") + "." + file_format
+
+    def reserve(self, file_format="png", digest="", source="", kind="image", moment=None) -> str:
+        """
+        Creates an empty file with a new name and returns its full name.
+        Saves run in the background, so the name is taken before the save
+        is queued; the save then overwrites the empty file.
+        file_format:
+            the extension, such as "png" or "txt.gz".
+        digest:
+            the content digest, for {hash}.
+        source:
+            the clipboard format, for {source}; file_format by default.
+        """
+        if moment is None:
+            moment = datetime.datetime.now()
+        with self.lock:
+            stem = self.format_stem(moment, file_format, digest, source, kind)
+            repeat = self._count_stem(stem, file_format)
+            while True:
+                name = stem if repeat == 1 else stem + "_" + str(repeat)
+                full_file_name = os.path.normpath(os.path.join(self.target_dir, name + "." + file_format))
+                # the normpath is also required since PySimpleGUI uses / on Windows.
+                # C:/Users/caglar/Desktop/gun05\clip_20201204_142219.png
+                try:
+                    create_exclusive(full_file_name)
+                except FileExistsError:
+                    # left by a previous session, or not made by shotlast.
+                    if self.numbered:
+                        stem = self.format_stem(moment, file_format, digest, source, kind)
+                    repeat = self._count_stem(stem, file_format)
+                    continue
+                except FileNotFoundError:
+                    # a sub directory of the template.
+                    directory = os.path.dirname(full_file_name)
+                    if os.path.isdir(directory):
+                        raise
+                    os.makedirs(directory, exist_ok=True)
+                    continue
+                return full_file_name
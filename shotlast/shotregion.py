@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+shotregion
+Finds the changed region between two screenshots for shotlast.
+
+Successive screenshots of a lecture or a video usually differ only in a
+small area, such as the mouse cursor or a clock. Each image is reduced
+to a grid of cells (the mean brightness of cell x cell pixels), and two
+grids are compared with NumPy: the fraction of changed cells tells if
+the change is worth a capture, their bounding box where it is.
+
+requires:
+    pip install numpy
+"""
+
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+# pylint: disable=line-too-long
+
+import collections
+import json
+import os
+import threading
+
+
+# size (in pixels) of a grid cell.
+GRID_CELL = 16
+
+# a cell changed if its mean brightness moved more than this (0 - 255).
+CELL_TOLERANCE = 8
+
+# changes whose box covers at most this fraction of the image can be
+# saved as a cropped delta, see --save-deltas.
+MAX_DELTA_AREA = 0.5
+
+# file of the deltas, in the target directory.
+DELTA_LOG_NAME = ".shotlast_deltas.jsonl"
+
+
+RegionChange = collections.namedtuple("RegionChange", ["fraction", "box"])
+# fraction: float, the fraction of the cells that changed, 0.0 - 1.0.
+# box: (left, top, right, bottom) in pixels of the changed cells,
+#      None if nothing changed.
+
+
+def numpy_available() -> bool:
+    """
+    --compare region needs numpy:
+        pip install numpy
+    """
+    try:
+        import numpy  # pylint: disable=import-outside-toplevel,unused-import
+    except ImportError:
+        return False
+    return True
+
+
+def get_image_grid(image, cell=GRID_CELL):
+    """
+    Returns a 2D uint8 numpy array, the mean brightness of every
+    cell x cell block of the image (the partial blocks at the right and
+    bottom edges included).
+    The reduction runs in Pillow (C), the array is small: 8K is 480x270.
+    """
+    import numpy  # pylint: disable=import-outside-toplevel
+
+    if image.mode not in ("L", "RGB", "RGBA"):
+        image = image.convert("RGB")
+    return numpy.asarray(image.convert("L").reduce(cell), dtype=numpy.uint8)
+
+
+def compare_grids(grid1, grid2, size, cell=GRID_CELL, tolerance=CELL_TOLERANCE) -> RegionChange:
+    """
+    Returns the RegionChange from grid1 to grid2, the grids of two images
+    of the same size (width, height).
+    """
+    import numpy  # pylint: disable=import-outside-toplevel
+
+    if grid1.shape != grid2.shape:
+        return RegionChange(1.0, (0, 0) + tuple(size))
+    changed = numpy.abs(grid1.astype(numpy.int16) - grid2.astype(numpy.int16)) > tolerance
+    count = int(numpy.count_nonzero(changed))
+    if not count:
+        return RegionChange(0.0, None)
+    rows = numpy.flatnonzero(changed.any(axis=1))
+    cols = numpy.flatnonzero(changed.any(axis=0))
+    box = (int(cols[0]) * cell, int(rows[0]) * cell,
+           min(size[0], (int(cols[-1]) + 1) * cell), min(size[1], (int(rows[-1]) + 1) * cell))
+    return RegionChange(count / changed.size, box)
+
+
+def box_area_fraction(box, size) -> float:
+    """
+    >>> box_area_fraction((0, 0, 50, 100), (100, 100))
+    0.5
+    """
+    return (box[2] - box[0]) * (box[3] - box[1]) / float(size[0] * size[1])
+
+
+class DeltaLog:
+    """
+    Appends a JSON line per saved delta to .shotlast_deltas.jsonl:
+        {"file": "clip_..._2.png", "keyframe": "clip_....png",
+         "box": [left, top, right, bottom], "size": [width, height]}
+    A frame is its keyframe with the delta pasted at (left, top).
+    Names are relative to the target directory.
+    """
+
+    def __init__(self, target_dir):
+        self.target_dir = target_dir
+        self.file_name = os.path.join(target_dir, DELTA_LOG_NAME)
+        self.handle = None
+        self.lock = threading.Lock()
+
+    def add(self, full_file_name, keyframe_file_name, box, size):
+        record = {
+            "file": os.path.relpath(full_file_name, self.target_dir).replace(os.sep, "/"),
+            "keyframe": os.path.relpath(keyframe_file_name, self.target_dir).replace(os.sep, "/"),
+            "box": list(box),
+            "size": list(size),
+        }
+        with self.lock:
+            if self.handle is None:
+                self.handle = open(self.file_name, "a", encoding="utf-8")  # pylint: disable=consider-using-with
+            self.handle.write(json.dumps(record) + "\n")
+            self.handle.flush()
+
+    def close(self):
+        with self.lock:
+            if self.handle is not None:
+                self.handle.close()
+                self.handle = None
+
+
+def read_delta_references(target_dir) -> set:
+    """
+    Returns the full names of the files that the delta log of target_dir
+    needs to rebuild its frames: the deltas and their keyframes.
+    Empty if there is no delta log.
+    """
+    references = set()
+    file_name = os.path.join(target_dir, DELTA_LOG_NAME)
+    if not os.path.isfile(file_name):
+        return references
+    with open(file_name, "rt", encoding="utf-8") as handle:
+        for line in handle:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut by a crash
+            for key in ("file", "keyframe"):
+                if record.get(key):
+                    references.add(os.path.normpath(os.path.join(target_dir, record[key])))
+    return references
@@ -0,0 +1,499 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+shotsearch
+Full-text search over the saved clipboard texts for shotlast.
+
+Each target directory gets a SQLite FTS5 index of its texts,
+.shotlast_search.sqlite next to the content index. The watcher adds
+every saved text on a background worker (TextIndexer), so indexing
+never delays a capture. "shotlast search" first indexes the text files
+that are new or changed since the last run, reading them in parallel
+(update_index()), then ranks the matches with BM25:
+
+    shotlast search "connection refused" --dir /data/clips
+
+Only the first INDEX_LIMIT bytes of a text are indexed.
+"""
+
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+# pylint: disable=line-too-long
+
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import gzip
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import click
+
+import shottext
+import shotwriter
+
+
+SEARCH_FILE_NAME = ".shotlast_search.sqlite"
+
+# the saved texts, compressed or not, see shottext.EXTENSIONS.
+TEXT_EXTENSIONS = tuple("." + extension for extension in shottext.EXTENSIONS.values())
+
+# bytes of a text that are indexed, the rest of a large log is not searchable.
+INDEX_LIMIT = 4 * 1024 * 1024
+
+# below this many new files, update_index() reads them without worker processes.
+PARALLEL_MIN_FILES = 16
+
+# rows inserted per transaction by update_index().
+BATCH_SIZE = 256
+
+# longer words are cut in the snippets, such as base64 blobs.
+SNIPPET_WORD = 40
+
+# markers of the matched terms in the snippets.
+_MATCH_START = "\x02"
+_MATCH_END = "\x03"
+
+
+SearchHit = collections.namedtuple("SearchHit", ["path", "saved_at", "snippet"])
+# path: str, relative to the target directory, with "/".
+# saved_at: float, timestamp.
+# snippet: str, the matched terms between _MATCH_START and _MATCH_END.
+
+
+def fts5_available() -> bool:
+    """
+    FTS5 is compiled into the SQLite of most Python builds, not all.
+    """
+    try:
+        connection = sqlite3.connect(":memory:")
+        try:
+            connection.execute("CREATE VIRTUAL TABLE probe USING fts5(body)")
+        finally:
+            connection.close()
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+def build_match_query(query: str) -> str:
+    """
+    Turns the words of a query into an FTS5 query matching the texts
+    that contain all of them. Every word is quoted, so punctuation is
+    not FTS5 syntax; a trailing * still matches a prefix.
+    >>> build_match_query('connection refused')
+    '"connection" "refused"'
+    >>> build_match_query('ssh-keygen conf*')
+    '"ssh-keygen" "conf"*'
+    >>> build_match_query('x"y')
+    '"x""y"'
+    """
+    terms = []
+    for word in query.split():
+        prefix = word.endswith("*") and len(word) > 1
+        if prefix:
+            word = word[:-1]
+        terms.append('"' + word.replace('"', '""') + '"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def _read_limited(handle, limit):
+    chunks = []
+    while limit > 0:
+        chunk = handle.read(min(limit, 256 * 1024))
+        if not chunk:
+            break
+        chunks.append(chunk)
+        limit -= len(chunk)
+    return b"".join(chunks)
+
+
+def read_text_file(file_name, limit=INDEX_LIMIT) -> str:
+    """
+    Returns the first limit bytes of a saved text, decompressed.
+    """
+    if file_name.endswith(".gz"):
+        with gzip.open(file_name, "rb") as handle:
+            content = _read_limited(handle, limit)
+    elif file_name.endswith(".zst"):
+        import zstandard  # pylint: disable=import-outside-toplevel
+        with open(file_name, "rb") as raw, zstandard.ZstdDecompressor().stream_reader(raw) as handle:
+            content = _read_limited(handle, limit)
+    else:
+        with open(file_name, "rb") as handle:
+            content = _read_limited(handle, limit)
+    return content.decode("utf-8", errors="replace")
+
+
+class TextIndex:
+    """
+    The FTS5 index of the texts of a target directory.
+    A text is found by its path, relative to target_dir, so the
+    directory can be moved. The size and mtime of its file tell
+    update_index() whether it changed.
+
+    The database is opened lazily. Safe to use from multiple threads.
+    """
+
+    def __init__(self, target_dir):
+        self.target_dir = target_dir
+        self.file_name = os.path.join(target_dir, SEARCH_FILE_NAME)
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.file_name, check_same_thread=False)
+            # the watcher writes while "shotlast search" reads.
+            self.connection.execute("PRAGMA journal_mode = WAL")
+            self.connection.execute("PRAGMA synchronous = NORMAL")
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT NOT NULL UNIQUE,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    saved_at REAL NOT NULL
+                );
+                CREATE VIRTUAL TABLE IF NOT EXISTS texts USING fts5(
+                    body, tokenize = 'unicode61 remove_diacritics 2'
+                );
+            """)
+        return self.connection
+
+    def relative_path(self, full_file_name) -> str:
+        return os.path.relpath(full_file_name, self.target_dir).replace(os.sep, "/")
+
+    def _add(self, connection, path, text, size, mtime, saved_at):
+        row = connection.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            rowid = connection.execute(
+                "INSERT INTO files (path, size, mtime, saved_at) VALUES (?, ?, ?, ?)",
+                (path, size, mtime, saved_at)).lastrowid
+        else:
+            rowid = row[0]
+            connection.execute("UPDATE files SET size = ?, mtime = ?, saved_at = ? WHERE id = ?",
+                               (size, mtime, saved_at, rowid))
+            connection.execute("DELETE FROM texts WHERE rowid = ?", (rowid,))
+        connection.execute("INSERT INTO texts (rowid, body) VALUES (?, ?)", (rowid, text))
+
+    def add(self, full_file_name, text, size, mtime, saved_at=None):
+        """
+        Indexes (or re-indexes) the text saved as full_file_name.
+        """
+        if saved_at is None:
+            saved_at = mtime
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                self._add(connection, self.relative_path(full_file_name), text, size, mtime, saved_at)
+
+    def add_many(self, items):
+        """
+        Indexes (full_file_name, text, size, mtime) items in one transaction.
+        """
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                for full_file_name, text, size, mtime in items:
+                    self._add(connection, self.relative_path(full_file_name), text, size, mtime, mtime)
+
+    def remove(self, paths):
+        """
+        Removes the texts of the given relative paths.
+        """
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                for path in paths:
+                    row = connection.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+                    if row is not None:
+                        connection.execute("DELETE FROM texts WHERE rowid = ?", row)
+                        connection.execute("DELETE FROM files WHERE id = ?", row)
+
+    def replace_path(self, old_file_name, new_file_name):
+        """
+        Points the text indexed as old_file_name to new_file_name, used
+        when a duplicate file is deleted. If new_file_name is indexed
+        too, the row of old_file_name is removed instead.
+        """
+        old_path = self.relative_path(old_file_name)
+        new_path = self.relative_path(new_file_name)
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                if connection.execute("SELECT id FROM files WHERE path = ?", (new_path,)).fetchone() is None:
+                    connection.execute("UPDATE files SET path = ? WHERE path = ?", (new_path, old_path))
+                    return
+                row = connection.execute("SELECT id FROM files WHERE path = ?", (old_path,)).fetchone()
+                if row is not None:
+                    connection.execute("DELETE FROM texts WHERE rowid = ?", row)
+                    connection.execute("DELETE FROM files WHERE id = ?", row)
+
+    def clear(self):
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM texts")
+                connection.execute("DELETE FROM files")
+
+    def known_files(self) -> dict:
+        """
+        Returns {relative path: (size, mtime)} of the indexed texts.
+        """
+        with self.lock:
+            connection = self._connect()
+            rows = connection.execute("SELECT path, size, mtime FROM files").fetchall()
+        return {path: (size, mtime) for path, size, mtime in rows}
+
+    def count(self) -> int:
+        with self.lock:
+            return self._connect().execute("SELECT count(*) FROM files").fetchone()[0]
+
+    def search(self, match_query, limit=20):
+        """
+        Returns a list of SearchHit, the best BM25 rank first.
+        Raises sqlite3.OperationalError if match_query is not a valid
+        FTS5 query.
+        """
+        sql = ("SELECT files.path, files.saved_at, "
+               "snippet(texts, 0, ?, ?, '...', 16) "
+               "FROM texts JOIN files ON files.id = texts.rowid "
+               "WHERE texts MATCH ? ORDER BY rank LIMIT ?")
+        with self.lock:
+            rows = self._connect().execute(sql, (_MATCH_START, _MATCH_END, match_query, limit)).fetchall()
+        return [SearchHit(*row) for row in rows]
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+class TextIndexer:
+    """
+    Indexes the texts saved by the watcher on a single worker thread.
+    submit() only queues the text, which is already in memory, so the
+    saved file is never read again (with "--sink archive" it may be
+    gone soon).
+
+    metrics:
+        optional shotmetrics.StageTimer, the worker records the "index"
+        stage and the "indexed" counter.
+    """
+
+    def __init__(self, target_dir, metrics=None, depth=64):
+        self.index = TextIndex(target_dir)
+        self.metrics = metrics
+        self.queue = shotwriter.SaveQueue(workers=1, depth=depth)
+        self.queue.metrics = metrics
+        if metrics is not None:
+            metrics.set_gauge("index_queue_depth", self.queue.pending)
+
+    def _index(self, full_file_name, content, size, mtime, saved_at):
+        start = time.perf_counter()
+        text = content[:INDEX_LIMIT].decode("utf-8", errors="replace")
+        self.index.add(full_file_name, text, size, mtime, saved_at)
+        if self.metrics is not None:
+            self.metrics.record("index", time.perf_counter() - start)
+            self.metrics.increment("indexed", kind="text")
+
+    def submit(self, full_file_name, content: bytes):
+        """
+        Queues the text (UTF-8 bytes, at least its first INDEX_LIMIT
+        bytes) saved as full_file_name, which must exist.
+        """
+        stat = os.stat(full_file_name)
+        self.queue.submit(lambda: self._index(full_file_name, content, stat.st_size, stat.st_mtime, time.time()))
+
+    def close(self):
+        """
+        Waits for the pending texts.
+        """
+        self.queue.close()
+        self.index.close()
+
+
+def iter_text_files(directory):
+    """
+    Yields the os.DirEntry of the saved texts under directory,
+    skipping the hidden files and directories.
+    """
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_text_files(entry.path)
+            elif entry.is_file(follow_symlinks=False) and entry.name.endswith(TEXT_EXTENSIONS):
+                yield entry
+
+
+def _read_worker(item):
+    """
+    Runs in a worker process. Returns (path, text, size, mtime),
+    text is None if the file can not be read.
+    """
+    path, size, mtime = item
+    try:
+        return path, read_text_file(path), size, mtime
+    except Exception:  # pylint: disable=broad-except
+        return path, None, size, mtime
+
+
+UpdateResult = collections.namedtuple("UpdateResult", ["indexed", "pruned", "failed", "total"])
+
+
+def update_index(index, prune=False, jobs=None):
+    """
+    Indexes the text files of index.target_dir that are new or changed
+    since they were indexed. The files are read and decompressed in
+    jobs worker processes (number of CPUs by default), the index is
+    written in batches from this thread.
+    prune:
+        also removes the texts whose file is gone, such as the ones
+        moved into an archive by "--sink archive".
+    Returns an UpdateResult.
+    """
+    known = index.known_files()
+    stale = []
+    seen = set()
+    for entry in iter_text_files(index.target_dir):
+        path = index.relative_path(entry.path)
+        seen.add(path)
+        stat = entry.stat(follow_symlinks=False)
+        if known.get(path) != (stat.st_size, stat.st_mtime):
+            stale.append((entry.path, stat.st_size, stat.st_mtime))
+
+    pruned = [path for path in known if path not in seen] if prune else []
+    if pruned:
+        index.remove(pruned)
+
+    indexed = failed = 0
+    batch = []
+    executor = None
+    if len(stale) >= PARALLEL_MIN_FILES and jobs != 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+    try:
+        results = executor.map(_read_worker, stale, chunksize=16) if executor is not None else map(_read_worker, stale)
+        for full_file_name, text, size, mtime in results:
+            if text is None:
+                failed += 1
+                continue
+            batch.append((full_file_name, text, size, mtime))
+            if len(batch) >= BATCH_SIZE:
+                index.add_many(batch)
+                indexed += len(batch)
+                batch = []
+        if batch:
+            index.add_many(batch)
+            indexed += len(batch)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return UpdateResult(indexed, len(pruned), failed, index.count())
+
+
+def format_snippet(snippet) -> str:
+    """
+    Highlights the matched terms of a snippet, on a single line.
+    """
+    words = []
+    for word in snippet.split():
+        if len(word) > SNIPPET_WORD and _MATCH_START not in word:
+            word = word[:SNIPPET_WORD] + "..."
+        words.append(word)
+    snippet = " ".join(words)
+    parts = []
+    for i, part in enumerate(snippet.split(_MATCH_START)):
+        if i == 0:
+            parts.append(part)
+            continue
+        match, _, rest = part.partition(_MATCH_END)
+        parts.append(click.style(match, fg="yellow", bold=True) + rest)
+    return "".join(parts)
+
+
+def main(arguments=None):
+    """
+    shotlast search <query> [--dir DIR] [--limit N] [--no-update] [--rebuild] [--prune] [--jobs N] [--raw]
+    """
+    parser = argparse.ArgumentParser(prog="shotlast search", description="Searches the saved clipboard texts.")
+
+    help1 = 'Words that the texts must all contain. A word ending with * matches its prefix, such as "conf*".'
+    parser.add_argument('query', nargs='+', help=help1)
+
+    help1 = "Directory with the saved texts, the current directory by default."
+    parser.add_argument('--dir', dest='directory', help=help1, default=".")
+
+    help1 = "Maximum number of results."
+    parser.add_argument('--limit', type=int, help=help1, default=20)
+
+    help1 = "Searches the index as it is, without indexing the new text files first."
+    parser.add_argument('--no-update', action='store_true', help=help1)
+
+    help1 = "Indexes all the text files again."
+    parser.add_argument('--rebuild', action='store_true', help=help1)
+
+    help1 = 'Removes the texts whose file is gone, including the ones moved into an archive by "--sink archive".'
+    parser.add_argument('--prune', action='store_true', help=help1)
+
+    help1 = 'Number of worker processes reading the new text files. Default: number of CPUs.'
+    parser.add_argument('--jobs', type=int, help=help1, default=None)
+
+    help1 = 'The query is in the FTS5 syntax, such as "error AND NOT warning" or "NEAR(disk full)".'
+    parser.add_argument('--raw', action='store_true', help=help1)
+
+    args = parser.parse_args(arguments)
+
+    if not os.path.isdir(args.directory):
+        click.secho("Not a directory: " + str(args.directory), fg="red")
+        return 1
+
+    if not fts5_available():
+        click.secho("The SQLite of this Python has no FTS5, search is not available.", fg="red")
+        return 1
+
+    query = " ".join(args.query)
+    match_query = query if args.raw else build_match_query(query)
+    index = TextIndex(args.directory)
+    try:
+        if args.rebuild:
+            index.clear()
+        if not args.no_update:
+            start = time.perf_counter()
+            result = update_index(index, args.prune, args.jobs)
+            if result.indexed or result.pruned or result.failed:
+                elapsed = (time.perf_counter() - start) * 1000
+                click.secho(f"indexed {result.indexed} texts, pruned {result.pruned}, "
+                            f"{result.failed} unreadable, in {elapsed:.0f} ms.", fg="yellow")
+
+        start = time.perf_counter()
+        try:
+            hits = index.search(match_query, args.limit)
+        except sqlite3.OperationalError as ex1:
+            click.secho("Invalid query: " + str(ex1), fg="red")
+            return 1
+        elapsed = (time.perf_counter() - start) * 1000
+
+        for hit in hits:
+            moment = datetime.datetime.fromtimestamp(hit.saved_at).isoformat(sep=" ", timespec="seconds")
+            click.secho(hit.path, fg="green", nl=False)
+            click.secho(f"  {moment}")
+            click.echo("    " + format_snippet(hit.snippet))
+        click.secho(f"{len(hits)} results in {elapsed:.1f} ms, {index.count()} texts indexed.")
+    finally:
+        index.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+shottext
+Streams clipboard text to disk for shotlast.
+
+A copied log can be hundreds of megabytes. TextCapture receives the
+text in chunks from the backend, hashes it on the fly and keeps only
+the first megabyte in memory; the rest goes to a temporary file.
+Once saved, large texts can be compressed with gzip or zstd.
+"""
+
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-with
+
+import gzip
+import io
+import os
+import tempfile
+
+import shothash
+
+
+# compressions of large texts, see --compress-text.
+COMPRESSIONS = ["none", "gzip", "zstd"]
+
+# file name extensions of the compressed texts.
+EXTENSIONS = {"none": "txt", "gzip": "txt.gz", "zstd": "txt.zst"}
+
+
+def zstd_available() -> bool:
+    """
+    zstd needs the optional zstandard package:
+        pip install zstandard
+    """
+    try:
+        import zstandard  # pylint: disable=import-outside-toplevel,unused-import
+    except ImportError:
+        return False
+    return True
+
+
+def open_compressed(file_name, compression):
+    """
+    Returns a binary file object that compresses what is written to it.
+    """
+    if compression == "gzip":
+        return gzip.open(file_name, "wb", compresslevel=6)
+    if compression == "zstd":
+        import zstandard  # pylint: disable=import-outside-toplevel
+        return zstandard.ZstdCompressor(level=3).stream_writer(open(file_name, "wb"), closefd=True)
+    return open(file_name, "wb")
+
+
+class TextCapture:
+    """
+    Collects the chunks (UTF-8 bytes) of a clipboard text.
+    The digest is updated chunk by chunk, so the full text is never
+    needed as a single str.
+
+    spill_size:
+        bytes kept in memory, the rest is written to a temporary
+        file in temp_dir.
+    """
+
+    def __init__(self, temp_dir=None, spill_size=1024 * 1024):
+        self.temp_dir = temp_dir
+        self.spill_size = spill_size
+        self.hasher = shothash.new_content_hasher()
+        self.buffer = io.BytesIO()
+        self.spill = None  # temporary file, once the buffer is full
+        self.size = 0
+        self.blank = True  # True until a non whitespace byte is seen
+
+    def write(self, chunk: bytes):
+        self.hasher.update(chunk)
+        self.size += len(chunk)
+        if self.blank and chunk.strip():
+            self.blank = False
+        if self.spill is None and self.buffer.tell() + len(chunk) > self.spill_size:
+            self.spill = tempfile.TemporaryFile(prefix="shotlast_", suffix=".part", dir=self.temp_dir)
+        if self.spill is None:
+            self.buffer.write(chunk)
+        else:
+            self.spill.write(chunk)
+
+    def hexdigest(self) -> str:
+        return self.hasher.hexdigest()
+
+    def iter_chunks(self, chunk_size=256 * 1024):
+        """
+        Yields the collected text again, from the start.
+        """
+        yield self.buffer.getbuffer().tobytes()
+        if self.spill is not None:
+            self.spill.seek(0)
+            yield from iter(lambda: self.spill.read(chunk_size), b"")
+
+    def head(self, size) -> bytes:
+        """
+        Returns the first size bytes of the collected text.
+        """
+        chunks = []
+        for chunk in self.iter_chunks():
+            chunks.append(chunk[:size])
+            size -= len(chunks[-1])
+            if size <= 0:
+                break
+        return b"".join(chunks)
+
+    def save(self, full_file_name, compression="none"):
+        """
+        Writes the collected text to full_file_name, compressed or not.
+        Returns the size of the written file.
+        """
+        with open_compressed(full_file_name, compression) as handle:
+            for chunk in self.iter_chunks():
+                handle.write(chunk)
+        return os.path.getsize(full_file_name)
+
+    def close(self):
+        self.buffer = io.BytesIO()
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def save_text_capture(capture, full_file_name, compression="none", metrics=None):
+    """
+    Saves the capture, then releases it.
+    This is what a SaveQueue worker runs for large texts.
+    """
+    try:
+        if metrics is None:
+            return capture.save(full_file_name, compression)
+        with metrics.time("encode" if compression != "none" else "write"):
+            return capture.save(full_file_name, compression)
+    finally:
+        capture.close()
+
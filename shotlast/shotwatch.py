@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+shotwatch
+Clipboard change notification backends for shotlast.
+
+A watcher blocks in wait() until the clipboard (probably) changed.
+    XFixesWatcher  : Linux, XFixes selection owner notifications.
+    WindowsWatcher : Windows, AddClipboardFormatListener/WM_CLIPBOARDUPDATE.
+    PollingWatcher : everywhere, wakes up at a fixed period.
+    AdaptivePollingWatcher : everywhere, polls fast after a change and
+                     backs off while the clipboard is idle.
+"""
+
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+# pylint: disable=line-too-long
+# pylint: disable=too-few-public-methods
+
+import ctypes
+import os
+import select
+import sys
+import threading
+import time
+
+import shotx11
+
+
+class ClipboardWatcher:
+    """
+    The base class for clipboard watchers.
+    """
+
+    # short name, printed when shotlast starts.
+    name = "base"
+
+    def wait(self, timeout=None) -> bool:
+        """
+        Blocks until the clipboard changes or timeout (in seconds) expires.
+        timeout None means wait forever.
+        Returns True if a change was reported, False on timeout.
+        """
+        msg = "Do not call wait() of the base class."
+        raise NotImplementedError(msg)
+
+    def notify(self, changed: bool):
+        """
+        Called after each check with whether the clipboard had
+        something new. Only the adaptive watcher uses it.
+        """
+
+    def close(self):
+        """
+        Releases the OS resources of the watcher.
+        """
+
+
+class PollingWatcher(ClipboardWatcher):
+    """
+    The fallback watcher: it does not know anything about the clipboard,
+    it simply reports a "change" after each period.
+    Wake ups are scheduled from the previous wake up, not from the end
+    of the check, so the time spent checking does not make the period
+    drift. If a check takes longer than the period, the next one starts
+    right away, and the missed wake ups are skipped.
+    """
+
+    name = "poll"
+
+    def __init__(self, period=2.0):
+        self.period = float(period)
+        self.last_wake = None
+
+    def wait(self, timeout=None) -> bool:
+        now = time.monotonic()
+        if self.last_wake is None:
+            self.last_wake = now
+        next_wake = max(now, self.last_wake + self.period)
+        if timeout is not None and next_wake - now > timeout:
+            time.sleep(max(0.0, timeout))
+            return False
+        time.sleep(next_wake - now)
+        self.last_wake = next_wake
+        return True
+
+
+class AdaptivePollingWatcher(PollingWatcher):
+    """
+    A PollingWatcher whose period follows the clipboard activity:
+    right after a change it polls every min_period seconds, so bursts
+    (such as a series of screenshots) are not missed. Every check
+    without a change multiplies the period by backoff, up to max_period,
+    so an idle clipboard costs almost nothing.
+    """
+
+    name = "adaptive"
+
+    def __init__(self, min_period=0.1, max_period=2.0, backoff=2.0):
+        self.min_period = float(min_period)
+        self.max_period = max(float(max_period), self.min_period)
+        self.backoff = max(1.0, float(backoff))
+        super().__init__(self.max_period)
+
+    def notify(self, changed: bool):
+        if changed:
+            self.period = self.min_period
+        else:
+            self.period = min(self.max_period, self.period * self.backoff)
+
+
+# X11 / XFixes __________________________________________________
+
+
+# from X11/extensions/Xfixes.h
+_XFixesSelectionNotify = 0
+_XFixesSetSelectionOwnerNotifyMask = 1 << 0
+_XFixesSelectionWindowDestroyNotifyMask = 1 << 1
+_XFixesSelectionClientCloseNotifyMask = 1 << 2
+
+
+class XFixesWatcher(ClipboardWatcher):
+    """
+    Linux watcher, uses XFixes selection owner notifications.
+    Every time an application takes the ownership of a watched selection
+    (in other words, every copy), the X server sends us an event.
+    Waiting is done with select() on the X connection, so it uses no CPU
+    while idle.
+
+    requires:
+        libX11 and libXfixes, and a running X server (or Xvfb).
+    """
+
+    name = "xfixes"
+
+    def __init__(self, selections=("CLIPBOARD",)):
+        self.xlib = shotx11.load_xlib()
+        self.xfixes = shotx11.load_library("Xfixes")
+        if self.xfixes is None:
+            raise OSError("libXfixes could not be loaded.")
+
+        xlib = self.xlib
+        self.xfixes.XFixesQueryExtension.argtypes = [
+            ctypes.c_void_p, ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int)]
+        self.xfixes.XFixesSelectSelectionInput.argtypes = [
+            ctypes.c_void_p, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_ulong]
+
+        self.display = xlib.XOpenDisplay(None)
+        if not self.display:
+            raise OSError("Can not open X display: " + str(os.environ.get("DISPLAY")))
+
+        event_base = ctypes.c_int()
+        error_base = ctypes.c_int()
+        if not self.xfixes.XFixesQueryExtension(self.display, ctypes.byref(event_base), ctypes.byref(error_base)):
+            xlib.XCloseDisplay(self.display)
+            self.display = None
+            raise OSError("X server does not support XFixes.")
+        self.notify_event = event_base.value + _XFixesSelectionNotify
+
+        root = xlib.XDefaultRootWindow(self.display)
+        mask = (_XFixesSetSelectionOwnerNotifyMask |
+                _XFixesSelectionWindowDestroyNotifyMask |
+                _XFixesSelectionClientCloseNotifyMask)
+        for selection in selections:
+            atom = xlib.XInternAtom(self.display, selection.encode("ascii"), 0)
+            self.xfixes.XFixesSelectSelectionInput(self.display, root, atom, mask)
+        xlib.XFlush(self.display)
+        self.fd = xlib.XConnectionNumber(self.display)
+
+    def _drain_events(self) -> bool:
+        """
+        Reads all the queued events, returns True if any of them is
+        a selection notification.
+        """
+        changed = False
+        event = shotx11.XEvent()
+        while self.xlib.XPending(self.display):
+            self.xlib.XNextEvent(self.display, ctypes.byref(event))
+            if event.type == self.notify_event:
+                changed = True
+        return changed
+
+    def wait(self, timeout=None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self._drain_events():
+                return True
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+            select.select([self.fd], [], [], remaining)
+
+    def close(self):
+        if self.display:
+            self.xlib.XCloseDisplay(self.display)
+            self.display = None
+
+
+# Windows _______________________________________________________
+
+
+_WM_CLIPBOARDUPDATE = 0x031D
+_HWND_MESSAGE = -3
+_QS_ALLINPUT = 0x04FF
+_PM_REMOVE = 0x0001
+_WAIT_TIMEOUT = 0x00000102
+_INFINITE = 0xFFFFFFFF
+
+
+class WindowsWatcher(ClipboardWatcher):
+    """
+    Windows watcher, registers a message-only window with
+    AddClipboardFormatListener and waits for WM_CLIPBOARDUPDATE.
+    Available on Windows Vista and later.
+
+    WM_CLIPBOARDUPDATE is posted to the queue of the thread that owns
+    the window, and only that thread can pump it. wait() usually runs on
+    another thread than the constructor (see shotasync), so the window
+    is created by the first wait(), in the thread that then pumps it.
+    The constructor only checks that a listener window can be created.
+    """
+
+    name = "wm_clipboardupdate"
+
+    def __init__(self):
+        from ctypes import wintypes  # pylint: disable=import-outside-toplevel
+
+        self.user32 = ctypes.WinDLL("user32", use_last_error=True)
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        user32 = self.user32
+        self.changed = False
+        self.hwnd = None  # the listener window, see _open_window()
+        self.thread_id = None  # the thread that owns (and pumps) hwnd
+
+        LRESULT = ctypes.c_ssize_t
+        WNDPROC = ctypes.WINFUNCTYPE(LRESULT, wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM)
+
+        class WNDCLASSW(ctypes.Structure):
+            _fields_ = [
+                ("style", wintypes.UINT),
+                ("lpfnWndProc", WNDPROC),
+                ("cbClsExtra", ctypes.c_int),
+                ("cbWndExtra", ctypes.c_int),
+                ("hInstance", wintypes.HINSTANCE),
+                ("hIcon", wintypes.HICON),
+                ("hCursor", wintypes.HANDLE),
+                ("hbrBackground", wintypes.HBRUSH),
+                ("lpszMenuName", wintypes.LPCWSTR),
+                ("lpszClassName", wintypes.LPCWSTR),
+            ]
+
+        user32.DefWindowProcW.restype = LRESULT
+        user32.DefWindowProcW.argtypes = [wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM]
+        user32.RegisterClassW.argtypes = [ctypes.POINTER(WNDCLASSW)]
+        user32.CreateWindowExW.restype = wintypes.HWND
+        user32.CreateWindowExW.argtypes = [
+            wintypes.DWORD, wintypes.LPCWSTR, wintypes.LPCWSTR, wintypes.DWORD,
+            ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int,
+            wintypes.HWND, wintypes.HMENU, wintypes.HINSTANCE, wintypes.LPVOID]
+        user32.AddClipboardFormatListener.argtypes = [wintypes.HWND]
+        user32.RemoveClipboardFormatListener.argtypes = [wintypes.HWND]
+        user32.DestroyWindow.argtypes = [wintypes.HWND]
+        user32.MsgWaitForMultipleObjects.argtypes = [
+            wintypes.DWORD, ctypes.c_void_p, wintypes.BOOL, wintypes.DWORD, wintypes.DWORD]
+        user32.MsgWaitForMultipleObjects.restype = wintypes.DWORD
+        user32.PeekMessageW.argtypes = [
+            ctypes.POINTER(wintypes.MSG), wintypes.HWND, wintypes.UINT, wintypes.UINT, wintypes.UINT]
+        user32.TranslateMessage.argtypes = [ctypes.POINTER(wintypes.MSG)]
+        user32.DispatchMessageW.argtypes = [ctypes.POINTER(wintypes.MSG)]
+        kernel32.GetModuleHandleW.restype = wintypes.HMODULE
+        kernel32.GetModuleHandleW.argtypes = [wintypes.LPCWSTR]
+
+        def window_proc(hwnd, msg, wparam, lparam):
+            if msg == _WM_CLIPBOARDUPDATE:
+                self.changed = True
+                return 0
+            return user32.DefWindowProcW(hwnd, msg, wparam, lparam)
+
+        # keep a reference, otherwise the callback is garbage collected.
+        self._window_proc = WNDPROC(window_proc)
+        self._msg_type = wintypes.MSG
+
+        self.h_instance = kernel32.GetModuleHandleW(None)
+        self.class_name = "shotlast_clipboard_watcher"
+        wndclass = WNDCLASSW()
+        wndclass.lpfnWndProc = self._window_proc
+        wndclass.hInstance = self.h_instance
+        wndclass.lpszClassName = self.class_name
+        # registering twice fails with ERROR_CLASS_ALREADY_EXISTS, that is fine.
+        user32.RegisterClassW(ctypes.byref(wndclass))
+
+        # raises OSError now rather than in wait(), so create_watcher()
+        # can fall back to polling.
+        self._destroy_window(self._create_window())
+
+    def _create_window(self):
+        hwnd = self.user32.CreateWindowExW(
+            0, self.class_name, "shotlast", 0, 0, 0, 0, 0,
+            _HWND_MESSAGE, None, self.h_instance, None)
+        if not hwnd:
+            raise ctypes.WinError(ctypes.get_last_error())
+        if not self.user32.AddClipboardFormatListener(hwnd):
+            error = ctypes.get_last_error()
+            self.user32.DestroyWindow(hwnd)
+            raise ctypes.WinError(error)
+        return hwnd
+
+    def _destroy_window(self, hwnd):
+        self.user32.RemoveClipboardFormatListener(hwnd)
+        self.user32.DestroyWindow(hwnd)
+
+    def _open_window(self):
+        # the window must belong to the thread that pumps its messages.
+        if self.hwnd is None or self.thread_id != threading.get_ident():
+            self.hwnd = self._create_window()
+            self.thread_id = threading.get_ident()
+
+    def _pump_messages(self):
+        msg = self._msg_type()
+        while self.user32.PeekMessageW(ctypes.byref(msg), None, 0, 0, _PM_REMOVE):
+            self.user32.TranslateMessage(ctypes.byref(msg))
+            self.user32.DispatchMessageW(ctypes.byref(msg))
+
+    def wait(self, timeout=None) -> bool:
+        self._open_window()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self._pump_messages()
+            if self.changed:
+                self.changed = False
+                return True
+            milliseconds = _INFINITE
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                milliseconds = int(remaining * 1000)
+            self.user32.MsgWaitForMultipleObjects(0, None, False, milliseconds, _QS_ALLINPUT)
+
+    def close(self):
+        # only the owner thread can destroy the window; when that thread
+        # has already ended, Windows destroyed its windows with it.
+        if self.hwnd and self.thread_id == threading.get_ident():
+            self._destroy_window(self.hwnd)
+        self.hwnd = None
+
+
+def create_watcher(mode="auto", period=2.0, selections=("CLIPBOARD",), min_period=0.1):
+    """
+    Returns a watcher for the current platform.
+    mode:
+        "event": native change notifications, raises OSError if not possible.
+        "poll": PollingWatcher with the given period.
+        "adaptive": AdaptivePollingWatcher, from min_period up to period.
+        "auto": "event" if possible, "adaptive" otherwise.
+    """
+    if mode == "poll":
+        return PollingWatcher(period)
+    if mode == "adaptive":
+        return AdaptivePollingWatcher(min_period, period)
+
+    try:
+        if sys.platform.startswith('win32'):
+            return WindowsWatcher()
+        if sys.platform.startswith('linux'):
+            return XFixesWatcher(selections)
+        raise OSError("No clipboard change notifications for " + sys.platform)
+    except Exception:  # pylint: disable=broad-except
+        if mode == "event":
+            raise
+        return AdaptivePollingWatcher(min_period, period)
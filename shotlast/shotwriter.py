@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+shotwriter
+Background writers for shotlast.
+
+Encoding a large screenshot can take hundreds of milliseconds.
+SaveQueue runs the saves on worker threads, so the clipboard watcher
+can go straight back to watching.
+Pillow and zlib release the GIL while encoding, so threads are enough.
+"""
+
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+# pylint: disable=line-too-long
+# pylint: disable=broad-except
+
+import queue
+import threading
+
+import click
+
+
+# what to do when the queue is full:
+POLICIES = ["block", "drop-oldest", "spill"]
+
+
+class SaveQueue:
+    """
+    A bounded queue of save jobs, consumed by worker threads.
+    A job is any callable without arguments. It can come with a discard
+    callable, which undoes what was done when the job was queued (such
+    as the reserved file name and the index row) if the job is dropped
+    or fails.
+
+    workers:
+        int, number of worker threads.
+    depth:
+        int, maximum number of pending jobs.
+    policy:
+        what submit() does when the queue is full:
+        "block": waits for a free slot.
+        "drop-oldest": drops the oldest pending job, and runs its discard.
+        "spill": runs the spill callable of the job in the caller thread,
+            typically a cheaper save such as an uncompressed file.
+    """
+
+    def __init__(self, workers=2, depth=8, policy="block"):
+        if policy not in POLICIES:
+            raise ValueError("Unknown queue policy: " + str(policy))
+        self.policy = policy
+        self.jobs = queue.Queue(maxsize=max(1, depth))
+        self.threads = []
+        self.closed = False
+        self.metrics = None  # an optional shotmetrics.StageTimer
+        for i in range(max(1, workers)):
+            thread = threading.Thread(target=self._work, name=f"shotlast-writer-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _work(self):
+        while True:
+            item = self.jobs.get()
+            try:
+                if item is None:
+                    # sentinel, see close()
+                    return
+                job, discard = item
+                try:
+                    job()
+                except Exception:
+                    if discard is not None:
+                        discard()
+                    raise
+            except Exception as ex1:
+                if self.metrics is not None:
+                    self.metrics.increment("errors", stage="save_worker")
+                print(repr(ex1))
+            finally:
+                self.jobs.task_done()
+
+    def pending(self) -> int:
+        """
+        Returns the approximate number of jobs waiting in the queue.
+        """
+        return self.jobs.qsize()
+
+    def submit(self, job, spill=None, discard=None):
+        """
+        Queues the job.
+        spill: callable, used instead of job by the "spill" policy
+        when the queue is full. If it is None, job itself is run
+        in the caller thread.
+        discard: callable, run when the job fails, or instead of it
+        when the "drop-oldest" policy drops it.
+        """
+        if self.closed:
+            raise RuntimeError("SaveQueue is closed.")
+
+        item = (job, discard)
+        if self.policy == "block":
+            self.jobs.put(item)
+            return
+
+        try:
+            self.jobs.put_nowait(item)
+            return
+        except queue.Full:
+            pass
+
+        if self.policy == "spill":
+            click.secho("save queue is full, spilling to disk.", fg="red")
+            if self.metrics is not None:
+                self.metrics.increment("queue_spilled")
+            try:
+                (spill or job)()
+            except Exception:
+                if discard is not None:
+                    discard()
+                raise
+        else:
+            # drop-oldest
+            try:
+                _, dropped_discard = self.jobs.get_nowait()
+                self.jobs.task_done()
+                click.secho("save queue is full, dropped the oldest capture.", fg="red")
+                if self.metrics is not None:
+                    self.metrics.increment("queue_dropped")
+                if dropped_discard is not None:
+                    dropped_discard()
+            except queue.Empty:
+                pass
+            except Exception as ex1:
+                # the job is dropped anyway, only its leftovers remain.
+                print(repr(ex1))
+            self.jobs.put(item)
+
+    def close(self):
+        """
+        Waits for all the pending jobs, then stops the workers.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        pending = self.pending()
+        if pending:
+            click.secho(f"flushing {pending} pending saves...", fg="yellow")
+        self.jobs.join()
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+shotx11
+In-process X11 selection reader for shotlast, using ctypes and libX11.
+
+One display connection and one hidden window are kept open, and
+TARGETS, TIMESTAMP and the selection data are requested directly
+from the X server, instead of running xclip for every request.
+Large transfers with the INCR protocol are supported.
+
+requires:
+    libX11 and a running X server (or Xvfb).
+"""
+
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+# pylint: disable=line-too-long
+# pylint: disable=too-few-public-methods
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+
+# from X11/X.h
+_None = 0
+_CurrentTime = 0
+_AnyPropertyType = 0
+_PropertyChangeMask = 1 << 22
+_PropertyNotify = 28
+_SelectionNotify = 31
+_PropertyNewValue = 0
+_Success = 0
+
+
+class XSelectionEvent(ctypes.Structure):
+    _fields_ = [
+        ("type", ctypes.c_int),
+        ("serial", ctypes.c_ulong),
+        ("send_event", ctypes.c_int),
+        ("display", ctypes.c_void_p),
+        ("requestor", ctypes.c_ulong),
+        ("selection", ctypes.c_ulong),
+        ("target", ctypes.c_ulong),
+        ("property", ctypes.c_ulong),
+        ("time", ctypes.c_ulong),
+    ]
+
+
+class XPropertyEvent(ctypes.Structure):
+    _fields_ = [
+        ("type", ctypes.c_int),
+        ("serial", ctypes.c_ulong),
+        ("send_event", ctypes.c_int),
+        ("display", ctypes.c_void_p),
+        ("window", ctypes.c_ulong),
+        ("atom", ctypes.c_ulong),
+        ("time", ctypes.c_ulong),
+        ("state", ctypes.c_int),
+    ]
+
+
+class XEvent(ctypes.Union):
+    # XEvent is a union padded to 24 longs in Xlib.h.
+    _fields_ = [
+        ("type", ctypes.c_int),
+        ("xselection", XSelectionEvent),
+        ("xproperty", XPropertyEvent),
+        ("pad", ctypes.c_long * 24),
+    ]
+
+
+_XErrorHandler = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p)
+
+
+def load_library(name):
+    """
+    Returns a ctypes.CDLL of the given library name such as "X11",
+    or None if it can not be found.
+    """
+    path = ctypes.util.find_library(name)
+    if not path:
+        return None
+    try:
+        return ctypes.CDLL(path)
+    except OSError:
+        return None
+
+
+# True once XInitThreads() was called, see load_xlib().
+_threads_initialized = False
+
+
+def load_xlib():
+    """
+    Returns libX11 with the signatures used by shotlast set,
+    raises OSError if it is not available.
+    The reader and the watcher use their own displays from different
+    threads, so XInitThreads() is called once, before any XOpenDisplay().
+    """
+    global _threads_initialized  # pylint: disable=global-statement
+    xlib = load_library("X11")
+    if xlib is None:
+        raise OSError("libX11 could not be loaded.")
+    if not _threads_initialized:
+        xlib.XInitThreads()
+        _threads_initialized = True
+
+    xlib.XOpenDisplay.restype = ctypes.c_void_p
+    xlib.XOpenDisplay.argtypes = [ctypes.c_char_p]
+    xlib.XCloseDisplay.argtypes = [ctypes.c_void_p]
+    xlib.XDefaultRootWindow.restype = ctypes.c_ulong
+    xlib.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+    xlib.XConnectionNumber.argtypes = [ctypes.c_void_p]
+    xlib.XPending.argtypes = [ctypes.c_void_p]
+    xlib.XFlush.argtypes = [ctypes.c_void_p]
+    xlib.XNextEvent.argtypes = [ctypes.c_void_p, ctypes.POINTER(XEvent)]
+    xlib.XCheckTypedWindowEvent.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int, ctypes.POINTER(XEvent)]
+    xlib.XInternAtom.restype = ctypes.c_ulong
+    xlib.XInternAtom.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int]
+    xlib.XGetAtomName.restype = ctypes.c_void_p
+    xlib.XGetAtomName.argtypes = [ctypes.c_void_p, ctypes.c_ulong]
+    xlib.XFree.argtypes = [ctypes.c_void_p]
+    xlib.XCreateSimpleWindow.restype = ctypes.c_ulong
+    xlib.XCreateSimpleWindow.argtypes = [
+        ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int, ctypes.c_int,
+        ctypes.c_uint, ctypes.c_uint, ctypes.c_uint, ctypes.c_ulong, ctypes.c_ulong]
+    xlib.XDestroyWindow.argtypes = [ctypes.c_void_p, ctypes.c_ulong]
+    xlib.XSelectInput.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_long]
+    xlib.XGetSelectionOwner.restype = ctypes.c_ulong
+    xlib.XGetSelectionOwner.argtypes = [ctypes.c_void_p, ctypes.c_ulong]
+    xlib.XConvertSelection.argtypes = [
+        ctypes.c_void_p, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_ulong]
+    xlib.XDeleteProperty.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_ulong]
+    xlib.XGetWindowProperty.argtypes = [
+        ctypes.c_void_p, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_long, ctypes.c_long,
+        ctypes.c_int, ctypes.c_ulong,
+        ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.c_int),
+        ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.c_ulong),
+        ctypes.POINTER(ctypes.c_void_p)]
+    xlib.XSetErrorHandler.restype = ctypes.c_void_p
+    xlib.XSetErrorHandler.argtypes = [_XErrorHandler]
+    return xlib
+
+
+def _ignore_x_error(_display, _error_event):
+    # the default handler of Xlib exits the process,
+    # for example when a selection owner window disappears.
+    return 0
+
+
+# keep a reference, otherwise the callback is garbage collected.
+_x_error_handler = _XErrorHandler(_ignore_x_error)
+
+
+class X11SelectionReader:
+    """
+    Reads X selections (CLIPBOARD, PRIMARY...) through libX11.
+
+    timeout:
+        seconds to wait for the selection owner to answer a request.
+    """
+
+    # bytes asked per XGetWindowProperty call.
+    CHUNK_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, timeout=2.0):
+        self.xlib = load_xlib()
+        self.timeout = timeout
+        self.display = self.xlib.XOpenDisplay(None)
+        if not self.display:
+            raise OSError("Can not open X display: " + str(os.environ.get("DISPLAY")))
+        self.xlib.XSetErrorHandler(_x_error_handler)
+
+        root = self.xlib.XDefaultRootWindow(self.display)
+        self.window = self.xlib.XCreateSimpleWindow(self.display, root, 0, 0, 1, 1, 0, 0, 0)
+        # PropertyNotify events are needed for INCR transfers.
+        self.xlib.XSelectInput(self.display, self.window, _PropertyChangeMask)
+        self.fd = self.xlib.XConnectionNumber(self.display)
+        self.atoms = {}
+        self.atom_names = {}
+        self.property = self.atom("SHOTLAST_SELECTION")
+
+    def atom(self, name: str) -> int:
+        """
+        Returns the atom of the given name, such as "CLIPBOARD".
+        """
+        if name not in self.atoms:
+            atom = self.xlib.XInternAtom(self.display, name.encode("ascii"), 0)
+            self.atoms[name] = atom
+            self.atom_names[atom] = name
+        return self.atoms[name]
+
+    def atom_name(self, atom: int) -> str:
+        if atom not in self.atom_names:
+            pointer = self.xlib.XGetAtomName(self.display, atom)
+            if not pointer:
+                return ""
+            name = ctypes.string_at(pointer).decode("latin-1")
+            self.xlib.XFree(pointer)
+            self.atom_names[atom] = name
+            self.atoms[name] = atom
+        return self.atom_names[atom]
+
+    def get_owner(self, selection="CLIPBOARD") -> int:
+        """
+        Returns the window id of the selection owner, 0 if there is none.
+        This does not involve the owner, only the X server, so it is cheap.
+        """
+        return self.xlib.XGetSelectionOwner(self.display, self.atom(selection))
+
+    def _wait_for_event(self, event_type, event, deadline) -> bool:
+        while not self.xlib.XCheckTypedWindowEvent(self.display, self.window, event_type, ctypes.byref(event)):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            select.select([self.fd], [], [], remaining)
+        return True
+
+    def _get_property(self, delete=True):
+        """
+        Returns (type atom, format, data bytes) of our property.
+        """
+        chunks = []
+        offset = 0
+        actual_type = ctypes.c_ulong()
+        actual_format = ctypes.c_int()
+        nitems = ctypes.c_ulong()
+        bytes_after = ctypes.c_ulong()
+        data = ctypes.c_void_p()
+        while True:
+            status = self.xlib.XGetWindowProperty(
+                self.display, self.window, self.property,
+                offset, self.CHUNK_SIZE // 4, False, _AnyPropertyType,
+                ctypes.byref(actual_type), ctypes.byref(actual_format),
+                ctypes.byref(nitems), ctypes.byref(bytes_after), ctypes.byref(data))
+            if status != _Success:
+                break
+            if data.value:
+                # format 32 items are C longs in Xlib, whatever their size is.
+                item_size = {8: 1, 16: ctypes.sizeof(ctypes.c_short), 32: ctypes.sizeof(ctypes.c_long)}.get(actual_format.value, 1)
+                chunk = ctypes.string_at(data.value, nitems.value * item_size)
+                self.xlib.XFree(data)
+                chunks.append(chunk)
+                # offset is in 32-bit units of the protocol.
+                offset += nitems.value * actual_format.value // 32
+            if not bytes_after.value:
+                break
+        if delete:
+            self.xlib.XDeleteProperty(self.display, self.window, self.property)
+            self.xlib.XFlush(self.display)
+        return actual_type.value, actual_format.value, b"".join(chunks)
+
+    def _iter_incr(self, deadline):
+        """
+        Yields the chunks of a selection sent with the INCR protocol:
+        the owner writes the property again and again, every time we
+        delete it, and a zero length chunk ends the transfer.
+        """
+        event = XEvent()
+        while True:
+            if not self._wait_for_event(_PropertyNotify, event, deadline):
+                raise TimeoutError("INCR transfer timed out.")
+            if event.xproperty.atom != self.property or event.xproperty.state != _PropertyNewValue:
+                continue
+            _, _, chunk = self._get_property(delete=True)
+            if not chunk:
+                return
+            yield chunk
+            # every chunk gives the owner more time.
+            deadline = time.monotonic() + self.timeout
+
+    def _request(self, selection: str, target: str):
+        """
+        Asks the owner of the selection to convert it to target.
+        Returns (type name, format, data bytes, deadline).
+        If type name is "INCR", the data follows in chunks, see _iter_incr().
+        """
+        event = XEvent()
+        # drop the stale PropertyNotify events of the previous transfers.
+        while self.xlib.XCheckTypedWindowEvent(self.display, self.window, _PropertyNotify, ctypes.byref(event)):
+            pass
+        self.xlib.XDeleteProperty(self.display, self.window, self.property)
+        self.xlib.XConvertSelection(
+            self.display, self.atom(selection), self.atom(target),
+            self.property, self.window, _CurrentTime)
+        self.xlib.XFlush(self.display)
+
+        deadline = time.monotonic() + self.timeout
+        selection_atom, target_atom = self.atom(selection), self.atom(target)
+        while True:
+            if not self._wait_for_event(_SelectionNotify, event, deadline):
+                return "", 0, b"", deadline
+            # a late answer to an earlier request (which timed out) names
+            # another target or selection: it is not ours, wait on.
+            reply = event.xselection
+            if reply.selection == selection_atom and reply.target == target_atom and reply.property in (self.property, _None):
+                break
+        if event.xselection.property == _None:
+            # the owner refused the conversion.
+            return "", 0, b"", deadline
+
+        # the owner wrote the property before sending SelectionNotify,
+        # drop that PropertyNotify so an INCR transfer starts clean.
+        while self.xlib.XCheckTypedWindowEvent(self.display, self.window, _PropertyNotify, ctypes.byref(event)):
+            pass
+        type_atom, data_format, data = self._get_property(delete=True)
+        return self.atom_name(type_atom), data_format, data, deadline
+
+    def convert(self, selection: str, target: str):
+        """
+        Asks the owner of the selection to convert it to target.
+        Returns (type name, format, data bytes).
+        data is b"" if there is no owner or the conversion is refused.
+        """
+        type_name, data_format, data, deadline = self._request(selection, target)
+        if type_name == "INCR":
+            data = b"".join(self._iter_incr(deadline))
+        return type_name, data_format, data
+
+    def iter_read(self, selection: str, target: str):
+        """
+        Like read(), but yields the data in chunks as they arrive,
+        so a large INCR transfer is never held in memory at once.
+        """
+        type_name, _, data, deadline = self._request(selection, target)
+        if type_name == "INCR":
+            yield from self._iter_incr(deadline)
+        elif data:
+            yield data
+
+    def get_targets(self, selection="CLIPBOARD"):
+        """
+        Returns the names of the targets (formats) offered by the owner,
+        such as ["TARGETS", "image/png", ...].
+        """
+        _, data_format, data = self.convert(selection, "TARGETS")
+        if data_format != 32 or not data:
+            return []
+        count = len(data) // ctypes.sizeof(ctypes.c_ulong)
+        atoms = (ctypes.c_ulong * count).from_buffer_copy(data)
+        return [self.atom_name(atom) for atom in atoms]
+
+    def get_timestamp(self, selection="CLIPBOARD") -> bytes:
+        """
+        Returns the TIMESTAMP target of the selection as bytes,
+        b"" if it is not available, or if it is 0 (CurrentTime):
+        such an owner does not tell when it took the selection.
+        """
+        _, data_format, data = self.convert(selection, "TIMESTAMP")
+        if data_format != 32 or not data:
+            return b""
+        value = ctypes.c_ulong.from_buffer_copy(data[:ctypes.sizeof(ctypes.c_ulong)]).value
+        if not value & 0xFFFFFFFF:
+            return b""
+        return struct.pack("<I", value & 0xFFFFFFFF)
+
+    def read(self, selection: str, target: str) -> bytes:
+        """
+        Returns the selection converted to target, such as "image/png".
+        """
+        _, _, data = self.convert(selection, target)
+        return data
+
+    def close(self):
+        if self.display:
+            self.xlib.XDestroyWindow(self.display, self.window)
+            self.xlib.XCloseDisplay(self.display)
+            self.display = None
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+Tests of the clipboard watchers: the XFixes watcher against Xvfb (see
+conftest.py), and the fallback to polling without a display.
+
+    py.test shotlast
+"""
+
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+# pylint: disable=line-too-long
+# pylint: disable=redefined-outer-name
+
+import sys
+import threading
+import time
+
+import pytest
+
+import shotwatch
+
+
+linux_only = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="XFixes is only used on Linux.")
+
+
+@pytest.fixture
+def watcher(xvfb):  # pylint: disable=unused-argument
+    watcher = shotwatch.XFixesWatcher(("CLIPBOARD", "PRIMARY"))
+    yield watcher
+    watcher.close()
+
+
+@linux_only
+def test_xfixes_times_out(watcher):
+    start = time.monotonic()
+    assert not watcher.wait(0.2)
+    assert time.monotonic() - start >= 0.2
+
+
+@linux_only
+def test_xfixes_wakes_up(selection_owner, watcher):
+    # wait() blocks in select() on another thread, as with shotasync.
+    woken = []
+    thread = threading.Thread(target=lambda: woken.append(watcher.wait(10)))
+    thread.start()
+    time.sleep(0.2)
+    start = time.monotonic()
+    selection_owner.own({"text/plain": b"hello"})
+    thread.join(10)
+    assert woken == [True]
+    assert time.monotonic() - start < 2
+    # the event was read, there is nothing new.
+    assert not watcher.wait(0.1)
+
+
+@linux_only
+def test_xfixes_watches_every_selection(selection_owner, watcher):
+    selection_owner.own({"text/plain": b"hello"}, selection="PRIMARY")
+    assert watcher.wait(5)
+    # a selection that is not watched does not wake it up.
+    selection_owner.own({"text/plain": b"hello"}, selection="SECONDARY")
+    assert not watcher.wait(0.3)
+
+
+@linux_only
+def test_fallback_without_display(monkeypatch):
+    monkeypatch.delenv("DISPLAY", raising=False)
+    with pytest.raises(OSError):
+        shotwatch.XFixesWatcher()
+    with pytest.raises(OSError):
+        shotwatch.create_watcher("event")
+    watcher = shotwatch.create_watcher("auto", period=2.0, min_period=0.1)
+    assert isinstance(watcher, shotwatch.AdaptivePollingWatcher)
+    assert watcher.period == 2.0
+    watcher.close()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+Tests of the libX11 selection reader and the x11 backend against Xvfb,
+see conftest.py. They are skipped without Xvfb.
+
+    py.test shotlast
+"""
+
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+# pylint: disable=line-too-long
+# pylint: disable=redefined-outer-name
+
+import io
+import os
+import struct
+
+import pytest
+
+
+def _png(width, height):
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    # noise does not compress, so the size of the PNG is about width * height * 3.
+    image = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def reader(xvfb):  # pylint: disable=unused-argument
+    import shotx11  # pylint: disable=import-outside-toplevel
+
+    reader = shotx11.X11SelectionReader()
+    yield reader
+    reader.close()
+
+
+def test_targets_and_timestamp(selection_owner, reader):
+    selection_owner.own({"image/png": _png(16, 16)}, timestamp=4242)
+    assert reader.get_owner() == selection_owner.window
+    assert reader.get_targets() == ["TARGETS", "TIMESTAMP", "image/png"]
+    assert reader.get_timestamp() == struct.pack("<I", 4242)
+
+
+def test_zero_timestamp(selection_owner, reader):
+    # such an owner does not tell when it took the selection.
+    selection_owner.own({"image/png": _png(16, 16)}, timestamp=0)
+    assert reader.get_timestamp() == b""
+
+
+def test_no_owner(xvfb, reader):  # pylint: disable=unused-argument
+    assert reader.get_owner("SECONDARY") == 0
+    assert reader.get_targets("SECONDARY") == []
+    assert reader.read("SECONDARY", "image/png") == b""
+
+
+def test_read_image(selection_owner, reader):
+    content = _png(64, 64)
+    selection_owner.own({"image/png": content})
+    assert len(content) < selection_owner.incr_size
+    assert reader.read("CLIPBOARD", "image/png") == content
+    # a refused target gives no data, and the next request still works.
+    assert reader.read("CLIPBOARD", "image/bmp") == b""
+    assert reader.read("CLIPBOARD", "image/png") == content
+
+
+def test_incr(selection_owner, reader):
+    content = _png(600, 600)
+    selection_owner.own({"image/png": content})
+    assert len(content) > 4 * selection_owner.incr_size
+    type_name, _, _, deadline = reader._request("CLIPBOARD", "image/png")  # pylint: disable=protected-access
+    assert type_name == "INCR"
+    assert b"".join(reader._iter_incr(deadline)) == content  # pylint: disable=protected-access
+    assert reader.read("CLIPBOARD", "image/png") == content
+    chunks = list(reader.iter_read("CLIPBOARD", "image/png"))
+    assert len(chunks) > 1
+    assert b"".join(chunks) == content
+
+
+def test_backend(selection_owner, reader):
+    import shotbackends  # pylint: disable=import-outside-toplevel
+
+    content = _png(32, 32)
+    selection_owner.own({"image/png": content}, timestamp=100)
+    backend = shotbackends.X11Backend(reader=reader)
+    token = backend.change_token()
+    assert token == (selection_owner.window, struct.pack("<I", 100))
+    assert backend.list_formats() == ["TARGETS", "TIMESTAMP", "image/png"]
+    assert backend.read_image_data("image/png") == content
+    # a new copy changes the token.
+    selection_owner.own({"image/png": content}, timestamp=200)
+    assert backend.change_token() != token